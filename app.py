@@ -1,7 +1,25 @@
-from flask import Flask, request, jsonify
-# from keybert import KeyBERT
-import numpy as np
-from random import randint
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+import atexit
+import codecs
+import json
+import os
+import pickle
+import re
+import sys
+import time
+from itertools import islice
+from array import array
+from collections import OrderedDict, namedtuple
+from hashlib import blake2b
+from random import Random, random
+from secrets import token_urlsafe
+from sys import intern
+from threading import Event, Lock, RLock, Thread
+from types import MappingProxyType
+
+# NumPy and this service's own modules (keywords, metrics, recommend, results, score_table, sessions, wire, articles)
+# are imported by the functions that use them, and the stores and tables built from them are only built on first use
+# (see LazyGlobal), so importing the app only costs Flask.  The warm-up pays for the rest before the first request.
 
 """
 flask=2.2.2
@@ -21,129 +39,961 @@ Below is a list of the possible pages the Quiz Feedback will tell you to visit:
 app = Flask(__name__)
 
 
-# @app.route('/get_keywords', methods=["POST"])
-# def keywords_GET():
-#     text = request.json['text']
-#     try:
-#         max_keywords = request.json['max_keywords']
-#     except:
-#         max_keywords = None
-#     # Processong on text
-#     keywords = generate_keywords(text, max_keywords)
-
-#     return jsonify(keywords)
-
-
-# @app.route('/get_keywords/<string:text>', methods=["GET"])
-# def keywords_POST(text):
-#     keywords = generate_keywords(text)
-
-#     return jsonify(keywords)
-
-
-# def generate_keywords(text, max_keywords=None):
-#     """
-#     Arguments:
-#             docs: The document(s) for which to extract keywords/keyphrases
-#             candidates: Candidate keywords/keyphrases to use instead of extracting them from the document(s)
-#                         NOTE: This is not used if you passed a `vectorizer`.
-#             keyphrase_ngram_range: Length, in words, of the extracted keywords/keyphrases.
-#                                    NOTE: This is not used if you passed a `vectorizer`.
-#             stop_words: Stopwords to remove from the document.
-#                         NOTE: This is not used if you passed a `vectorizer`.
-#             top_n: Return the top n keywords/keyphrases
-#             min_df: Minimum document frequency of a word across all documents
-#                     if keywords for multiple documents need to be extracted.
-#                     NOTE: This is not used if you passed a `vectorizer`.
-#             use_maxsum: Whether to use Max Sum Distance for the selection
-#                         of keywords/keyphrases.
-#             use_mmr: Whether to use Maximal Marginal Relevance (MMR) for the
-#                      selection of keywords/keyphrases.
-#             diversity: The diversity of the results between 0 and 1 if `use_mmr`
-#                        is set to True.
-#             nr_candidates: The number of candidates to consider if `use_maxsum` is
-#                            set to True.
-#             vectorizer: Pass in your own `CountVectorizer` from
-#                         `sklearn.feature_extraction.text.CountVectorizer`
-#             highlight: Whether to print the document and highlight its keywords/keyphrases.
-#                        NOTE: This does not work if multiple documents are passed.
-#             seed_keywords: Seed keywords that may guide the extraction of keywords by
-#                            steering the similarities towards the seeded keywords.
-#             doc_embeddings: The embeddings of each document.
-#             word_embeddings: The embeddings of each potential keyword/keyphrase across
-#                              across the vocabulary of the set of input documents.
-#                              NOTE: The `word_embeddings` should be generated through
-#                              `.extract_embeddings` as the order of these embeddings depend
-#                              on the vectorizer that was used to generate its vocabulary.
-#     """
-#     if max_keywords:
-#         return kw_model.extract_keywords(docs=[text], keyphrase_ngram_range=(1, max_keywords), top_n=30)
-#     return kw_model.extract_keywords(docs=[text], keyphrase_ngram_range=(1, len(text)), top_n=30)
+@app.route('/get_keywords', methods=["POST"])
+def keywords_GET():
+    try:
+        payload = request.json
+    except Exception as e:
+        payload = e
+
+    return jsonify(keywords_result(payload))
+
+
+@app.route('/get_keywords/<string:text>', methods=["GET"])
+def keywords_POST(text):
+    return jsonify(keywords_result({"text": text}))
+
+
+def keywords_result(payload):
+    """
+    The top keywords of payload["text"] as [keyword, score] pairs, or an error.  "max_keywords" is the longest
+    keyword, in words, and "top_n" how many keywords to return.
+    """
+    from keywords import TOP_N
+
+    try:
+        if isinstance(payload, Exception):
+            raise SubmissionError("invalid_json", str(payload))
+        if type(payload) is not dict:
+            raise SubmissionError("invalid_payload", "The payload should be a JSON object.")
+
+        text = payload.get("text")
+        if type(text) is not str:
+            raise SubmissionError("missing_field", "'text'", "text")
+        if len(text) > MAX_KEYWORD_TEXT_LENGTH:
+            raise SubmissionError("text_too_long", f"The text can be at most {MAX_KEYWORD_TEXT_LENGTH} characters.",
+                                  "text")
+        max_keywords = payload.get("max_keywords")
+        if max_keywords is not None and (type(max_keywords) is not int or max_keywords < 1):
+            raise SubmissionError("invalid_max_keywords", "max_keywords should be a positive integer.", "max_keywords")
+        top_n = payload.get("top_n", TOP_N)
+        if type(top_n) is not int or not 0 < top_n <= MAX_KEYWORD_TOP_N:
+            raise SubmissionError("invalid_top_n", f"top_n should be an integer from 1 to {MAX_KEYWORD_TOP_N}.",
+                                  "top_n")
+    except SubmissionError as e:
+        METRICS.inc("quiz_errors_total", (("code", e.code),))
+        return {"Error": str(e), "Message": KEYWORDS_ERROR_MESSAGE, "Code": e.code}
+
+    with METRICS.time(STAGE_METRIC, KEYWORDS_STAGE):
+        return generate_keywords(text, max_keywords, top_n)
+
+
+def generate_keywords(text, max_keywords=None, top_n=None):
+    """
+    Keywords of up to max_keywords words (or MAX_NGRAM when it is None), best first, top_n of them (or TOP_N).
+    Results are cached by the hash of the text, and texts from concurrent requests are extracted together.
+    """
+    from keywords import MAX_NGRAM, TOP_N, text_key
+
+    if top_n is None:
+        top_n = TOP_N
+    max_ngram = min(max_keywords or MAX_NGRAM, MAX_NGRAM)
+    key = text_key(text, max_ngram, top_n)
+    keywords = KEYWORD_CACHE.get(KEYWORD_EXTRACTOR.fingerprint, key)
+    if keywords is None:
+        keywords = KEYWORD_BATCHER.submit((text, max_ngram, top_n)).result()
+        KEYWORD_CACHE.put(KEYWORD_EXTRACTOR.fingerprint, key, keywords)
+    return keywords
+
+
+def extract_keyword_batch(items):
+    texts, max_ngrams, top_ns = zip(*items)
+    results = KEYWORD_EXTRACTOR.extract(texts, max_ngrams, max(top_ns))
+    return [keywords[:top_n] for keywords, top_n in zip(results, top_ns)]
+
+
+N_QUESTIONS = 8
+
+PAYLOAD_ERROR_MESSAGE = "There is an issue with the payload/input JSON file from your end.  The json file should have a 'q' and an 'a' parameter for each question, usually 16 parameters: 'q1' to 'q8', then 'a1' to 'a8'.  The q's represent the QID (from the Quiz Google Doc), where the a's represent the answer the user gave as an integer (indexed from zero)."
+DUPLICATE_QUESTION_MESSAGE = "The quiz feedback does not work if we have duplicate questions.  Please check that all questions are unique, and we did not ask the same question twice."
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_BATCH_SIZE = 256
+# Strings (so brackets inside them are skipped), an unterminated string, and the punctuation that nests or separates
+# array items
+JSON_ITEM_TOKENS = re.compile(r'"(?:[^"\\]|\\.)*"|"|[\[\]{},]')
+# Written by `python score_table.py build quiz_scores.bin`
+SCORE_TABLE_PATH = os.environ.get("QUIZ_SCORE_TABLE", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                    "quiz_scores.bin"))
+# The bank is read from this file when it's set, otherwise create_question_bank() is used
+QUESTION_BANK_PATH = os.environ.get("QUESTION_BANK")
+BANK_CACHE_DIR = os.environ.get("QUESTION_BANK_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                    ".bank_cache"))
+# How often, in seconds, the QUESTION_BANK file is checked for changes.  0 turns reloading off.
+QUESTION_BANK_RELOAD_INTERVAL = float(os.environ.get("QUESTION_BANK_RELOAD_INTERVAL", 5))
+MAX_QUIZ_QUESTIONS = 100
+# "local", or "sqlite:///path/to/sessions.db" to share sessions between workers
+SESSION_STORE_URL = os.environ.get("SESSION_STORE", "local")
+# Sessions are forgotten this many seconds after their last answer
+SESSION_TTL = float(os.environ.get("SESSION_TTL", 3600))
+# The most sessions a "local" store keeps in each worker, dropping the least recently used ones
+MAX_LOCAL_SESSIONS = int(os.environ.get("MAX_LOCAL_SESSIONS", 100_000))
+# Scored quizzes are stored here for /analytics.  Every worker writes its own shards and reads everyone else's, so
+# /analytics covers all workers (up to a minute behind) and survives restarts.  Set QUIZ_RESULTS_DIR to an empty
+# string to only aggregate in memory, in which case each worker answers from its own quizzes until it restarts.
+RESULTS_DIR = os.environ.get("QUIZ_RESULTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                              ".quiz_results")) or None
+MAX_COHORT_LENGTH = 100
+# Cohort names are letters, digits, spaces and _ . : / @ -
+COHORT_PATTERN = re.compile(r"[\w .:/@-]*")
+# The most cohorts quizzes are recorded under.  Quizzes for a new cohort are refused past this
+MAX_COHORTS = int(os.environ.get("MAX_COHORTS", 1000))
+# Set METRICS_PROFILING=1 to allow sampling profiles to be started through /metrics/profile
+METRICS_PROFILING = os.environ.get("METRICS_PROFILING", "").lower() in ("1", "true", "yes")
+METRICS_PROFILE_DIR = os.environ.get("METRICS_PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                         ".profiles"))
+MAX_PROFILE_SECONDS = 300
+# The compiled startup bank is pickled here and loaded directly on later boots, or never when it is set to "".  It
+# defaults to the user's cache directory, outside the app, so a build never packages one
+SNAPSHOT_PATH = os.environ.get("QUIZ_SNAPSHOT", os.path.join(os.environ.get("XDG_CACHE_HOME") or
+                                                             os.path.expanduser(os.path.join("~", ".cache")),
+                                                             "quiz-feedback", "quiz_snapshot.pickle"))
+SNAPSHOT_FORMAT = 1
+# Word embeddings for keyword extraction, used only if the file exists
+KEYWORD_MODEL_PATH = os.environ.get("KEYWORD_MODEL", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                  "keyword_model.npz"))
+KEYWORD_CACHE_SIZE = 4096
+KEYWORD_BATCH_SIZE = 64
+MAX_KEYWORD_TEXT_LENGTH = 200_000
+MAX_KEYWORD_TOP_N = 100
+MAX_ARTICLE_LENGTH = 200_000
+ARTICLE_ERROR_MESSAGE = "The json file should have a 'text' parameter with the article to check, and optionally its 'headline'.  Without a headline, the first line of a multi-line text is used."
+KEYWORDS_ERROR_MESSAGE = "The json file should have a 'text' parameter with the article to extract keywords from, and optionally 'max_keywords' (the most words in a keyword) and 'top_n' (how many keywords to return)."
+WIRE_ERROR_MESSAGE = "Binary submission bodies start with a header naming the current phrase table, from GET /phrase_table, followed by the submission records.  See wire.py for the format."
+PHRASE_TABLE_MAX_AGE = 300
+# A .npz file of historical learners ("scores" and "pages" arrays) loaded into the recommendation pool at startup
+RECOMMENDER_POOL_PATH = os.environ.get("RECOMMENDER_POOL")
+RECOMMENDATIONS_ERROR_MESSAGE = "The json file should have either the same 'q' and 'a' parameters as /quiz_feedback, or a 'scores' parameter with one score per learning outcome, and optionally 'top_k' (how many pages to return, all of them by default)."
+ENGAGEMENT_ERROR_MESSAGE = "The json file should have a 'page' parameter naming the site page the learner engaged with, and either the same 'q' and 'a' parameters as /quiz_feedback, or a 'scores' parameter with one score per learning outcome."
+BATCH_ERROR_MESSAGE = "The batch should be a JSON array of quiz payloads (or an object with a 'submissions' array), or one JSON payload per line with the application/x-ndjson content type."
+
+
+@app.before_request
+def watch_question_bank():
+    g.request_start = time.perf_counter()
+    BANK_REGISTRY.ensure_watching(QUESTION_BANK_RELOAD_INTERVAL)
+    WARMUP.ensure_started()
+
+
+@app.route('/ready', methods=["GET"])
+def readiness():
+    """
+    Readiness probe: 200 once this worker has warmed up, 503 until then.
+    """
+    if not WARMUP.ready.is_set():
+        return jsonify({"Ready": False, "Error": WARMUP.error}), 503
+    return jsonify({"Ready": True, "Warmup Seconds": WARMUP.seconds})
+
+
+@app.after_request
+def add_bank_version(response):
+    if "bank_version" in g:
+        response.headers["X-Question-Bank-Version"] = str(g.bank_version.version)
+    return response
+
+
+@app.after_request
+def count_request(response):
+    endpoint = request.endpoint or "not_found"
+    METRICS.inc("quiz_requests_total", (("endpoint", endpoint), ("status", response.status_code)))
+    if "request_start" in g:
+        METRICS.observe("quiz_request_duration_seconds", (("endpoint", endpoint),),
+                        time.perf_counter() - g.request_start)
+    return response
 
 
 @app.route('/quiz_feedback', methods=["POST"])
 def get_quiz_feedback():
-    try:
-        q = []
-        a = []
+    from wire import SUBMISSION_TYPE
+
+    # The whole request is served from this version, even if a new one is swapped in meanwhile
+    with METRICS.time(STAGE_METRIC, BANK_STAGE):
+        version = g.bank_version = BANK_REGISTRY.current()
+
+    if request.mimetype == SUBMISSION_TYPE:
+        return wire_feedback_response(request, version)
+
+    with METRICS.time(STAGE_METRIC, PARSE_STAGE):
+        try:
+            payload = request.json
+        except Exception as e:
+            payload = e
+
+    result = quiz_feedback_result(payload, version)
+    with METRICS.time(STAGE_METRIC, SERIALIZE_STAGE):
+        return jsonify(result)
+
 
-        N_QUESTIONS = 8
-        for i in range(1, N_QUESTIONS + 1):
-            q.append(request.json[f"q{i}"])
-            a.append(request.json[f"a{i}"])
+@app.route('/quiz_feedback/batch', methods=["POST"])
+def get_batch_quiz_feedback():
+    from wire import SUBMISSION_TYPE
 
+    version = g.bank_version = BANK_REGISTRY.current()
+
+    try:
+        # Seeds every quiz in the batch that doesn't set its own seed
+        seed = read_batch_seed(request.args.get("seed"))
     except Exception as e:
+        METRICS.inc("quiz_errors_total", (("code", "invalid_batch"),))
         return jsonify({"Error": str(e),
-                        "Message": "There is an issue with the payload/input JSON file from your end.  The json file should have 16 parameters.  The first eight are 'q1' to 'q8', then there's 'a1' to 'a8'.  The q's represent the QID (from the Quiz Google Doc), where the a's represent the answer the user gave as an integer (indexed from zero)."})
+                        "Message": BATCH_ERROR_MESSAGE})
+
+    if request.mimetype == SUBMISSION_TYPE:
+        return wire_feedback_response(request, version, seed, stream=wants_stream(request))
+
+    if wants_stream(request):
+        # One JSON line per scored quiz, written as the request body is read
+        lines = stream_batch_quiz_feedback(iter_batch_payload(request), version.compiled, seed=seed,
+                                           results=RESULT_STORE)
+        return Response(stream_with_context(lines), mimetype="application/x-ndjson")
 
     try:
-        assert len(q) == len(
-            set(q)), "The quiz feedback does not work if we have duplicate questions.  Please check that all questions are unique, and we did not ask the same question twice."
+        payloads = read_batch_payload(request)
     except Exception as e:
+        METRICS.inc("quiz_errors_total", (("code", "invalid_batch"),))
         return jsonify({"Error": str(e),
-                        "Message": "Please check error message."})
+                        "Message": BATCH_ERROR_MESSAGE})
+
+    results = get_batch_quiz_feedback(payloads, version.compiled, seed=seed, results=RESULT_STORE)
+    with METRICS.time(STAGE_METRIC, SERIALIZE_STAGE):
+        return jsonify(results)
+
+
+@app.route('/phrase_table', methods=["GET"])
+def get_phrase_table():
+    """
+    The question indices, phrase tables and error codes that binary requests and responses refer to.  The response is
+    cacheable: its ETag is the table's version, and a client that already has it gets a 304.
+    """
+    version = g.bank_version = BANK_REGISTRY.current()
+    table = wire_table(version.compiled)
+    response = jsonify(table.document)
+    response.set_etag(table.version)
+    response.cache_control.public = True
+    response.cache_control.max_age = PHRASE_TABLE_MAX_AGE
+    return response.make_conditional(request)
+
+
+@app.route('/recommendations', methods=["POST"])
+def get_recommendations():
+    version = g.bank_version = BANK_REGISTRY.current()
 
     try:
-        feedback, page_to_visit = get_quiz_feedback(q, a)
+        payload = request.json
     except Exception as e:
+        payload = e
+
+    return jsonify(recommendations_result(payload, version))
+
+
+@app.route('/engagement', methods=["POST"])
+def post_engagement():
+    """
+    Records that a learner opened a site page, so the pages recommended and suggested from then on learn from it.
+    """
+    version = g.bank_version = BANK_REGISTRY.current()
+
+    try:
+        payload = request.json
+    except Exception as e:
+        payload = e
+
+    return jsonify(engagement_result(payload, version))
+
+
+def wire_feedback_response(req, version: "BankVersion", seed=None, stream=False):
+    """
+    The response to a binary /quiz_feedback or /quiz_feedback/batch request.  A body that can't be read at all gets
+    the usual JSON error.
+    """
+    from wire import FEEDBACK_TYPE, WireFormatError
+
+    table = wire_table(version.compiled)
+    try:
+        with METRICS.time(STAGE_METRIC, PARSE_STAGE):
+            records = table.read_submissions(iter(lambda: req.stream.read(STREAM_CHUNK_SIZE), b""))
+            if not stream:
+                records = list(records)
+    except WireFormatError as e:
+        METRICS.inc("quiz_errors_total", (("code", e.code),))
+        return jsonify({"Error": str(e), "Message": WIRE_ERROR_MESSAGE, "Code": e.code})
+
+    if stream:
+        chunks = stream_wire_quiz_feedback(records, version.compiled, seed=seed, results=RESULT_STORE)
+        return Response(stream_with_context(chunks), mimetype=FEEDBACK_TYPE)
+    body = table.header + get_wire_quiz_feedback(records, version.compiled, seed=seed, results=RESULT_STORE)
+    return Response(body, mimetype=FEEDBACK_TYPE)
+
+
+@app.route('/quiz_questions', methods=["POST"])
+def get_quiz_questions():
+    version = g.bank_version = BANK_REGISTRY.current()
+
+    try:
+        payload = request.json
+    except Exception as e:
+        payload = e
+
+    return jsonify(quiz_questions_result(payload, version))
+
+
+@app.route('/article_score', methods=["POST"])
+def get_article_score():
+    try:
+        payload = request.json
+    except Exception as e:
+        payload = e
+
+    return jsonify(article_score_results([payload])[0])
+
+
+@app.route('/article_score/batch', methods=["POST"])
+def get_batch_article_score():
+    try:
+        payloads = read_batch_payload(request)
+    except Exception as e:
+        METRICS.inc("quiz_errors_total", (("code", "invalid_batch"),))
         return jsonify({"Error": str(e),
-                        "Message": "An error has occurred within the Python code."})
+                        "Message": BATCH_ERROR_MESSAGE})
+
+    return jsonify(article_score_results(payloads))
+
+
+def article_score_results(payloads):
+    """
+    Scores each article payload for fake news red flags.  Invalid payloads get an error result in their place.
+    The feature extraction and scoring is shared by every valid article, see articles.py.
+    """
+    results = [None] * len(payloads)
+    valid = []
+    articles = []
+    for i, payload in enumerate(payloads):
+        try:
+            articles.append(read_article(payload))
+            valid.append(i)
+        except SubmissionError as e:
+            METRICS.inc("quiz_errors_total", (("code", e.code),))
+            results[i] = {"Error": str(e), "Message": ARTICLE_ERROR_MESSAGE, "Code": e.code}
+
+    if articles:
+        # Imported on first use, since compiling its lexicons takes longer than the rest of startup
+        from articles import article_results
+
+        with METRICS.time(STAGE_METRIC, ARTICLES_STAGE):
+            scored = article_results(articles)
+        for i, result in zip(valid, scored):
+            results[i] = {"Score": result["score"],
+                          "Learning Outcomes": dict(zip(LEARNING_OUTCOMES, result["outcomes"])),
+                          "Red Flags": result["red_flags"]}
+    return results
+
+
+def read_article(payload):
+    from articles import split_article
+
+    if isinstance(payload, Exception):
+        raise SubmissionError("invalid_json", str(payload))
+    if type(payload) is not dict:
+        raise SubmissionError("invalid_payload", "The payload should be a JSON object.")
+    text = payload.get("text")
+    if type(text) is not str:
+        raise SubmissionError("missing_field", "'text'", "text")
+    headline = payload.get("headline")
+    if headline is not None and type(headline) is not str:
+        raise SubmissionError("invalid_headline", "The headline should be a string.", "headline")
+    if len(text) + len(headline or "") > MAX_ARTICLE_LENGTH:
+        raise SubmissionError("text_too_long", f"The article can be at most {MAX_ARTICLE_LENGTH} characters.", "text")
+    return split_article(text, headline)
+
+
+@app.route('/metrics', methods=["GET"])
+def get_metrics():
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/metrics/profile', methods=["POST"])
+def start_profile():
+    """
+    Samples the stacks of every thread in this worker for ?seconds= and writes them to a flamegraph-compatible file.
+    """
+    if not METRICS_PROFILING:
+        return jsonify({"Error": "Profiling is disabled",
+                        "Message": "Set METRICS_PROFILING=1 to allow sampling profiles.",
+                        "Code": "profiling_disabled"})
+    try:
+        seconds = float(request.args.get("seconds", 10))
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            raise ValueError
+    except ValueError:
+        return jsonify({"Error": f"Invalid seconds: {request.args.get('seconds')}",
+                        "Message": f"seconds should be a number from 0 to {MAX_PROFILE_SECONDS}.",
+                        "Code": "invalid_seconds"})
 
-    return jsonify({"Feedback": feedback, "Suggested Page": page_to_visit})
+    path = PROFILER.start(seconds)
+    if path is None:
+        return jsonify({"Error": "A profile is already running",
+                        "Message": f"Wait for {PROFILER.running()} to be written.",
+                        "Code": "profile_running"})
+    return jsonify({"Profile": path, "Seconds": seconds})
+
+
+@app.route('/analytics', methods=["GET"])
+def get_analytics():
+    return jsonify(analytics_result(request.args.get("cohort")))
+
+
+@app.route('/sessions', methods=["POST"])
+def create_quiz_session():
+    from sessions import Session
+
+    version = g.bank_version = BANK_REGISTRY.current()
+    SESSION_STORE.evict_expired()
+
+    session_id = token_urlsafe(16)
+    session = Session(version.compiled.fingerprint, len(learning_outcomes))
+    SESSION_STORE.put(session_id, SESSION_STORE.encode(session))
+    return jsonify(session_state(session_id, session))
+
+
+@app.route('/sessions/<session_id>', methods=["GET"])
+def get_quiz_session(session_id):
+    version = g.bank_version = BANK_REGISTRY.current()
+
+    data = SESSION_STORE.get(session_id)
+    if data is None:
+        return jsonify(unknown_session_result(session_id))
+    try:
+        seed = read_batch_seed(request.args.get("seed"))
+    except ValueError as e:
+        return jsonify(submission_error_result(SubmissionError("invalid_seed", str(e), "seed")))
+    try:
+        session = read_session(data, version.compiled)
+    except SubmissionError as e:
+        return jsonify(submission_error_result(e))
+    return jsonify(session_state(session_id, session, seed))
+
+
+@app.route('/sessions/<session_id>', methods=["DELETE"])
+def delete_quiz_session(session_id):
+    if not SESSION_STORE.delete(session_id):
+        return jsonify(unknown_session_result(session_id))
+    return jsonify({"Session": session_id, "Deleted": True})
+
+
+@app.route('/sessions/<session_id>/answers', methods=["POST"])
+def add_quiz_session_answers(session_id):
+    version = g.bank_version = BANK_REGISTRY.current()
+
+    try:
+        payload = request.json
+    except Exception as e:
+        payload = e
+
+    return jsonify(session_answers_result(session_id, payload, version))
+
+
+def session_answers_result(session_id, payload, version: "BankVersion"):
+    """
+    Adds one or more answers, sent as q1..qN / a1..aN like a whole quiz, to a session's running scores.
+    """
+    compiled_bank = version.compiled
+    engine = compiled_bank.engine
+    try:
+        questions, answers, rows = compiled_bank.validator.validate(payload)
+        seed = read_seed(payload, questions, answers)
+
+        def add_answers(data):
+            session = read_session(data, compiled_bank)
+            # Every answer is checked before any is added, since a local session is updated in place
+            for question in questions:
+                offset = engine.offsets[question]
+                if session.has_answer(offset, offset + engine.n_answers[question]):
+                    raise SubmissionError("duplicate_question", DUPLICATE_QUESTION_MESSAGE)
+            for row in rows:
+                session.add_answer(row, engine.matrix[row])
+            return SESSION_STORE.encode(session)
+
+        data = SESSION_STORE.update(session_id, add_answers)
+    except SubmissionError as e:
+        return submission_error_result(e)
+
+    if data is None:
+        return unknown_session_result(session_id)
+    return session_state(session_id, SESSION_STORE.decode(data), seed)
+
+
+def read_session(data, compiled_bank: "CompiledQuestionBank"):
+    """
+    Decodes a stored session, which is only usable with the bank it was started on.
+    """
+    from sessions import SessionError
+
+    try:
+        session = SESSION_STORE.decode(data)
+    except SessionError:
+        session = None
+    if session is None or session.fingerprint != compiled_bank.fingerprint:
+        raise SubmissionError("stale_session", "The question bank has changed since this session started.  "
+                                               "Please start a new session.")
+    return session
+
+
+def session_state(session_id, session: "Session", seed=None):
+    import numpy as np
+
+    scores = session.scores.astype(np.int64)
+    result = {"Session": session_id, "Answered": len(session.rows), "Scores": scores.tolist()}
+    if session.rows:
+        fb = Feedback(scores, seed=seed)
+        feedback, page_to_visit = fb.construct()
+        result["Ranks"] = [LEARNING_OUTCOMES[i] for i in fb.learning_outcomes_ranks]
+        result["Feedback"] = feedback
+        result["Suggested Page"] = page_to_visit
+    return result
+
+
+def unknown_session_result(session_id):
+    return {"Error": f"Session not found: {session_id}",
+            "Message": "The session does not exist or has expired.  Please start a new session.",
+            "Code": "unknown_session"}
+
+
+def quiz_questions_result(payload, version: "BankVersion"):
+    """
+    Chooses the next questions for a learner.  The payload can hold the quiz answered so far as q1..qN / a1..aN, or
+    their "scores" directly, plus the "n_questions" wanted and QIDs to "exclude".  Questions already answered are
+    never chosen again.
+    """
+    compiled_bank = version.compiled
+    try:
+        if isinstance(payload, Exception):
+            raise SubmissionError("invalid_json", str(payload))
+        if type(payload) is not dict:
+            raise SubmissionError("invalid_payload", "The payload should be a JSON object.")
+
+        n_questions = payload.get("n_questions", N_QUESTIONS)
+        if type(n_questions) is not int or not 0 < n_questions <= MAX_QUIZ_QUESTIONS:
+            raise SubmissionError("invalid_n_questions",
+                                  f"n_questions should be an integer from 1 to {MAX_QUIZ_QUESTIONS}.", "n_questions")
+        exclude = payload.get("exclude", [])
+        if type(exclude) is not list:
+            raise SubmissionError("invalid_exclude", "exclude should be a list of question IDs.", "exclude")
+
+        scores = payload.get("scores")
+        if "q1" in payload:
+            answered, _, rows = compiled_bank.validator.validate(payload)
+            exclude = exclude + answered
+            scores = compiled_bank.engine.score(rows)
+        elif scores is not None:
+            if type(scores) is not list or len(scores) != len(learning_outcomes) or \
+                    not all(type(score) in (int, float) for score in scores):
+                raise SubmissionError("invalid_scores", f"scores should be a list of {len(learning_outcomes)} numbers.",
+                                      "scores")
+    except SubmissionError as e:
+        return submission_error_result(e)
+
+    outcome = 0 if scores is None else weakest_outcome(scores)
+    questions = compiled_bank.selector.select(outcome, n_questions, exclude)
+    return {"Questions": questions, "Learning Outcome": LEARNING_OUTCOMES[outcome]}
+
+
+def analytics_result(cohort=None, results: "ResultStore" = None):
+    """
+    Learning outcome performance over every stored quiz of one cohort, or of all cohorts when cohort is None.
+    """
+    import numpy as np
+    from results import PERCENTILES
+
+    if results is None:
+        results = RESULT_STORE
+    aggregate = results.aggregate(cohort)
+    if aggregate is None:
+        return {"Error": f"No results for cohort: {cohort}",
+                "Message": "No quizzes have been scored for this cohort yet.",
+                "Code": "unknown_cohort"}
+
+    count = aggregate.count
+    means = aggregate.score_sum / max(count, 1)
+    deviations = np.sqrt(np.maximum(aggregate.score_sqsum / max(count, 1) - means ** 2, 0))
+    percentiles = aggregate.percentiles().tolist()
+    outcomes = []
+    for k, name in enumerate(LEARNING_OUTCOMES):
+        outcomes.append({"Learning Outcome": name,
+                         "Mean": float(means[k]),
+                         "Standard Deviation": float(deviations[k]),
+                         "Percentiles": {str(p): value for p, value in zip(PERCENTILES, percentiles[k])},
+                         "Weakest": int(aggregate.weakest[k]),
+                         "Weakest Share": float(aggregate.weakest[k] / max(count, 1))})
+
+    # One count per answer the question has, rather than the width of the widest question
+    n_answers = BANK_REGISTRY.current().compiled.engine.n_answers
+    answers = dict()
+    for index, counts in enumerate(aggregate.answers.tolist()):
+        if any(counts):
+            question_id = results.question_id(index)
+            # Answers given before the bank changed are still counted, even if the question now has fewer
+            width = max(n_answers.get(question_id, 0), max(i for i, count in enumerate(counts) if count) + 1)
+            # Keys are strings, so numeric and text question IDs can sit in the same JSON object
+            answers[str(question_id)] = (counts + [0] * width)[:width]
+    return {"Cohort": cohort, "Cohorts": results.cohorts(), "Quizzes": count, "Learning Outcomes": outcomes,
+            "Answers": answers}
+
+
+def quiz_feedback_result(payload, version: "BankVersion"):
+    """
+    The /quiz_feedback response for one decoded payload, shared by the WSGI and ASGI apps.
+    A payload that could not be decoded is passed in as its exception.
+    """
+    try:
+        with METRICS.time(STAGE_METRIC, VALIDATE_STAGE):
+            q, a, rows = version.compiled.validator.validate(payload)
+            seed = read_seed(payload, q, a)
+            cohort = read_cohort(payload, RESULT_STORE)
+    except SubmissionError as e:
+        return submission_error_result(e)
+
+    try:
+        feedback, page_to_visit = get_quiz_feedback(q, a, version.compiled, seed, version.score_table, rows,
+                                                    results=RESULT_STORE, cohort=cohort)
+    except Exception as e:
+        METRICS.inc("quiz_errors_total", (("code", "internal_error"),))
+        return {"Error": str(e),
+                "Message": "An error has occurred within the Python code."}
+
+    return {"Feedback": feedback, "Suggested Page": page_to_visit}
+
+
+def recommendations_result(payload, version: "BankVersion"):
+    """
+    The site pages ranked for one learner, from their quiz answers or their score vector.  The quiz is not recorded.
+    """
+    import numpy as np
+
+    try:
+        with METRICS.time(STAGE_METRIC, VALIDATE_STAGE):
+            scores = read_learner_scores(payload, version)
+            top_k = payload.get("top_k", len(SITE_PAGES))
+            if type(top_k) is not int or top_k < 1:
+                raise SubmissionError("invalid_payload", f"Invalid top_k: {top_k}.  top_k should be a positive "
+                                                         f"integer.", "top_k")
+    except SubmissionError as e:
+        result = submission_error_result(e)
+        if e.code != "duplicate_question":
+            result["Message"] = RECOMMENDATIONS_ERROR_MESSAGE
+        return result
+
+    with METRICS.time(STAGE_METRIC, RECOMMEND_STAGE):
+        order, ranking = RECOMMENDER.recommend(np.asarray(scores).reshape(1, -1))
+    return {"Pages": [{"Page": SITE_PAGES[page], "Score": round(float(score), 6)}
+                      for page, score in zip(order[0, :top_k].tolist(), ranking[0, :top_k].tolist())]}
+
+
+def engagement_result(payload, version: "BankVersion"):
+    """
+    Records one learner's engagement with a page in RECOMMENDER.  The quiz is not recorded in the analytics.
+    """
+    import numpy as np
+
+    try:
+        with METRICS.time(STAGE_METRIC, VALIDATE_STAGE):
+            scores = read_learner_scores(payload, version)
+            page = payload.get("page")
+            if type(page) is not str or page not in SITE_PAGES:
+                raise SubmissionError("invalid_payload", f"Invalid page: {page}.  The page should be one of "
+                                                         f"{', '.join(SITE_PAGES)}.", "page")
+    except SubmissionError as e:
+        result = submission_error_result(e)
+        if e.code != "duplicate_question":
+            result["Message"] = ENGAGEMENT_ERROR_MESSAGE
+        return result
+
+    with METRICS.time(STAGE_METRIC, RECOMMEND_STAGE):
+        RECOMMENDER.record(np.asarray(scores).reshape(1, -1), [page])
+    return {"Recorded": True, "Page": page}
+
+
+def read_learner_scores(payload, version: "BankVersion"):
+    """
+    The score vector of a /recommendations or /engagement payload: its 'scores', or the scores of its quiz answers.
+    """
+    import numpy as np
+
+    if type(payload) is dict and "scores" in payload:
+        scores = payload["scores"]
+        if type(scores) is not list or len(scores) != len(learning_outcomes) or \
+                any(type(score) not in (int, float) for score in scores):
+            raise SubmissionError("invalid_payload", f"Invalid scores: {scores}.  The scores should be a list of "
+                                                     f"{len(learning_outcomes)} numbers.", "scores")
+        return scores
+    _, _, rows = version.compiled.validator.validate(payload)
+    return version.compiled.engine.score(np.asarray(rows, dtype=np.intp))
+
+
+def submission_error_result(error: "SubmissionError"):
+    METRICS.inc("quiz_errors_total", (("code", error.code),))
+    if error.code == "duplicate_question":
+        message = "Please check error message."
+    else:
+        message = PAYLOAD_ERROR_MESSAGE
+    return {"Error": str(error), "Message": message, "Code": error.code}
+
+
+def read_seed(payload, questions, answers):
+    """
+    Reads the optional 'seed' from a payload.  It can be an integer, or "submission" to derive it from the answers.
+    """
+    seed = payload.get("seed")
+    if seed == "submission":
+        return submission_seed(questions, answers)
+    if seed is not None and type(seed) is not int:
+        raise SubmissionError("invalid_seed", f"Invalid seed: {seed}.  The seed should be an integer, or \"submission\".")
+    return seed
+
+
+def read_cohort(payload, results: "ResultStore" = None):
+    """
+    Reads the optional 'cohort' a quiz is recorded under for /analytics.  A new cohort is refused once results has as
+    many as it keeps.
+    """
+    cohort = payload.get("cohort", "")
+    if type(cohort) is not str or len(cohort) > MAX_COHORT_LENGTH or not COHORT_PATTERN.fullmatch(cohort):
+        raise SubmissionError("invalid_cohort", f"Invalid cohort: {cohort}.  The cohort should be a string of at most "
+                                                f"{MAX_COHORT_LENGTH} letters, digits, spaces and _ . : / @ -",
+                              "cohort")
+    if results is not None and not results.accepts_cohort(cohort):
+        raise SubmissionError("invalid_cohort", f"Invalid cohort: {cohort}.  No more than {results.max_cohorts} "
+                                                f"cohorts can be recorded.", "cohort")
+    return cohort
+
+
+def read_batch_payload(req):
+    if req.mimetype in ("application/x-ndjson", "application/jsonl"):
+        payloads = []
+        for line in req.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                payloads.append(json.loads(line))
+            except ValueError as e:
+                # Reported in place for that line, rather than failing the batch
+                payloads.append(e)
+        return payloads
+
+    payloads = req.get_json()
+    if type(payloads) is dict:
+        payloads = payloads.get("submissions")
+    if type(payloads) is not list:
+        raise ValueError("Expected a list of quiz payloads")
+    return payloads
+
+
+def read_batch_seed(seed):
+    if seed is not None:
+        seed = int(seed)
+    return seed
+
+
+def wants_stream(req):
+    if req.args.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    return "application/x-ndjson" in req.headers.get("Accept", "")
+
+
+def iter_batch_payload(req):
+    """
+    Yields payloads one at a time while reading the request body, so large uploads are never held in memory.
+    """
+    if req.mimetype in ("application/x-ndjson", "application/jsonl"):
+        for line in req.stream:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield e
+    else:
+        yield from iter_json_array(req.stream)
+
+
+def iter_json_array(stream, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yields the items of a JSON array as they are read from stream.  An item that is complete but isn't valid JSON is
+    yielded as its ValueError, in its place, and reading carries on with the next item.
+    """
+    decoder = json.JSONDecoder()
+    reader = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = False
+    more = True
+    chunks = iter(lambda: stream.read(chunk_size), b"")
+    while more:
+        chunk = next(chunks, None)
+        if chunk is None:
+            more = False
+        else:
+            buffer += reader.decode(chunk)
+        while True:
+            buffer = buffer.lstrip()
+            if not buffer:
+                break
+            if not started:
+                if buffer[0] != "[":
+                    raise ValueError("Expected a list of quiz payloads")
+                buffer = buffer[1:]
+                started = True
+            elif buffer[0] == ",":
+                buffer = buffer[1:]
+            elif buffer[0] == "]":
+                return
+            else:
+                try:
+                    item, end = decoder.raw_decode(buffer)
+                    # Only whole once a "," or "]" (or the end of the body) follows, as a number might carry on in
+                    # the next chunk
+                    rest = buffer[end:].lstrip()
+                    if rest[:1] not in (",", "]") and (more or rest):
+                        raise ValueError(f"Expected ',' or ']' after item: {buffer[:end]!r}")
+                except ValueError as e:
+                    end = json_item_end(buffer)
+                    if end is None:
+                        # The item continues in the next chunk
+                        break
+                    item = e
+                yield item
+                buffer = buffer[end:]
+
+    raise ValueError("The list of quiz payloads is incomplete")
+
+
+def json_item_end(buffer):
+    """
+    Returns where the array item at the start of buffer ends (the index of the "," or "]" after it), or None if
+    buffer ends first.  Brackets inside strings are skipped, so an item that is only malformed inside doesn't take
+    the rest of the array with it.
+    """
+    depth = 0
+    for token in JSON_ITEM_TOKENS.finditer(buffer):
+        char = token.group()
+        if char == '"':
+            # A string that runs past the end of buffer
+            return None
+        if char in "[{":
+            depth += 1
+        elif char in "]}" and depth:
+            depth -= 1
+        elif char in ",]" and not depth:
+            return token.start()
+    return None
+
+
+class AnswerTextTable():
+    """
+    Side table holding each distinct answer text once.  Questions only store integer answer IDs into it, and the
+    text is only looked up when it's needed for rendering or for answers given as text.
+    """
+    __slots__ = ("texts", "ids", "_lock")
+
+    def __init__(self):
+        self.texts = []
+        self.ids = dict()
+        self._lock = Lock()
+
+    def add(self, text):
+        answer_id = self.ids.get(text)
+        if answer_id is None:
+            with self._lock:
+                answer_id = self.ids.get(text)
+                if answer_id is None:
+                    answer_id = len(self.texts)
+                    self.texts.append(intern(text) if type(text) is str else text)
+                    self.ids[text] = answer_id
+        return answer_id
+
+    def get_id(self, text):
+        return self.ids.get(text)
+
+    def get_text(self, answer_id):
+        return self.texts[answer_id]
+
+
+ANSWER_TEXTS = AnswerTextTable()
 
 
 class Question():
+    # Learning outcomes are stored as int8, six per answer, in the order the answers were added
+    __slots__ = ("question", "type", "question_id", "correct_answer", "answer_ids", "outcomes", "version")
+
     def __init__(self, question, question_type, question_id=None):
         self.question = question
-        self.answers = []
+        self.answer_ids = array("l")
         self.correct_answer = None
         self.type = question_type
-        self.learning_outcomes = dict()
+        self.outcomes = array("b")
+        # Counts the changes made through add_answer, so a compiled bank holding this question knows it is stale
+        self.version = 0
 
         if question_id:
             self.question_id = question_id
         else:
             self.question_id = hash(question)
 
+    @property
+    def answers(self):
+        return [ANSWER_TEXTS.get_text(answer_id) for answer_id in self.answer_ids]
+
+    @property
+    def learning_outcomes(self):
+        return {ANSWER_TEXTS.get_text(answer_id): self.get_learning_outcome_score(i)
+                for i, answer_id in enumerate(self.answer_ids)}
+
     def add_answer(self, answer, correct, learning_outcome: list):
         if self.correct_answer and correct:
             raise AssertionError("Only one answer can be correct.")
 
+        assert len(learning_outcome) == 6
+        answer_id = ANSWER_TEXTS.add(answer)
+
+        # An answer with the same text as an earlier one replaces its learning outcome
+        for i, existing_id in enumerate(self.answer_ids):
+            if existing_id == answer_id:
+                self.outcomes[6 * i:6 * i + 6] = array("b", learning_outcome)
+
         if correct:
-            self.correct_answer = len(self.answers)
-        self.answers.append(answer)
+            self.correct_answer = len(self.answer_ids)
+        self.answer_ids.append(answer_id)
+        self.outcomes.extend(learning_outcome)
+        self.version += 1
 
-        assert len(learning_outcome) == 6
-        self.learning_outcomes[answer] = learning_outcome
+    def answer_index(self, answer):
+        if type(answer) is int:
+            n_answers = len(self.answer_ids)
+            if not -n_answers <= answer < n_answers:
+                raise IndexError("list index out of range")
+            return answer % n_answers
+
+        answer_id = ANSWER_TEXTS.get_id(answer)
+        if answer_id is None or answer_id not in self.answer_ids:
+            raise KeyError(answer)
+        return self.answer_ids.index(answer_id)
 
     def get_learning_outcome_score(self, answer):
-        if type(answer) is int:
-            # Get answer
-            answer = self.answers[answer]
+        i = self.answer_index(answer)
+        return self.outcomes[6 * i:6 * i + 6].tolist()
 
-        learning_outcome = self.learning_outcomes[answer]
+    def outcome_array(self):
+        import numpy as np
 
-        return learning_outcome
+        # (n_answers, 6) int8 view of the outcomes, without copying them
+        return np.frombuffer(self.outcomes, dtype=np.int8).reshape(-1, 6)
 
     def get_question_id(self):
         return self.question_id
@@ -152,21 +1002,50 @@ class Question():
         return self.question
 
     def get_number_of_answers(self):
-        return len(self.answers)
+        return len(self.answer_ids)
+
+    def __getstate__(self):
+        # Answer IDs only mean something in this process's ANSWER_TEXTS, so the texts are saved instead
+        return (self.question, self.type, self.question_id, self.correct_answer, self.answers, self.outcomes,
+                self.version)
+
+    def __setstate__(self, state):
+        self.question, self.type, self.question_id, self.correct_answer, answers, self.outcomes, self.version = state
+        self.answer_ids = array("l", map(ANSWER_TEXTS.add, answers))
 
 
 class QuestionBank():
     def __init__(self):
         self.questions = []
         self.id_to_q = dict()
+        self._compiled = None
+        self._compiled_version = None
 
     def add_question(self, question: Question):
         self.questions.append(question)
         self.id_to_q[question.get_question_id()] = question
+        self._compiled = None
+
+    def compile(self):
+        # Compiled once and reused until a question is added, or one of the questions gets a new answer.  Versions
+        # only go up, so their sum changes whenever any of them does.
+        version = sum(question.version for question in self.questions)
+        if self._compiled is None or version != self._compiled_version:
+            self._compiled = CompiledQuestionBank(self)
+            self._compiled_version = version
+        return self._compiled
 
     def get_question(self, question_number: int):
         return self.questions[question_number]
 
+    def select_questions(self, n_questions: int, scores=None, exclude=()):
+        """
+        Chooses the next n_questions for a learner, targeting their weakest learning outcome given their scores so
+        far.  Without scores, the questions that best separate understanding of fake news are chosen.
+        """
+        outcome = 0 if scores is None else weakest_outcome(scores)
+        return self.compile().selector.select(outcome, n_questions, exclude)
+
     def id_to_question(self, id_):
         return self.id_to_q.get(id_)
 
@@ -174,41 +1053,52 @@ class QuestionBank():
         return self.questions
 
 
+def invalid_answer_message(question_id, answer):
+    return f"""For question {question_id}, the answer {answer} is not valid.
+                                    All quiz question's and answers are stored in the Python file.  If the answers were not typed properly into the python file, or the answers are incomplete, this error could occur.  Otherwise, check that the answer you sent is valid.  Answers should be an integer, where the index starts at 0."""
+
+
 class Quiz():
+    __slots__ = ("question_bank", "quiz_questions", "quiz_answers", "_positions")
+
     def __init__(self, question_bank):
         self.question_bank = question_bank
         self.quiz_questions = []
         self.quiz_answers = []
+        # Question -> its position in the quiz, so answers can be added in O(1)
+        self._positions = dict()
+
+    def _append(self, question):
+        if question is not None:
+            self._positions.setdefault(question, len(self.quiz_questions))
+        self.quiz_questions.append(question)
+        self.quiz_answers.append(None)
 
     def add_questions(self, questions):
         for q in questions:
             if type(q) is str:
                 question = self.question_bank.id_to_question(q)
-                self.quiz_questions.append(question)
+                self._append(question)
 
             elif type(q) is Question:
-                self.quiz_questions.append(q)
+                self._append(q)
 
             else:
                 raise AssertionError(f"Invalid Question: {q}")
 
-            self.quiz_answers.append(None)
-
     def add_question(self, question):
         if type(question) is str:
             q = self.question_bank.id_to_question(question)
             if q is None:
                 raise AssertionError(f"Question ID is not valid: {question}")
-            self.quiz_questions.append(q)
+            self._append(q)
 
         elif type(question) is Question:
-            self.quiz_questions.append(question)
+            self._append(question)
 
         else:
             raise AssertionError("Invalid Question")
 
-        self.quiz_answers.append(None)
-
     def add_answer(self, question, answer):
         if type(question) is str:
             q = self.question_bank.id_to_question(question)
@@ -217,25 +1107,35 @@ class Quiz():
             question = q
 
         if type(question) != int:
-            question_index = self.quiz_questions.index(question)
+            question_index = self._positions.get(question)
+            if question_index is None:
+                raise ValueError(f"{question} is not in list")
         else:
             question_index = question
 
+        if answer is not None and type(answer) is not int:
+            # Answers given as text are stored as their index
+            answer = self.quiz_questions[question_index].answer_index(answer)
         self.quiz_answers[question_index] = answer
 
     def score_quiz(self):
-        score = np.asarray([0] * len(learning_outcomes))
+        import numpy as np
+
+        bank = self.question_bank
+        if all(q is not None and bank.id_to_question(q.get_question_id()) is q for q in self.quiz_questions):
+            engine = bank.compile().engine
+            rows = engine.rows([q.get_question_id() for q in self.quiz_questions], self.quiz_answers)
+            return engine.score(rows)
+
+        # Questions added as objects that aren't in the bank are scored from their own learning outcomes
+        score = np.zeros(len(learning_outcomes), dtype=np.int64)
         for q, a in zip(self.quiz_questions, self.quiz_answers):
             if a is None:
                 raise AssertionError("Not all quiz questions have answers")
             try:
-                question_score = q.get_learning_outcome_score(a)
-            except IndexError as e:
-                raise IndexError(f"""For question {q.get_question_id()}, the answer {a} is not valid.
-                                    All quiz question's and answers are stored in the Python file.  If the answers were not typed properly into the python file, or the answers are incomplete, this error could occur.  Otherwise, check that the answer you sent is valid.  Answers should be an integer, where the index starts at 0.""")
-            question_score = np.asarray(question_score)
-            score += question_score
-
+                score += q.get_learning_outcome_score(a)
+            except IndexError:
+                raise IndexError(invalid_answer_message(q.get_question_id(), a))
         return score
 
     def get_questions(self):
@@ -432,214 +1332,1511 @@ def create_question_bank():
     return bank
 
 
+class QuestionBankError(ValueError):
+    pass
+
+
+def load_question_bank(path, cache_dir=None):
+    """
+    Loads a question bank from a JSON file, or from the compiled .npz form that this function caches.
+
+    The JSON file holds a list of questions (or an object with a "questions" list), each with the same fields
+    Question and Question.add_answer take:
+        {"question_id": "MC1", "question": "...", "question_type": "MCS",
+         "answers": [{"answer": "...", "correct": false, "learning_outcome": [-3, -1, -1, -5, -5, 0]}, ...]}
+
+    The whole file is validated before any Question is built.  The compiled form is saved in cache_dir under the hash
+    of the file's content, so later loads of the same file skip parsing and validation.
+    """
+    import numpy as np
+
+    if path.endswith(".npz"):
+        return _question_bank_from_arrays(np.load(path))
+
+    with open(path, "rb") as f:
+        content = f.read()
+
+    if cache_dir is None:
+        cache_dir = BANK_CACHE_DIR
+    cache_path = os.path.join(cache_dir, blake2b(content, digest_size=16).hexdigest() + ".npz")
+    if os.path.exists(cache_path):
+        try:
+            return _question_bank_from_arrays(np.load(cache_path))
+        except (OSError, ValueError, KeyError):
+            # A damaged cache entry is rebuilt below
+            pass
+
+    try:
+        data = json.loads(content)
+    except ValueError as e:
+        raise QuestionBankError(f"{path} is not valid JSON: {e}")
+    arrays = _question_bank_to_arrays(data)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written under a temporary name first, so other workers never load a half written file
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        app.logger.warning(f"Could not cache the compiled question bank: {e}")
+
+    return _question_bank_from_arrays(arrays)
+
+
+def _question_bank_to_arrays(data):
+    import numpy as np
+
+    if type(data) is dict:
+        data = data.get("questions")
+    if type(data) is not list:
+        raise QuestionBankError("The question bank should be a list of questions, or an object with a 'questions' list.")
+
+    question_ids = []
+    question_texts = []
+    question_types = []
+    answer_counts = []
+    answer_texts = []
+    correct = []
+    outcome_lengths = []
+    outcomes = []
+    try:
+        for question in data:
+            question_ids.append(question["question_id"])
+            question_texts.append(question["question"])
+            question_types.append(question["question_type"])
+            answer_counts.append(len(question["answers"]))
+            for answer in question["answers"]:
+                answer_texts.append(answer["answer"])
+                correct.append(answer["correct"])
+                learning_outcome = answer["learning_outcome"]
+                if type(learning_outcome) is not list:
+                    # Reported with the wrong lengths below, rather than letting a dict's keys through
+                    outcome_lengths.append(-1)
+                    continue
+                outcome_lengths.append(len(learning_outcome))
+                outcomes.extend(learning_outcome)
+    except (KeyError, TypeError) as e:
+        raise QuestionBankError(f"Question {len(question_ids)} is missing a field or has the wrong type: {e}")
+
+    # Everything below checks the whole bank at once
+    errors = []
+    if not all(type(text) is str for text in question_ids + question_texts + question_types + answer_texts):
+        errors.append("Question IDs, questions, question types and answers should all be strings.")
+
+    question_ids_array = np.array(question_ids, dtype=str)
+    unique_ids, counts = np.unique(question_ids_array, return_counts=True)
+    if (counts > 1).any():
+        errors.append(f"Duplicate question IDs: {unique_ids[counts > 1].tolist()}")
+
+    answer_counts = np.array(answer_counts, dtype=np.int64)
+    if (answer_counts == 0).any():
+        errors.append(f"Questions with no answers: {question_ids_array[answer_counts == 0].tolist()}")
+
+    outcome_lengths = np.array(outcome_lengths, dtype=np.int64)
+    wrong_length = outcome_lengths != len(learning_outcomes)
+    # Question that each answer belongs to
+    answer_question = np.repeat(np.arange(len(answer_counts)), answer_counts)
+    if wrong_length.any():
+        errors.append(f"Learning outcomes should be lists of {len(learning_outcomes)} values, in questions "
+                      f"{np.unique(question_ids_array[answer_question[wrong_length]]).tolist()}")
+
+    if not all(type(flag) is bool for flag in correct):
+        errors.append("'correct' should be true or false.")
+    correct = np.array(correct, dtype=bool)
+    n_correct = np.bincount(answer_question, weights=correct, minlength=len(answer_counts))
+    if (n_correct != 1).any():
+        errors.append(f"Questions without exactly one correct answer: {question_ids_array[n_correct != 1].tolist()}")
+
+    # bool is a subclass of int, and NumPy would truncate floats, so the types are checked exactly
+    if not all(type(value) is int for value in outcomes):
+        errors.append("Learning outcomes should be integers.")
+    elif max(map(abs, outcomes), default=0) > np.iinfo(np.int8).max:
+        errors.append("Learning outcomes should be between -127 and 127.")
+
+    if errors:
+        raise QuestionBankError("  ".join(errors))
+    outcomes = np.array(outcomes, dtype=np.int64).reshape(-1, len(learning_outcomes))
+
+    starts = np.cumsum(answer_counts) - answer_counts
+    return {
+        "question_ids": question_ids_array,
+        "questions": np.array(question_texts, dtype=str),
+        "question_types": np.array(question_types, dtype=str),
+        "answer_counts": answer_counts,
+        "answers": np.array(answer_texts, dtype=str),
+        "correct_answers": np.flatnonzero(correct) - starts,
+        "outcomes": outcomes.astype(np.int8),
+    }
+
+
+def _question_bank_from_arrays(arrays):
+    import numpy as np
+
+    # The arrays were validated before they were saved, so Questions are filled in directly
+    bank = QuestionBank()
+    answer_counts = arrays["answer_counts"].tolist()
+    answer_ids = [ANSWER_TEXTS.add(text) for text in arrays["answers"].tolist()]
+    outcomes = np.ascontiguousarray(arrays["outcomes"], dtype=np.int8)
+    start = 0
+    for question_id, text, question_type, n_answers, correct_answer in zip(
+            arrays["question_ids"].tolist(), arrays["questions"].tolist(), arrays["question_types"].tolist(),
+            answer_counts, arrays["correct_answers"].tolist()):
+        question = Question(text, question_type=question_type, question_id=question_id)
+        question.answer_ids = array("l", answer_ids[start:start + n_answers])
+        question.outcomes = array("b", outcomes[start:start + n_answers].tobytes())
+        question.correct_answer = correct_answer
+        bank.add_question(question)
+        start += n_answers
+    return bank
+
+
+def dump_question_bank(bank: QuestionBank, path):
+    # Writes a bank in the format load_question_bank reads, e.g. to move create_question_bank() into a file
+    questions = []
+    for question in bank.get_all_questions():
+        questions.append({
+            "question_id": question.get_question_id(),
+            "question": question.get_question(),
+            "question_type": question.type,
+            "answers": [{"answer": answer, "correct": i == question.correct_answer,
+                         "learning_outcome": question.get_learning_outcome_score(i)}
+                        for i, answer in enumerate(question.answers)],
+        })
+    with open(path, "w") as f:
+        json.dump({"questions": questions}, f, indent=4)
+
+
+class CompiledQuestionBank():
+    """
+    Read-only scoring table built from a QuestionBank.
+
+    Each QID maps to a dense (n_answers, 6) array of learning outcome vectors and the index of its correct answer.
+    """
+    __slots__ = ("_outcomes", "_correct_answers", "_answers", "engine", "validator", "selector", "fingerprint")
+
+    def __init__(self, bank: QuestionBank):
+        import numpy as np
+
+        outcomes = dict()
+        correct_answers = dict()
+        answers = dict()
+        # Changes whenever a QID, answer, correct answer or learning outcome changes
+        fingerprint = blake2b(digest_size=16)
+        for question in bank.get_all_questions():
+            question_id = question.get_question_id()
+            scores = question.outcome_array().astype(np.int64)
+            scores.setflags(write=False)
+
+            outcomes[question_id] = scores
+            correct_answers[question_id] = question.correct_answer
+            answers[question_id] = tuple(question.answers)
+            fingerprint.update(repr((question_id, answers[question_id], question.correct_answer)).encode())
+            fingerprint.update(scores.tobytes())
+
+        object.__setattr__(self, "_outcomes", MappingProxyType(outcomes))
+        object.__setattr__(self, "_correct_answers", MappingProxyType(correct_answers))
+        object.__setattr__(self, "_answers", MappingProxyType(answers))
+        object.__setattr__(self, "engine", ScoringEngine(self))
+        object.__setattr__(self, "validator", SubmissionValidator(self))
+        object.__setattr__(self, "selector", QuestionSelector(self))
+        object.__setattr__(self, "fingerprint", fingerprint.hexdigest())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledQuestionBank is read-only")
+
+    def __getstate__(self):
+        # MappingProxyType can't be pickled, so the mappings are saved as dicts
+        return (dict(self._outcomes), dict(self._correct_answers), dict(self._answers), self.engine, self.validator,
+                self.selector, self.fingerprint)
+
+    def __setstate__(self, state):
+        outcomes, correct_answers, answers, engine, validator, selector, fingerprint = state
+        for scores in outcomes.values():
+            scores.setflags(write=False)
+        object.__setattr__(self, "_outcomes", MappingProxyType(outcomes))
+        object.__setattr__(self, "_correct_answers", MappingProxyType(correct_answers))
+        object.__setattr__(self, "_answers", MappingProxyType(answers))
+        object.__setattr__(self, "engine", engine)
+        object.__setattr__(self, "validator", validator)
+        object.__setattr__(self, "selector", selector)
+        object.__setattr__(self, "fingerprint", fingerprint)
+
+    def __contains__(self, question_id):
+        return question_id in self._outcomes
+
+    def __iter__(self):
+        return iter(self._outcomes)
+
+    def __len__(self):
+        return len(self._outcomes)
+
+    def outcomes(self, question_id):
+        return self._outcomes[question_id]
+
+    def answers(self, question_id):
+        return self._answers[question_id]
+
+    def correct_answer(self, question_id):
+        return self._correct_answers[question_id]
+
+    def answer_index(self, question_id, answer):
+        if type(answer) is int:
+            return answer
+        # Answers can also be given as the answer text
+        answers = self._answers[question_id]
+        if answer not in answers:
+            raise KeyError(answer)
+        return answers.index(answer)
+
+    def score(self, questions, answers):
+        return self.engine.score(self.engine.rows(questions, answers))
+
+
+class ScoringEngine():
+    """
+    Scores quizzes by gathering rows from one stacked (total_answers, 6) matrix of every answer's outcome vector.
+
+    A quiz is turned into row indices with `rows`, then scored with a single gather and sum.
+    """
+    __slots__ = ("compiled_bank", "question_ids", "matrix", "offsets", "n_answers")
+
+    def __init__(self, compiled_bank: CompiledQuestionBank):
+        import numpy as np
+
+        self.compiled_bank = compiled_bank
+        self.question_ids = tuple(compiled_bank)
+
+        blocks = [compiled_bank.outcomes(question_id) for question_id in self.question_ids]
+        sizes = [len(block) for block in blocks]
+        if blocks:
+            self.matrix = np.concatenate(blocks)
+        else:
+            self.matrix = np.zeros((0, len(learning_outcomes)), dtype=np.int64)
+        self.matrix.setflags(write=False)
+
+        # (qid, answer_idx) -> row is offsets[qid] + answer_idx
+        starts = np.cumsum([0] + sizes[:-1]).tolist()
+        self.offsets = MappingProxyType(dict(zip(self.question_ids, starts)))
+        self.n_answers = MappingProxyType(dict(zip(self.question_ids, sizes)))
+
+    def __getstate__(self):
+        return self.compiled_bank, self.question_ids, self.matrix, dict(self.offsets), dict(self.n_answers)
+
+    def __setstate__(self, state):
+        self.compiled_bank, self.question_ids, self.matrix, offsets, n_answers = state
+        self.matrix.setflags(write=False)
+        self.offsets = MappingProxyType(offsets)
+        self.n_answers = MappingProxyType(n_answers)
+
+    def row(self, question, answer):
+        offset = self.offsets.get(question)
+        if offset is None:
+            raise AssertionError(f"Question ID is not valid: {question}")
+        if answer is None:
+            raise AssertionError("Not all quiz questions have answers")
+
+        n_answers = self.n_answers[question]
+        index = self.compiled_bank.answer_index(question, answer)
+        if index < 0:
+            # Keep the same behaviour as indexing the answers list
+            index += n_answers
+        if not 0 <= index < n_answers:
+            raise IndexError(invalid_answer_message(question, answer))
+        return offset + index
+
+    def rows(self, questions, answers):
+        import numpy as np
+
+        return np.array([self.row(q, a) for q, a in zip(questions, answers)], dtype=np.intp)
+
+    def score(self, rows):
+        return self.matrix[rows].sum(axis=0)
+
+    def score_batch(self, rows, lengths=None):
+        """
+        Scores many quizzes at once.
+
+        rows is either an (N, n_questions) index matrix, or a flat array of every quiz's rows back to back with
+        lengths giving the number of questions in each quiz.  Returns an (N, 6) array of scores.
+        """
+        import numpy as np
+
+        rows = np.asarray(rows, dtype=np.intp)
+        if lengths is None:
+            return self.matrix[rows].sum(axis=1)
+
+        lengths = np.asarray(lengths, dtype=np.intp)
+        scores = np.zeros((len(lengths), self.matrix.shape[1]), dtype=self.matrix.dtype)
+        non_empty = lengths > 0
+        if non_empty.any():
+            starts = np.cumsum(lengths) - lengths
+            scores[non_empty] = np.add.reduceat(self.matrix[rows], starts[non_empty], axis=0)
+        return scores
+
+
+class SubmissionError(ValueError):
+    """
+    A payload that can't be scored.  code is a short, stable identifier clients can act on, and field is the
+    payload key at fault when there is one.
+    """
+    def __init__(self, code, message, field=None):
+        super().__init__(message)
+        self.code = code
+        self.field = field
+
+
+class SubmissionValidator():
+    """
+    Checks a decoded q1..qN / a1..aN payload against one compiled bank in a single pass, and returns the questions,
+    the answers as indices and the scoring matrix rows, so nothing has to be looked up again to score it.
+    """
+    __slots__ = ("offsets", "n_answers", "answer_indices", "max_questions")
+
+    def __init__(self, compiled_bank: CompiledQuestionBank, max_questions=MAX_QUIZ_QUESTIONS):
+        engine = compiled_bank.engine
+        self.offsets = dict(engine.offsets)
+        self.n_answers = dict(engine.n_answers)
+        # Answers can also be sent as their text
+        self.answer_indices = dict()
+        for question_id in engine.question_ids:
+            indices = dict()
+            for i, text in enumerate(compiled_bank.answers(question_id)):
+                indices.setdefault(text, i)
+            self.answer_indices[question_id] = indices
+        self.max_questions = max_questions
+
+    def validate(self, payload):
+        if isinstance(payload, Exception):
+            raise SubmissionError("invalid_json", str(payload))
+        if type(payload) is not dict:
+            raise SubmissionError("invalid_payload", "The payload should be a JSON object.")
+
+        questions = dict()
+        answers = dict()
+        for key, value in payload.items():
+            number = key[1:]
+            if number.isdigit() and number.isascii() and key[0] in "qa":
+                if number[0] == "0":
+                    # Otherwise "q01" would be read as another "q1"
+                    raise SubmissionError("invalid_payload", f"Invalid field name: {key}.  Questions and answers are "
+                                                             f"numbered from 1, without leading zeros.", key)
+                if key[0] == "q":
+                    questions[int(number)] = value
+                else:
+                    answers[int(number)] = value
+
+        n_questions = len(questions)
+        if n_questions == 0:
+            raise SubmissionError("missing_field", "'q1'", "q1")
+        if n_questions > self.max_questions:
+            raise SubmissionError("too_many_questions",
+                                  f"A quiz can have at most {self.max_questions} questions, this one has {n_questions}.")
+
+        question_list = []
+        answer_list = []
+        rows = []
+        seen = set()
+        for i in range(1, n_questions + 1):
+            question = questions.get(i)
+            if question is None:
+                raise SubmissionError("missing_field", f"'q{i}'", f"q{i}")
+            answer = answers.get(i)
+            if answer is None:
+                raise SubmissionError("missing_field", f"'a{i}'", f"a{i}")
+
+            offset = self.offsets.get(question) if type(question) in (str, int) else None
+            if offset is None:
+                raise SubmissionError("unknown_question", f"Question ID is not valid: {question}", f"q{i}")
+            if question in seen:
+                raise SubmissionError("duplicate_question", DUPLICATE_QUESTION_MESSAGE, f"q{i}")
+            seen.add(question)
+
+            if type(answer) is int:
+                if not 0 <= answer < self.n_answers[question]:
+                    raise SubmissionError("answer_out_of_range",
+                                          f"For question {question}, the answer {answer} is not valid.  Answers should "
+                                          f"be an integer from 0 to {self.n_answers[question] - 1}.", f"a{i}")
+            elif type(answer) is str and answer in self.answer_indices[question]:
+                answer = self.answer_indices[question][answer]
+            else:
+                raise SubmissionError("invalid_answer",
+                                      f"For question {question}, the answer {answer} is not valid.  Answers should be "
+                                      f"an integer, where the index starts at 0.", f"a{i}")
+
+            question_list.append(question)
+            answer_list.append(answer)
+            rows.append(offset + answer)
+
+        if len(answers) != n_questions:
+            extra = min(set(answers) - set(questions))
+            raise SubmissionError("missing_field", f"'q{extra}'", f"q{extra}")
+
+        return question_list, answer_list, rows
+
+
+class QuestionSelector():
+    """
+    Picks the questions that tell us the most about one learning outcome.
+
+    A question's discriminative power for an outcome is how much its correct answer moves that outcome compared with
+    the average incorrect answer.  The questions are sorted by it once per outcome, so choosing questions is a walk
+    down the front of one list rather than a scan of the bank.
+    """
+    __slots__ = ("question_ids", "power", "order")
+
+    def __init__(self, compiled_bank: CompiledQuestionBank):
+        import numpy as np
+
+        engine = compiled_bank.engine
+        self.question_ids = engine.question_ids
+        n_outcomes = engine.matrix.shape[1]
+
+        if not self.question_ids:
+            self.power = np.zeros((0, n_outcomes))
+            self.order = tuple(() for _ in range(n_outcomes))
+            return
+
+        starts = np.array([engine.offsets[q] for q in self.question_ids], dtype=np.intp)
+        n_answers = np.array([engine.n_answers[q] for q in self.question_ids], dtype=np.intp)
+        correct = np.array([compiled_bank.correct_answer(q) or 0 for q in self.question_ids], dtype=np.intp)
+
+        correct_outcomes = engine.matrix[starts + correct].astype(np.float64)
+        totals = np.add.reduceat(engine.matrix, starts, axis=0).astype(np.float64)
+        n_incorrect = np.maximum(n_answers - 1, 1)[:, None]
+        incorrect_mean = (totals - correct_outcomes) / n_incorrect
+        self.power = np.where(n_answers[:, None] > 1, correct_outcomes - incorrect_mean, 0)
+        self.power.setflags(write=False)
+
+        # For each outcome, question positions from most to least discriminative
+        order = np.argsort(-self.power, axis=0, kind="stable")
+        self.order = tuple(order[:, k].tolist() for k in range(n_outcomes))
+
+    def __getstate__(self):
+        return self.question_ids, self.power, self.order
+
+    def __setstate__(self, state):
+        self.question_ids, self.power, self.order = state
+        self.power.setflags(write=False)
+
+    def select(self, outcome: int, n_questions: int, exclude=()):
+        exclude = set(exclude)
+        selected = []
+        for position in self.order[outcome]:
+            question_id = self.question_ids[position]
+            if question_id in exclude:
+                continue
+            selected.append(question_id)
+            if len(selected) == n_questions:
+                break
+        return selected
+
+
+def load_score_table(path, compiled_bank: CompiledQuestionBank):
+    from score_table import ScoreTable, ScoreTableError
+
+    # The precomputed table is optional, scores are computed as normal without it
+    if not os.path.exists(path):
+        return None
+    try:
+        return ScoreTable(path, compiled_bank.engine, compiled_bank.fingerprint)
+    except (ScoreTableError, ValueError, OSError) as e:
+        app.logger.warning(f"Not using the precomputed score table: {e}")
+        return None
+
+
+def _phrase_table(table):
+    # Tables are built once, as nested tuples of interned strings
+    if type(table) is str:
+        return intern(table)
+    return tuple(_phrase_table(item) for item in table)
+
+
+LEARNING_OUTCOMES = _phrase_table(learning_outcomes)
+
+INTRO_TO_POSITIVE = _phrase_table([
+    "It's great to see that you've got a good grasp on",
+    "From your quiz results, we can see that you're great at",
+    "It seems like you're already good at",
+])
+
+# Indexed by learning outcome
+FEEDBACK_TITLES = _phrase_table([
+    ["understanding what fake news is", "knowing what fake news is"],
+    ["understanding what biased news is", "understanding what biased information looks like"],
+    ["knowing how to identify biased information online", "being able to identify biased information"],
+    ["being able to recognise intentional fake news", "recognising intentional fake news",
+     "being able to recognise fake news which had been created intentionally"],
+    ["being able to recognise unintentional fake news", 'recognising unintentional fake news'],
+    ["understanding some of the consequences of falling for fake news",
+     "understanding some of the issues associated with believing fake news",
+     "knowing the consequences of falling for fake news"],
+])
+
+# Either a single intro, or an (intro, outro) pair that goes around the weakness
+IMPROVEMENT_INTROS = _phrase_table([
+    ("However, it seems like", "is a challenge for you"),
+    ("However, it seems like you would benefit from working on"),
+    ("Although there's room for improvement on"),
+    ("But unfortunately you scored lowly on"),
+    ("However, it could be worth you spending some time on",
+     "so that you're better equipped to avoid believing misinformation"),
+])
+
+IMPROVEMENT_ADVICE = _phrase_table([
+    # Understanding "what is fake news"
+    ["You can improve this by researching different types of fake news.",
+     "You can improve on this by learning about different sources.  Having a strong understanding on the key differences between quality reputable sources, and sources with no accountability."],
+
+    # Understanding 'what is biased news'
+    [
+        "You should look into some example's of far left media websites, and far right media websites.  Try having a read through some of their articles and see if you can identify any key differences.",
+    ],
+
+    # Understanding how to identify biased information
+    [
+        "You should try learning about 'story selection bias,' which can help you understand how various media sources try and shape your worldview by the type of stories they publish.",
+        "You should focus on trying to understand how to identify different loaded words and the emotions the author tries to envoke when they use them.",
+    ],
+
+    # Recognising intentional fake news
+    [
+        "You can improve this by learning about different types of sources and knowing how to identify quality reputable organisations versus sources that have no accountability.",
+        "You can improve this by learning to identify the agenda behind different online posts or news articles.",
+
+    ],
+
+    # Recognising unintentional fake news
+    [
+        "You can improve this by learning about different political biases people have, and how they influence the type of information individual's choose to share online.",
+
+    ],
+
+    # Understanding what are some consequences of falling for fake news
+    [
+        "It won't always be an issue if we believe some misinformation online, however there is always a danger associated with it.",
+        "Educating yourself on what some of the consequences could be will help you learn the imporance of recognising misinformation."
+    ],
+])
+
+# (page, text) pairs, indexed by learning outcome
+RECOMMENDED_READING = _phrase_table([
+    [("The definition of fake news",
+      "Based on your results, we recommend you read the following page to learn the different types of fake news."),
+     ("Real life examples",
+      "From your results, we recommend you read though some of our real-life examples on fake news.  By seeing some example's on fake news, you can develop a better understanding on what it is and what it looks like."),
+     ("The definition of fake news",
+      "We recommend you check out our page on the definition of fake news to gain a better understanding on the differences between various kinds of fake news."),
+     ("The definition of fake news",
+      "To further develop your understanding, have a look at the following educational page to help gain a better overview on what fake news is.")
+     ],
+
+    [("The existence of fake news/Biased Information",
+      "Based on these results, we recommend you have a look at the following page.  This page should help you gain an understanding on how news stories can contain bias, even if the author's were not intentional about adding it."),
+     ("The existence of fake news/Biased Information",
+      "We recommend you have a look at our page on why fake news is created.   This should help clarify what biased news is and how it gets created."),
+     ],
+
+    [("Tips to spot fake news/How can you spot biased news",
+      "Based on your results, we recommend you read the following page to learn about how you can recognise bias in the media."),
+     ("Tips to spot fake news/How can you spot biased news",
+      "Have a look at the following page.  This should by learning some extra tips on recognising media bias, you'll be able to help prevent yourself from falling for this form of misinformation.")
+     ],
+
+    [("Tips to spot fake news",
+      "As it seems like you havce trouble recognising fake news, we recommend you read our page on spotting fake news."),
+     ("Tips to spot fake news",
+      "From your quiz results, we recommend you have a look at our article on tips to spot fake news.  This should help you become more comfortable in recognising intentiona fake news."),
+     ("Real life examples",
+      "As it seems you're having trouble recognising unintentional misinformation online, we recommend you have a look at our real life example's page.  Here, you can see some fake news stories which have spread online, and we give you tips on how this story could have been identified as being fake news."),
+
+     ],
+
+    [("Tips to spot fake news",
+      "Have a look at our article on spotting fake news.  This should help give you some tips and ideas on the best ways to spot fake news and prevent yourself from falling for misinformation."),
+     ("Real life examples",
+      "As it seems you're having trouble recognising intentional misinformation online, we recommend you have a look at our real life example's page.  Here, you can see some fake news stories which have spread online, and we give you tips on how this story could have been identified as being fake news."),
+     ],
+
+    [("The importance of identifying fake news",
+      "Given your low score in understanding the consequences of believing misinformation online, we suggest that you read the following page which outline's the key reasons why it's important to ensure you're able to identify fake news and help prevent it spreading."),
+     ("The importance of identifying fake news",
+      "To further develop your understanding, have a look at the following article on the importance of identifying fake news.  This article explain's why fake news can be a serious issue when it spreads, and it will help you gain an understanding on why it will benefit you to be able to recognise fake news.")],
+])
+
+# Every page a learner can be sent to, as listed at the top of this file
+SITE_PAGES = ('Real life examples', 'The definition of fake news', 'The existence of fake news/Biased Information',
+              'The importance of identifying fake news', 'Tips to spot fake news',
+              'Tips to spot fake news/How can you spot biased news')
+
+# Every distinct (page, text) pair in RECOMMENDED_READING
+READINGS = tuple(dict.fromkeys(pair for suggestions in RECOMMENDED_READING for pair in suggestions))
+
+
+def _reading_choices():
+    # For each learning outcome, and each page in SITE_PAGES, the indices in READINGS of that outcome's suggestions
+    # for the page.  A page that isn't suggested for the outcome gets every suggestion for it instead
+    choices = []
+    for suggestions in RECOMMENDED_READING:
+        by_page = []
+        for page in SITE_PAGES:
+            for_page = [i for i, pair in enumerate(READINGS) if pair[0] == page]
+            by_page.append(tuple(i for i in for_page if READINGS[i] in suggestions) or tuple(for_page))
+        choices.append(tuple(by_page))
+    return tuple(choices)
+
+
+READING_CHOICES = _reading_choices()
+
+# Everything binary clients need to expand phrase IDs, served at /phrase_table
+PHRASE_TABLES = {"Learning Outcomes": LEARNING_OUTCOMES, "Intros": INTRO_TO_POSITIVE, "Titles": FEEDBACK_TITLES,
+                 "Improvement Intros": IMPROVEMENT_INTROS, "Advice": IMPROVEMENT_ADVICE, "Readings": READINGS,
+                 "Reading Choices": READING_CHOICES}
+
+# Each phrase choice uses its own draw, so the choices don't depend on the order the methods are called in
+N_FEEDBACK_DRAWS = 7
+INTRO_DRAW, FIRST_POSITIVE_DRAW, SECOND_POSITIVE_DRAW, IMPROVEMENT_INTRO_DRAW, WEAKNESS_DRAW, ADVICE_DRAW, \
+    READING_DRAW = range(N_FEEDBACK_DRAWS)
+
+
+SCORE_CACHE_SIZE = 65536
+FEEDBACK_CACHE_SIZE = 16384
+
+
+def weakest_outcome(scores):
+    import numpy as np
+
+    # The last of the outcome ranks Feedback uses
+    return int(np.argsort(scores)[0])
+
+
 class Feedback():
-    def __init__(self, results):
+    # Only the scores and their ranking are stored per instance, the phrases come from the tables above
+    __slots__ = ("results", "learning_outcomes_ranks", "draws", "page")
+
+    learning_outcomes = LEARNING_OUTCOMES
+
+    def __init__(self, results, seed=None, draws=None, ranks=None, page=None):
+        """
+        Phrases are picked with a generator seeded from seed, so the same seed always gives the same feedback.
+        Alternatively, draws can be N_FEEDBACK_DRAWS floats in [0, 1) that were drawn beforehand.
+
+        ranks can be passed in when they have already been computed for these results, and page, the index in
+        SITE_PAGES of the suggested page, when RECOMMENDER has already ranked the pages for them.
+        """
+        import numpy as np
+
         self.results = results
-        self.learning_outcomes = ["Understanding 'What is fake news'",
-                                  "Understanding 'what is biased news'",
-                                  "Understanding how to identify 'biased information'",
-                                  'Recognising intentional fake news',
-                                  'Recognising unintentional fake news',
-                                  'Understanding what are some consequences of falling for Fake News']
-        # Ranks learning outcomes from best to worst
-        self.learning_outcomes_ranks = np.argsort(results)[::-1]
+        if ranks is None:
+            # Ranks learning outcomes from best to worst
+            ranks = tuple(np.argsort(results)[::-1].tolist())
+        self.learning_outcomes_ranks = ranks
+
+        if draws is None:
+            # Unseeded feedback draws from the shared generator rather than seeding a new one from the OS every time.
+            # Unlike a module-level Random of our own, it is reseeded in each forked worker.
+            draw = random if seed is None else Random(seed).random
+            draws = [draw() for _ in range(N_FEEDBACK_DRAWS)]
+        self.draws = draws
+        self.page = page
 
     def construct(self):
-        output = ""
-        output += self.intro_to_positive() + " "
-        output += self.first_positive()
-        output += " and "
-        output += self.second_positive() + ".  "
-
+        intro = self.intro_to_positive()
+        first = self.first_positive()
+        second = self.second_positive()
         improvement_intro = self.area_of_improvement_intro()
+        weakness = self.biggest_weakness()
+        advice = self.improvement_advice()
+        page, text = self.recommended_reading()
+
         if type(improvement_intro) is tuple:
-            output += improvement_intro[0] + " "
-            output += self.biggest_weakness() + " "
-            output += improvement_intro[1]
+            improvement = (improvement_intro[0], " ", weakness, " ", improvement_intro[1])
         else:
-            output += improvement_intro + " "
-            output += self.biggest_weakness()
-        output += ". "
-        output += self.improvement_advice() + "\n"
-
-        page, text = self.recommended_reading()
-        output += text
+            improvement = (improvement_intro, " ", weakness)
 
+        output = "".join((intro, " ", first, " and ", second, ".  ", *improvement, ". ", advice, "\n", text))
         return output, page
 
+    def _choose(self, options, draw):
+        return options[int(self.draws[draw] * len(options))]
+
     def intro_to_positive(self):
-        intro_to_good = [
-            "It's great to see that you've got a good grasp on",
-            "From your quiz results, we can see that you're great at",
-            "It seems like you're already good at",
-        ]
-        i = randint(0, len(intro_to_good) - 1)
-        return intro_to_good[i]
+        return self._choose(INTRO_TO_POSITIVE, INTRO_DRAW)
 
     def first_positive(self):
-        feedback_title = {
-            0: ["understanding what fake news is", "knowing what fake news is"],
-            1: ["understanding what biased news is", "understanding what biased information looks like"],
-            2: ["knowing how to identify biased information online", "being able to identify biased information"],
-            3: ["being able to recognise intentional fake news", "recognising intentional fake news",
-                "being able to recognise fake news which had been created intentionally"],
-            4: ["being able to recognise unintentional fake news", 'recognising unintentional fake news'],
-            5: ["understanding some of the consequences of falling for fake news",
-                "understanding some of the issues associated with believing fake news",
-                "knowing the consequences of falling for fake news"],
-        }
-        possible_statements = feedback_title[self.learning_outcomes_ranks[0]]
-
-        i = randint(0, len(possible_statements) - 1)
-        return possible_statements[i]
+        return self._choose(FEEDBACK_TITLES[self.learning_outcomes_ranks[0]], FIRST_POSITIVE_DRAW)
 
     def second_positive(self):
-        feedback_title = {
-            0: ["understanding what fake news is", "knowing what fake news is"],
-            1: ["understanding what biased news is", "understanding what biased information looks like"],
-            2: ["knowing how to identify biased information online", "being able to identify biased information"],
-            3: ["being able to recognise intentional fake news", "recognising intentional fake news",
-                "being able to recognise fake news which had been created intentionally"],
-            4: ["being able to recognise unintentional fake news", 'recognising unintentional fake news'],
-            5: ["understanding some of the consequences of falling for fake news",
-                "understanding some of the issues associated with believing fake news",
-                "knowing the consequences of falling for fake news"],
-        }
-        possible_statements = feedback_title[self.learning_outcomes_ranks[1]]
-
-        i = randint(0, len(possible_statements) - 1)
-        return possible_statements[i]
+        return self._choose(FEEDBACK_TITLES[self.learning_outcomes_ranks[1]], SECOND_POSITIVE_DRAW)
 
     def biggest_weakness(self):
-        feedback_title = {
-            0: ["understanding what fake news is", "knowing what fake news is"],
-            1: ["understanding what biased news is", "understanding what biased information looks like"],
-            2: ["knowing how to identify biased information online", "being able to identify biased information"],
-            3: ["being able to recognise intentional fake news", "recognising intentional fake news",
-                "being able to recognise fake news which had been created intentionally"],
-            4: ["being able to recognise unintentional fake news", 'recognising unintentional fake news'],
-            5: ["understanding some of the consequences of falling for fake news",
-                "understanding some of the issues associated with believing fake news",
-                "knowing the consequences of falling for fake news"],
-        }
-        possible_statements = feedback_title[self.learning_outcomes_ranks[-1]]
-        i = randint(0, len(possible_statements) - 1)
-        return possible_statements[i]
+        return self._choose(FEEDBACK_TITLES[self.learning_outcomes_ranks[-1]], WEAKNESS_DRAW)
 
     def area_of_improvement_intro(self):
-        improvement = [
-            ("However, it seems like", "is a challenge for you"),
-            ("However, it seems like you would benefit from working on"),
-            ("Although there's room for improvement on"),
-            ("But unfortunately you scored lowly on"),
-            ("However, it could be worth you spending some time on",
-             "so that you're better equipped to avoid believing misinformation"),
-        ]
-        i = randint(0, len(improvement) - 1)
-        return improvement[i]
+        return self._choose(IMPROVEMENT_INTROS, IMPROVEMENT_INTRO_DRAW)
 
     def improvement_advice(self):
-        how_to_improve = {
-            # Understanding "what is fake news"
-            0: ["You can improve this by researching different types of fake news.",
-                "You can improve on this by learning about different sources.  Having a strong understanding on the key differences between quality reputable sources, and sources with no accountability."],
-
-            # Understanding 'what is biased news'
-            1: [
-                "You should look into some example's of far left media websites, and far right media websites.  Try having a read through some of their articles and see if you can identify any key differences.",
-            ],
-
-            # Understanding how to identify biased information
-            2: [
-                "You should try learning about 'story selection bias,' which can help you understand how various media sources try and shape your worldview by the type of stories they publish.",
-                "You should focus on trying to understand how to identify different loaded words and the emotions the author tries to envoke when they use them.",
-            ],
-
-            # Recognising intentional fake news
-            3: [
-                "You can improve this by learning about different types of sources and knowing how to identify quality reputable organisations versus sources that have no accountability.",
-                "You can improve this by learning to identify the agenda behind different online posts or news articles.",
-
-            ],
-
-            # Recognising unintentional fake news
-            4: [
-                "You can improve this by learning about different political biases people have, and how they influence the type of information individual's choose to share online.",
-
-            ],
-
-            # Understanding what are some consequences of falling for fake news
-            5: [
-                "It won't always be an issue if we believe some misinformation online, however there is always a danger associated with it.",
-                "Educating yourself on what some of the consequences could be will help you learn the imporance of recognising misinformation."
-            ],
-        }
-
-        possible_statements = how_to_improve[self.learning_outcomes_ranks[-1]]
-        i = randint(0, len(possible_statements) - 1)
-        return possible_statements[i]
+        return self._choose(IMPROVEMENT_ADVICE[self.learning_outcomes_ranks[-1]], ADVICE_DRAW)
 
     def recommended_reading(self):
-        page_to_read = {
-            0: [("The definition of fake news",
-                 "Based on your results, we recommend you read the following page to learn the different types of fake news."),
-                ("Real life examples",
-                 "From your results, we recommend you read though some of our real-life examples on fake news.  By seeing some example's on fake news, you can develop a better understanding on what it is and what it looks like."),
-                ("The definition of fake news",
-                 "We recommend you check out our page on the definition of fake news to gain a better understanding on the differences between various kinds of fake news."),
-                ("The definition of fake news",
-                 "To further develop your understanding, have a look at the following educational page to help gain a better overview on what fake news is.")
-                ],
-
-            1: [("The existence of fake news/Biased Information",
-                 "Based on these results, we recommend you have a look at the following page.  This page should help you gain an understanding on how news stories can contain bias, even if the author's were not intentional about adding it."),
-                ("The existence of fake news/Biased Information",
-                 "We recommend you have a look at our page on why fake news is created.   This should help clarify what biased news is and how it gets created."),
-                ],
-
-            2: [("Tips to spot fake news/How can you spot biased news",
-                 "Based on your results, we recommend you read the following page to learn about how you can recognise bias in the media."),
-                ("Tips to spot fake news/How can you spot biased news",
-                 "Have a look at the following page.  This should by learning some extra tips on recognising media bias, you'll be able to help prevent yourself from falling for this form of misinformation.")
-                ],
-
-            3: [("Tips to spot fake news",
-                 "As it seems like you havce trouble recognising fake news, we recommend you read our page on spotting fake news."),
-                ("Tips to spot fake news",
-                 "From your quiz results, we recommend you have a look at our article on tips to spot fake news.  This should help you become more comfortable in recognising intentiona fake news."),
-                ("Real life examples",
-                 "As it seems you're having trouble recognising unintentional misinformation online, we recommend you have a look at our real life example's page.  Here, you can see some fake news stories which have spread online, and we give you tips on how this story could have been identified as being fake news."),
-
-                ],
-
-            4: [("Tips to spot fake news",
-                 "Have a look at our article on spotting fake news.  This should help give you some tips and ideas on the best ways to spot fake news and prevent yourself from falling for misinformation."),
-                ("Real life examples",
-                 "As it seems you're having trouble recognising intentional misinformation online, we recommend you have a look at our real life example's page.  Here, you can see some fake news stories which have spread online, and we give you tips on how this story could have been identified as being fake news."),
-                ],
-
-            5: [("The importance of identifying fake news",
-                 "Given your low score in understanding the consequences of believing misinformation online, we suggest that you read the following page which outline's the key reasons why it's important to ensure you're able to identify fake news and help prevent it spreading."),
-                ("The importance of identifying fake news",
-                 "To further develop your understanding, have a look at the following article on the importance of identifying fake news.  This article explain's why fake news can be a serious issue when it spreads, and it will help you gain an understanding on why it will benefit you to be able to recognise fake news.")],
-        }
-        possible_statements = page_to_read[self.learning_outcomes_ranks[-1]]
-        i = randint(0, len(possible_statements) - 1)
-        return possible_statements[i]
-
-
-def get_quiz_feedback(questions: list, answers: list):
-    bank = create_question_bank()
-    quiz = Quiz(bank)
-    for question, answer in zip(questions, answers):
-        quiz.add_question(question)
-        quiz.add_answer(question, answer)
-
-    scores = quiz.score_quiz()
-    fb = Feedback(scores)
-    feedback, page_to_visit = fb.construct()
+        page = self.page
+        if page is None:
+            page = suggested_pages(self.results)[0]
+        return READINGS[self._choose(READING_CHOICES[self.learning_outcomes_ranks[-1]][page], READING_DRAW)]
+
+
+def suggested_pages(scores):
+    """
+    The index in SITE_PAGES of the page RECOMMENDER ranks first for each row of a score matrix, or for one score
+    vector.
+    """
+    import numpy as np
+
+    order, _ = RECOMMENDER.recommend(np.asarray(scores).reshape(-1, len(learning_outcomes)))
+    return order[:, 0].tolist()
+
+
+def submission_seed(questions: list, answers: list):
+    # Stable across processes, unlike hash(), and independent of the order the questions were asked in
+    submission = sorted(zip(map(str, questions), map(str, answers)))
+    digest = blake2b(repr(submission).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def draw_feedback_choices(n_quizzes: int, seed=None):
+    """
+    Draws the phrase choices for n_quizzes Feedback objects in one call.
+
+    seed can be anything numpy.random.default_rng accepts, including a Generator that is shared between calls.
+    """
+    import numpy as np
+
+    return np.random.default_rng(seed).random((n_quizzes, N_FEEDBACK_DRAWS))
+
+
+class ResponseCache():
+    """
+    Thread-safe, bounded LRU cache for one compiled question bank.
+
+    Every lookup passes the fingerprint of the bank being used.  When it changes, every entry is dropped, so nothing
+    computed from an old bank definition is ever returned.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.fingerprint = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def _check_fingerprint(self, fingerprint):
+        if fingerprint != self.fingerprint:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+            self.fingerprint = fingerprint
+
+    def get(self, fingerprint, key):
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, fingerprint, key, value):
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "invalidations": self.invalidations, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+class LazyGlobal():
+    """
+    Stands in for a module-level object until it is first used.  The first attribute access builds it with factory()
+    and rebinds the global to it, so code in this module then uses the object directly, while references taken
+    earlier (such as "from app import METRICS") keep working through this.
+    """
+    # One lock for every lazy global, as building one can use another
+    _lock = RLock()
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.value = None
+
+    def get(self):
+        if self.value is None:
+            with self._lock:
+                if self.value is None:
+                    value = self.factory()
+                    globals()[self.name] = value
+                    self.value = value
+        return self.value
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+# Keyed by the sorted scoring matrix rows of a quiz, which is the canonical (qid, answer) set of the submission.
+# Scores and ranks are cached for every submission, the rendered text only when the feedback was seeded.
+SCORE_CACHE = ResponseCache(SCORE_CACHE_SIZE)
+FEEDBACK_CACHE = ResponseCache(FEEDBACK_CACHE_SIZE)
+# The WireTable of the bank in use, under a single key
+WIRE_TABLES = ResponseCache(1)
+# Keyed by the hash of the text and the options, for the keyword backend in use
+KEYWORD_CACHE = ResponseCache(KEYWORD_CACHE_SIZE)
+
+
+
+def build_keyword_extractor():
+    from keywords import KeywordExtractor
+
+    return KeywordExtractor(KEYWORD_MODEL_PATH if os.path.exists(KEYWORD_MODEL_PATH) else None)
+
+
+def build_keyword_batcher():
+    from keywords import MicroBatcher
+
+    return MicroBatcher(extract_keyword_batch, max_batch=KEYWORD_BATCH_SIZE)
+
+
+KEYWORD_EXTRACTOR = LazyGlobal("KEYWORD_EXTRACTOR", build_keyword_extractor)
+KEYWORD_BATCHER = LazyGlobal("KEYWORD_BATCHER", build_keyword_batcher)
+
+
+# Per-stage timings are observed under STAGE_METRIC, with the label tuples built once here
+STAGE_METRIC = "quiz_stage_duration_seconds"
+BANK_STAGE = (("stage", "bank"),)
+PARSE_STAGE = (("stage", "parse"),)
+VALIDATE_STAGE = (("stage", "validate"),)
+SCORE_STAGE = (("stage", "score"),)
+CONSTRUCT_STAGE = (("stage", "construct"),)
+KEYWORDS_STAGE = (("stage", "keywords"),)
+ARTICLES_STAGE = (("stage", "articles"),)
+RECOMMEND_STAGE = (("stage", "recommend"),)
+SERIALIZE_STAGE = (("stage", "serialize"),)
+
+# Where each quiz's scores came from
+SCORE_SOURCE_METRIC = "quiz_score_source_total"
+FEEDBACK_CACHE_SOURCE = (("source", "feedback_cache"),)
+SCORE_TABLE_SOURCE = (("source", "score_table"),)
+SCORE_CACHE_SOURCE = (("source", "score_cache"),)
+COMPUTED_SOURCE = (("source", "computed"),)
+BATCH_SOURCE = (("source", "batch"),)
+
+
+def response_cache_samples():
+    for name, cache in (("score", SCORE_CACHE), ("feedback", FEEDBACK_CACHE), ("keywords", KEYWORD_CACHE)):
+        info = cache.info()
+        labels = (("cache", name),)
+        yield "quiz_cache_hits_total", labels, info["hits"]
+        yield "quiz_cache_misses_total", labels, info["misses"]
+        yield "quiz_cache_evictions_total", labels, info["evictions"]
+        yield "quiz_cache_entries", labels, info["size"]
+
+
+def build_metrics():
+    from metrics import Metrics
+
+    metrics = Metrics()
+    metrics.describe("quiz_requests_total", "counter", "Requests by endpoint and status code.")
+    metrics.describe("quiz_request_duration_seconds", "histogram", "Time to handle a request, by endpoint.")
+    metrics.describe(STAGE_METRIC, "histogram", "Time spent in each stage of scoring quizzes.")
+    metrics.describe("quiz_errors_total", "counter", "Rejected payloads and failed requests, by error code.")
+    metrics.describe(SCORE_SOURCE_METRIC, "counter", "Quizzes scored, by where their scores came from.")
+    metrics.describe("quiz_cache_hits_total", "counter", "Response cache hits.")
+    metrics.describe("quiz_cache_misses_total", "counter", "Response cache misses.")
+    metrics.describe("quiz_cache_evictions_total", "counter", "Response cache evictions.")
+    metrics.describe("quiz_cache_entries", "gauge", "Entries in each response cache.")
+    metrics.add_collector(response_cache_samples)
+    metrics.describe("quiz_recommender_learners", "gauge", "Learners in the recommendation pool, by whether they are "
+                                                           "in its cell index yet.")
+    metrics.describe("quiz_recommender_cells", "gauge", "Cells in the recommendation pool's index.")
+    metrics.add_collector(recommender_samples)
+    return metrics
+
+
+def build_profiler():
+    from metrics import SamplingProfiler
+
+    return SamplingProfiler(METRICS_PROFILE_DIR)
+
+
+METRICS = LazyGlobal("METRICS", build_metrics)
+PROFILER = LazyGlobal("PROFILER", build_profiler)
+
+
+BankVersion = namedtuple("BankVersion", ["version", "bank", "compiled", "score_table"])
+
+
+class BankRegistry():
+    """
+    Holds the question bank version that requests are served from.
+
+    A request reads `current()` once and uses that version until it finishes.  New versions are compiled away from
+    the request path and then swapped in with a single assignment, so in-flight requests keep the version they
+    started with.
+    """
+    def __init__(self, version: BankVersion, source=None, caches=()):
+        self._current = version
+        self.source = source
+        self.caches = caches
+        self._lock = Lock()
+        self._source_stat = self._stat_source()
+        self._watcher_pid = None
+
+    def current(self):
+        return self._current
+
+    def publish(self, bank: QuestionBank):
+        compiled = bank.compile()
+        score_table = load_score_table(SCORE_TABLE_PATH, compiled)
+        with self._lock:
+            if compiled.fingerprint == self._current.compiled.fingerprint:
+                return self._current
+            self._current = BankVersion(self._current.version + 1, bank, compiled, score_table)
+
+        # Nothing computed from the old version is served again
+        for cache in self.caches:
+            cache.clear()
+        app.logger.info(f"Serving question bank version {self._current.version}")
+        return self._current
+
+    def _stat_source(self):
+        try:
+            stat = os.stat(self.source)
+        except (OSError, TypeError):
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload_if_changed(self):
+        source_stat = self._stat_source()
+        if source_stat is None or source_stat == self._source_stat:
+            return self._current
+        self._source_stat = source_stat
+
+        try:
+            bank = load_question_bank(self.source)
+        except (OSError, QuestionBankError) as e:
+            app.logger.warning(f"Keeping question bank version {self._current.version}: {e}")
+            return self._current
+        return self.publish(bank)
+
+    def ensure_watching(self, interval):
+        # Checked on each request, since watcher threads don't survive forking into workers
+        if self.source is None or interval <= 0 or self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        Thread(target=self._watch, args=(interval,), name="question-bank-watcher", daemon=True).start()
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.reload_if_changed()
+            except Exception:
+                app.logger.exception("Could not reload the question bank")
+
+
+def build_session_store():
+    from sessions import create_session_store
+
+    return create_session_store(SESSION_STORE_URL, SESSION_TTL, MAX_LOCAL_SESSIONS)
+
+
+def build_result_store():
+    from results import ResultStore
+
+    results = ResultStore(RESULTS_DIR, len(learning_outcomes), max_cohorts=MAX_COHORTS)
+    atexit.register(results.flush)
+    return results
+
+
+def build_recommender():
+    from recommend import PageRecommender
+
+    return PageRecommender(SITE_PAGES, RECOMMENDED_READING)
+
+
+SESSION_STORE = LazyGlobal("SESSION_STORE", build_session_store)
+RESULT_STORE = LazyGlobal("RESULT_STORE", build_result_store)
+RECOMMENDER = LazyGlobal("RECOMMENDER", build_recommender)
+
+
+def recommender_samples():
+    info = RECOMMENDER.info()
+    yield "quiz_recommender_learners", (("state", "indexed"),), info["indexed"]
+    yield "quiz_recommender_learners", (("state", "unindexed"),), info["pool"] - info["indexed"]
+    yield "quiz_recommender_cells", (), info["cells"]
+
+
+
+def snapshot_key(source=None):
+    """
+    Identifies the code and question bank a snapshot was made from, so a stale snapshot is never loaded.
+    """
+    import numpy as np
+
+    key = blake2b(digest_size=16)
+    # Pickles aren't guaranteed to load into another Python version, even with the same NumPy
+    key.update(repr((SNAPSHOT_FORMAT, np.__version__, tuple(sys.version_info))).encode())
+    # The built-in bank and the layout of every pickled class are defined in this file
+    with open(__file__, "rb") as f:
+        key.update(f.read())
+    if source:
+        stat = os.stat(source)
+        key.update(repr((os.path.abspath(source), stat.st_mtime_ns, stat.st_size)).encode())
+    return key.hexdigest()
+
+
+def load_snapshot(path, key):
+    """
+    Returns the question bank (with its compiled form) saved by write_snapshot, or None if there is no snapshot for
+    key.  Snapshots are pickles, so only load ones this service wrote.
+    """
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        app.logger.warning(f"Ignoring the snapshot in {path}: {e}")
+        return None
+    if type(snapshot) is not dict or snapshot.get("key") != key:
+        return None
+    return snapshot["bank"]
+
+
+def write_snapshot(path, key, bank: QuestionBank):
+    bank.compile()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        pickle.dump({"key": key, "bank": bank}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+
+def build_question_bank():
+    if QUESTION_BANK_PATH:
+        return load_question_bank(QUESTION_BANK_PATH)
+    return create_question_bank()
+
+
+def load_or_build_question_bank():
+    """
+    The startup question bank, compiled, from the snapshot when there is a current one.  Otherwise it is built and
+    a snapshot written for the next boot.
+    """
+    if not SNAPSHOT_PATH:
+        return build_question_bank()
+
+    key = snapshot_key(QUESTION_BANK_PATH)
+    bank = load_snapshot(SNAPSHOT_PATH, key)
+    if bank is None:
+        bank = build_question_bank()
+        try:
+            write_snapshot(SNAPSHOT_PATH, key, bank)
+        except OSError as e:
+            app.logger.warning(f"Could not write the snapshot {SNAPSHOT_PATH}: {e}")
+    return bank
+
+
+def build_bank_registry():
+    """
+    Builds the startup bank, once, the first time BANK_REGISTRY is used.  The startup version is also kept as
+    QUESTION_BANK, COMPILED_BANK and SCORE_TABLE, but requests should go through BANK_REGISTRY.current() so they see
+    reloaded banks.
+    """
+    global QUESTION_BANK, COMPILED_BANK, SCORE_TABLE
+    QUESTION_BANK = load_or_build_question_bank()
+    COMPILED_BANK = QUESTION_BANK.compile()
+    SCORE_TABLE = load_score_table(SCORE_TABLE_PATH, COMPILED_BANK)
+    return BankRegistry(BankVersion(1, QUESTION_BANK, COMPILED_BANK, SCORE_TABLE), source=QUESTION_BANK_PATH,
+                        caches=(SCORE_CACHE, FEEDBACK_CACHE))
+
+
+BANK_REGISTRY = LazyGlobal("BANK_REGISTRY", build_bank_registry)
+
+
+def __getattr__(name):
+    # app.QUESTION_BANK, app.COMPILED_BANK and app.SCORE_TABLE build the startup bank when they are first read
+    if name in ("QUESTION_BANK", "COMPILED_BANK", "SCORE_TABLE"):
+        BANK_REGISTRY.current()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class Warmup():
+    """
+    Runs function once per process in a background thread.  The readiness probe only succeeds once it has finished.
+    """
+    def __init__(self, function):
+        self.function = function
+        self.ready = Event()
+        self.seconds = None
+        self.error = None
+        self._lock = Lock()
+        self._pid = None
+
+    def ensure_started(self):
+        # Also checked on each request, since the thread doesn't survive forking into workers
+        if self.ready.is_set() or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        Thread(target=self.run, name="warmup", daemon=True).start()
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            self.function()
+        except Exception as e:
+            self.error = str(e)
+            app.logger.exception("Warmup failed")
+            return
+        self.seconds = time.perf_counter() - start
+        self.ready.set()
+
+
+def warm_up():
+    """
+    Takes every request path through its first call, so the first real requests don't pay for lazy imports, cold
+    caches or page faults.
+    """
+    import numpy as np
+
+    version = BANK_REGISTRY.current()
+    compiled_bank = version.compiled
+    engine = compiled_bank.engine
+    questions = list(engine.question_ids[:N_QUESTIONS])
+    answers = [0] * len(questions)
+    payload = {f"{key}{i}": value for i, pair in enumerate(zip(questions, answers), 1) for key, value in zip("qa", pair)}
+
+    if questions:
+        get_quiz_feedback(questions, answers, compiled_bank, None, version.score_table)
+        get_batch_quiz_feedback([payload, payload], compiled_bank)
+        compiled_bank.selector.select(0, N_QUESTIONS, ())
+    wire_table(compiled_bank)
+    if version.score_table is not None:
+        # Reads the whole table once, so its pages are in memory
+        int(version.score_table.scores.sum()) + int(version.score_table.ranks.sum())
+    RESULT_STORE.aggregate()
+    # A worker forked after the pool was loaded already has it
+    if RECOMMENDER_POOL_PATH and not RECOMMENDER.info()["pool"]:
+        RECOMMENDER.load_pool(RECOMMENDER_POOL_PATH)
+    RECOMMENDER.recommend(np.zeros((1, len(learning_outcomes))))
+    article_score_results([{"text": "warm up"}])
+    KEYWORD_EXTRACTOR.extract(["warm up"], [1])
+
+
+def get_quiz_feedback(questions: list, answers: list, compiled_bank: CompiledQuestionBank = None, seed=None,
+                      score_table: "ScoreTable" = None, rows=None, results: "ResultStore" = None, cohort=""):
+    """
+    Scores one quiz and builds its feedback.  When results is given, the quiz is recorded there under cohort.
+    """
+    import numpy as np
+
+    if compiled_bank is None:
+        version = BANK_REGISTRY.current()
+        compiled_bank = version.compiled
+        score_table = version.score_table
+    engine = compiled_bank.engine
+    fingerprint = compiled_bank.fingerprint
+
+    if rows is None:
+        rows = engine.rows(questions, answers)
+    else:
+        # Already checked by SubmissionValidator
+        rows = np.asarray(rows, dtype=np.intp)
+    key = tuple(sorted(rows.tolist()))
+
+    page = None
+    if seed is not None:
+        cached = FEEDBACK_CACHE.get(fingerprint, (key, seed))
+        if cached is not None:
+            feedback, page_to_visit, scores = cached
+            page = suggested_pages(scores)[0]
+            # Engagement recorded since then can make RECOMMENDER suggest another page
+            if SITE_PAGES[page] == page_to_visit:
+                METRICS.inc(SCORE_SOURCE_METRIC, FEEDBACK_CACHE_SOURCE)
+                if results is not None:
+                    results.record([cohort], [questions], [answers], scores)
+                return feedback, page_to_visit
+
+    with METRICS.time(STAGE_METRIC, SCORE_STAGE):
+        cached = None
+        source = SCORE_TABLE_SOURCE
+        if score_table is not None:
+            cached = score_table.lookup(key)
+        if cached is None:
+            source = SCORE_CACHE_SOURCE
+            cached = SCORE_CACHE.get(fingerprint, key)
+        if cached is None:
+            source = COMPUTED_SOURCE
+            scores = engine.score(rows)
+            scores.setflags(write=False)
+            fb = Feedback(scores, seed=seed, page=page)
+            SCORE_CACHE.put(fingerprint, key, (scores, fb.learning_outcomes_ranks))
+        else:
+            scores, ranks = cached
+            fb = Feedback(scores, seed=seed, ranks=ranks, page=page)
+    METRICS.inc(SCORE_SOURCE_METRIC, source)
+
+    with METRICS.time(STAGE_METRIC, CONSTRUCT_STAGE):
+        feedback, page_to_visit = fb.construct()
+    if seed is not None:
+        FEEDBACK_CACHE.put(fingerprint, (key, seed), (feedback, page_to_visit, scores))
+    if results is not None:
+        results.record([cohort], [questions], [answers], scores)
     return feedback, page_to_visit
 
+
+def get_batch_quiz_feedback(payloads: list, compiled_bank: CompiledQuestionBank = None, seed=None,
+                            results: "ResultStore" = None):
+    """
+    Validates every payload up front, scores the valid ones together, and returns one result per payload.
+
+    Invalid payloads get an {"Error", "Message"} result in their place instead of failing the whole batch.  The
+    phrase choices for the whole batch are drawn from seed in one go, unless a payload sets its own seed.  When
+    results is given, the valid quizzes are recorded there as one block.
+    """
+    import numpy as np
+
+    if compiled_bank is None:
+        compiled_bank = BANK_REGISTRY.current().compiled
+    engine = compiled_bank.engine
+
+    responses = [None] * len(payloads)
+    valid = []
+    seeds = []
+    cohorts = []
+    questions = []
+    answers = []
+    rows = []
+    lengths = []
+    with METRICS.time(STAGE_METRIC, VALIDATE_STAGE):
+        for i, payload in enumerate(payloads):
+            try:
+                q, a, quiz_rows = compiled_bank.validator.validate(payload)
+                quiz_seed = read_seed(payload, q, a)
+                cohort = read_cohort(payload, results)
+            except SubmissionError as e:
+                responses[i] = submission_error_result(e)
+                continue
+
+            valid.append(i)
+            seeds.append(quiz_seed)
+            cohorts.append(cohort)
+            questions.append(q)
+            answers.append(a)
+            rows.append(quiz_rows)
+            lengths.append(len(quiz_rows))
+
+    if valid:
+        with METRICS.time(STAGE_METRIC, SCORE_STAGE):
+            scores = engine.score_batch(np.concatenate(rows), lengths)
+        METRICS.inc(SCORE_SOURCE_METRIC, BATCH_SOURCE, len(valid))
+        if results is not None:
+            results.record(cohorts, questions, answers, scores)
+        with METRICS.time(STAGE_METRIC, RECOMMEND_STAGE):
+            pages = suggested_pages(scores)
+        with METRICS.time(STAGE_METRIC, CONSTRUCT_STAGE):
+            draws = draw_feedback_choices(len(valid), seed).tolist()
+            for i, score, quiz_seed, quiz_draws, page in zip(valid, scores, seeds, draws, pages):
+                if quiz_seed is None:
+                    fb = Feedback(score, draws=quiz_draws, page=page)
+                else:
+                    fb = Feedback(score, seed=quiz_seed, page=page)
+                feedback, page_to_visit = fb.construct()
+                responses[i] = {"Feedback": feedback, "Suggested Page": page_to_visit}
+
+    return responses
+
+
+def stream_batch_quiz_feedback(payloads, compiled_bank: CompiledQuestionBank = None, batch_size=STREAM_BATCH_SIZE,
+                               seed=None, results: "ResultStore" = None):
+    """
+    Generator version of get_batch_quiz_feedback that yields one NDJSON line per payload.
+
+    The first payload is scored on its own so the first line is sent straight away, then payloads are scored in
+    chunks of batch_size so memory use does not grow with the size of the batch.
+    """
+    import numpy as np
+
+    payloads = iter(payloads)
+    # One generator for the whole stream, so chunks don't repeat each other's choices
+    rng = np.random.default_rng(seed)
+    size = 1
+    while True:
+        chunk, error = read_chunk(payloads, size)
+        # Whatever was read before an error is still scored
+        for result in get_batch_quiz_feedback(chunk, compiled_bank, seed=rng, results=results):
+            yield json.dumps(result) + "\n"
+        if error is not None:
+            # The body can't be read any further, so report it and end the stream
+            METRICS.inc("quiz_errors_total", (("code", "invalid_batch"),))
+            yield json.dumps({"Error": str(error), "Message": BATCH_ERROR_MESSAGE, "Code": "invalid_batch"}) + "\n"
+            return
+        if len(chunk) < size:
+            return
+        size = batch_size
+
+
+def read_chunk(items, size):
+    """
+    Takes up to size items from an iterator, returning them with the exception that stopped it early, if any.
+    """
+    chunk = []
+    try:
+        for item in islice(items, size):
+            chunk.append(item)
+    except Exception as e:
+        return chunk, e
+    return chunk, None
+
+
+def wire_table(compiled_bank: CompiledQuestionBank):
+    from wire import WireTable
+
+    table = WIRE_TABLES.get(compiled_bank.fingerprint, "table")
+    if table is None:
+        table = WireTable(compiled_bank.engine, PHRASE_TABLES, MAX_QUIZ_QUESTIONS)
+        WIRE_TABLES.put(compiled_bank.fingerprint, "table", table)
+    return table
+
+
+def get_wire_quiz_feedback(records: list, compiled_bank: CompiledQuestionBank = None, seed=None,
+                           results: "ResultStore" = None):
+    """
+    Binary version of get_batch_quiz_feedback: scores decoded submission records and returns their encoded feedback
+    records, without the header.
+
+    Phrases are chosen exactly as get_batch_quiz_feedback chooses them, but only their IDs are sent, so no text is
+    built.  Records that failed to decode, or are invalid, get their error code in their place.
+    """
+    import numpy as np
+    from wire import ERROR_CODE_IDS, WireFormatError
+
+    if compiled_bank is None:
+        compiled_bank = BANK_REGISTRY.current().compiled
+    engine = compiled_bank.engine
+    table = wire_table(compiled_bank)
+
+    output = np.zeros(len(records), dtype=table.dtype)
+    valid = []
+    seeds = []
+    cohorts = []
+    questions = []
+    answers = []
+    rows = []
+    lengths = []
+    with METRICS.time(STAGE_METRIC, VALIDATE_STAGE):
+        for i, record in enumerate(records):
+            try:
+                if isinstance(record, WireFormatError):
+                    raise record
+                cohort = read_cohort({"cohort": record.cohort}, results) if record.cohort else ""
+            except (WireFormatError, SubmissionError) as e:
+                METRICS.inc("quiz_errors_total", (("code", e.code),))
+                output["code"][i] = ERROR_CODE_IDS[e.code]
+                continue
+
+            valid.append(i)
+            seeds.append(submission_seed(record.questions, record.answers) if record.seed == "submission"
+                         else record.seed)
+            cohorts.append(cohort)
+            questions.append(record.questions)
+            answers.append(record.answers)
+            rows.append(record.rows)
+            lengths.append(len(record.rows))
+
+    if valid:
+        with METRICS.time(STAGE_METRIC, SCORE_STAGE):
+            scores = engine.score_batch(np.concatenate(rows), lengths)
+            # Same ranking as Feedback
+            ranks = np.argsort(scores, axis=1)[:, ::-1]
+        METRICS.inc(SCORE_SOURCE_METRIC, BATCH_SOURCE, len(valid))
+        if results is not None:
+            results.record(cohorts, questions, answers, scores)
+        with METRICS.time(STAGE_METRIC, RECOMMEND_STAGE):
+            pages = suggested_pages(scores)
+        with METRICS.time(STAGE_METRIC, CONSTRUCT_STAGE):
+            draws = draw_feedback_choices(len(valid), seed)
+            for j, quiz_seed in enumerate(seeds):
+                if quiz_seed is not None:
+                    rng = Random(quiz_seed)
+                    draws[j] = [rng.random() for _ in range(N_FEEDBACK_DRAWS)]
+            output["ranks"][valid] = ranks
+            output["phrases"][valid] = table.phrase_ids(ranks, draws, pages)
+            output["scores"][valid] = scores
+
+    with METRICS.time(STAGE_METRIC, SERIALIZE_STAGE):
+        return output.tobytes()
+
+
+def stream_wire_quiz_feedback(records, compiled_bank: CompiledQuestionBank = None, batch_size=STREAM_BATCH_SIZE,
+                              seed=None, results: "ResultStore" = None):
+    """
+    Generator version of get_wire_quiz_feedback that yields the header, then the feedback records in chunks as the
+    submission records are read, like stream_batch_quiz_feedback.
+    """
+    import numpy as np
+    from wire import WireFormatError
+
+    if compiled_bank is None:
+        compiled_bank = BANK_REGISTRY.current().compiled
+    table = wire_table(compiled_bank)
+    yield table.header
+    rng = np.random.default_rng(seed)
+    size = 1
+    while True:
+        chunk, error = read_chunk(records, size)
+        # Whatever was read before an error is still scored
+        if chunk:
+            yield get_wire_quiz_feedback(chunk, compiled_bank, seed=rng, results=results)
+        if error is not None:
+            # The body can't be read any further, so the stream ends with a record holding only the reason
+            if isinstance(error, WireFormatError):
+                code = error.code
+            else:
+                code = "internal_error"
+                app.logger.exception("Binary stream ended early", exc_info=error)
+            METRICS.inc("quiz_errors_total", (("code", code),))
+            yield table.error_record(code)
+            return
+        if len(chunk) < size:
+            return
+        size = batch_size
+
+
+# Started by the server entry points (gunicorn's when_ready, the ASGI lifespan, __main__) or the first request, never
+# by importing the app
+WARMUP = Warmup(warm_up)
+
 if __name__ == '__main__':
-    # kw_model = KeyBERT()
+    WARMUP.ensure_started()
     app.run(port=5000)
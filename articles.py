@@ -0,0 +1,329 @@
+"""
+Scores article text for the fake news red flags the quiz teaches (questions MC6 to MC8): sensational or clickbait
+headlines, emotional language and missing sources, plus a few related signals.
+
+Each lexicon is compiled once into a single regular expression shaped like a trie of its phrases, so a text is
+scanned once per lexicon.  The counts become a feature matrix for the whole batch, and the fake score and the six
+learning outcome dimensions are worked out from it with matrix products.
+
+Large feeds can be scored offline on every core:
+    python articles.py feed.jsonl > scores.jsonl
+where each line of feed.jsonl is {"text": "...", "headline": "..."} ("headline" is optional, and any "id" is copied
+to the output).  A line that isn't a valid article gets {"line": ..., "error": "..."} in its place.
+"""
+
+import json
+import os
+import re
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+CHUNK_SIZE = 256
+
+CLICKBAIT = [
+    "you won't believe", "you will not believe", "what happens next", "what happened next", "will shock you",
+    "shocking", "jaw-dropping", "mind-blowing", "unbelievable", "this one trick", "one weird trick", "doctors hate",
+    "the truth about", "exposed", "gone wrong", "must see", "must-see", "breaking", "miracle", "secret", "revealed",
+    "can't believe", "goes viral", "the reason why", "number will surprise you", "insane", "epic", "bombshell",
+]
+EMOTIONAL = [
+    "outrage", "outraged", "outrageous", "furious", "fury", "terrifying", "terrified", "horrifying", "horrific",
+    "disgusting", "disgraceful", "shameful", "heartbreaking", "devastating", "devastated", "evil", "sickening",
+    "appalling", "panic", "chaos", "nightmare", "catastrophe", "catastrophic", "destroy", "destroyed", "destroys",
+    "slams", "blasts", "rips", "crushes", "humiliates", "betrayal", "betrayed", "scandal", "scandalous", "hate",
+    "hatred", "fear", "terror", "amazing", "incredible", "tragic", "brutal", "vile", "disaster", "alarming",
+]
+ABSOLUTES = [
+    "always", "never", "everyone", "nobody", "everything", "nothing", "all of them", "the best", "the worst",
+    "ever", "completely", "totally", "absolutely", "100%", "guaranteed", "proven", "undeniable",
+]
+UNVERIFIED = [
+    "sources say", "sources said", "experts say", "experts claim", "scientists say", "people are saying",
+    "many people are saying", "some say", "it is believed", "reportedly", "rumoured", "rumored", "allegedly",
+    "anonymous source", "an insider", "insiders say", "according to some", "word is",
+]
+SOURCES = [
+    "according to", "said in a statement", "told reporters", "told", "said", "stated", "reported by", "published in",
+    "a study by", "researchers at", "university", "spokesperson", "spokesman", "spokeswoman", "department of",
+    "ministry of", "data from", "survey by", "peer-reviewed", "journal", "press release", "official figures",
+]
+OPINION = [
+    "obviously", "clearly", "of course", "everyone knows", "so-called", "i think", "i believe", "in my opinion",
+    "we all know", "undoubtedly", "the fact is", "make no mistake", "no one can deny", "radical", "corrupt",
+    "elites", "puppet", "propaganda", "agenda",
+]
+SHARE_PRESSURE = [
+    "share this", "share before", "before it's deleted", "before it is deleted", "before they delete",
+    "spread the word", "pass it on", "forward this", "share if you agree", "tell everyone", "repost",
+]
+CONSPIRACY = [
+    "they don't want you to know", "what they don't tell you", "cover-up", "cover up", "mainstream media",
+    "wake up", "the truth is out there", "hidden agenda", "big pharma", "deep state", "hoax", "plandemic",
+    "censored", "banned video", "the government is hiding", "secret plan",
+]
+
+URL_PATTERN = re.compile(r"https?://\S+|www\.\S+")
+QUOTE_PATTERN = re.compile(r"[\"“][^\"“”]{12,}[\"”]")
+NUMBER_PATTERN = re.compile(r"\b\d[\d,.]*%?")
+WORD_PATTERN = re.compile(r"[A-Za-z0-9'’]+")
+SENTENCE_PATTERN = re.compile(r"[.!?]+")
+
+
+def trie_pattern(phrases):
+    """
+    A regular expression matching any of phrases (case-insensitively, on word boundaries), with shared prefixes
+    factored out the way a trie (or Aho-Corasick automaton) stores them, so the engine tries each prefix once.
+    """
+    trie = dict()
+    for phrase in phrases:
+        node = trie
+        for char in phrase.lower():
+            node = node.setdefault(char, dict())
+        node[""] = dict()
+
+    def build(node):
+        if list(node) == [""]:
+            return ""
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        pattern = alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+        if "" in node:
+            pattern = "(?:" + pattern + ")?"
+        return pattern
+
+    return re.compile(r"(?<![\w])" + build(trie) + r"(?![\w])", re.IGNORECASE)
+
+
+LEXICONS = [(name, trie_pattern(phrases)) for name, phrases in (
+    ("clickbait", CLICKBAIT),
+    ("emotional", EMOTIONAL),
+    ("absolutes", ABSOLUTES),
+    ("unverified", UNVERIFIED),
+    ("sources", SOURCES),
+    ("opinion", OPINION),
+    ("share_pressure", SHARE_PRESSURE),
+    ("conspiracy", CONSPIRACY),
+)]
+
+FEATURES = ["headline_clickbait", "headline_caps", "headline_exclamation"] + [name for name, _ in LEXICONS] + \
+           ["exclamation", "caps", "quotes", "links", "numbers", "missing_sources"]
+FEATURE_INDEX = {name: i for i, name in enumerate(FEATURES)}
+CLICKBAIT_PATTERN = dict(LEXICONS)["clickbait"]
+
+# How many of each signal (per 100 words for the lexicons, per sentence for exclamation marks) counts as half of
+# its full strength.  Features saturate at 1 as x / (x + half), except missing_sources which is 0 or 1.
+HALF_STRENGTH = {
+    "headline_clickbait": 0.5, "headline_caps": 0.2, "headline_exclamation": 0.5, "clickbait": 0.5,
+    "emotional": 1.5, "absolutes": 1.5, "unverified": 0.5, "sources": 1.0, "opinion": 1.0, "share_pressure": 0.3,
+    "conspiracy": 0.3, "exclamation": 0.2, "caps": 0.05, "quotes": 1.0, "links": 1.0, "numbers": 1.5,
+}
+
+# Evidence for (positive) or against (negative) the article being fake
+WEIGHTS = {
+    "headline_clickbait": 1.6, "headline_caps": 1.0, "headline_exclamation": 0.8, "clickbait": 1.0, "emotional": 1.4,
+    "absolutes": 0.6, "unverified": 1.0, "sources": -1.2, "opinion": 0.8, "share_pressure": 1.5, "conspiracy": 1.8,
+    "exclamation": 0.8, "caps": 0.8, "quotes": -0.6, "links": -0.4, "numbers": -0.4, "missing_sources": 1.2,
+}
+BIAS = -2.5
+
+# Which learning outcomes each red flag exercises, in the order of learning_outcomes in app.py:
+# what is fake news, what is biased news, identifying biased information, intentional fake news, unintentional fake
+# news, consequences of falling for fake news
+OUTCOMES = {
+    "headline_clickbait": [1, 0, 0, 1, 0, 0], "headline_caps": [1, 0, 0, 1, 0, 0],
+    "headline_exclamation": [1, 0, 0, 1, 0, 0], "clickbait": [1, 0, 0, 1, 0, 0], "emotional": [0, 1, 1, 1, 0, 0],
+    "absolutes": [0, 1, 1, 0, 0, 0], "unverified": [1, 0, 0, 0, 1, 0], "sources": [0, 0, 0, 0, 0, 0],
+    "opinion": [0, 1, 1, 0, 0, 0], "share_pressure": [0, 0, 0, 1, 0, 1], "conspiracy": [1, 0, 0, 1, 0, 1],
+    "exclamation": [0, 1, 1, 0, 0, 0], "caps": [0, 1, 0, 1, 0, 0], "quotes": [0, 0, 0, 0, 0, 0],
+    "links": [0, 0, 0, 0, 0, 0], "numbers": [0, 0, 0, 0, 0, 0], "missing_sources": [1, 0, 0, 0, 1, 0],
+}
+
+RED_FLAGS = {
+    "headline_clickbait": "Sensational or clickbait headline",
+    "headline_caps": "Headline in capital letters",
+    "headline_exclamation": "Exclamation marks in the headline",
+    "clickbait": "Clickbait phrases",
+    "emotional": "Emotional language",
+    "absolutes": "Sweeping, absolute claims",
+    "unverified": "Vague or anonymous sources",
+    "opinion": "Opinion presented as fact",
+    "share_pressure": "Pressure to share",
+    "conspiracy": "Conspiracy language",
+    "exclamation": "Many exclamation marks",
+    "caps": "Words in capital letters",
+    "missing_sources": "No sources, quotes or links",
+}
+RED_FLAG_THRESHOLD = 0.5
+
+HALF = np.asarray([HALF_STRENGTH.get(name, 1.0) for name in FEATURES])
+WEIGHT_VECTOR = np.asarray([WEIGHTS[name] for name in FEATURES])
+OUTCOME_MATRIX = np.asarray([OUTCOMES[name] for name in FEATURES], dtype=np.float64)
+
+
+def split_article(text, headline=None):
+    """
+    Uses the first line of a multi-line text as its headline when none is given.
+    """
+    if headline is None:
+        first, newline, rest = text.strip().partition("\n")
+        if newline and len(first) <= 200:
+            return first, rest
+        return "", text
+    return headline, text
+
+
+def article_counts(headline, body):
+    """
+    The raw counts for one article, in the order of FEATURES.  The last six are filled in by article_features.
+    """
+    headline_words = WORD_PATTERN.findall(headline)
+    counts = [
+        len(CLICKBAIT_PATTERN.findall(headline)),
+        sum(1 for word in headline_words if len(word) > 1 and word.isupper()) / max(len(headline_words), 1),
+        headline.count("!"),
+    ]
+    text = headline + "\n" + body
+    counts.extend(len(pattern.findall(text)) for _, pattern in LEXICONS)
+
+    words = WORD_PATTERN.findall(body)
+    counts.extend([
+        body.count("!"),
+        sum(1 for word in words if len(word) > 2 and word.isupper()),
+        len(QUOTE_PATTERN.findall(body)),
+        len(URL_PATTERN.findall(body)),
+        len(NUMBER_PATTERN.findall(body)),
+        0,
+    ])
+    return counts, len(words) + len(headline_words), len(SENTENCE_PATTERN.findall(body)) + 1
+
+
+def article_features(articles):
+    """
+    The (n_articles, n_features) matrix of feature strengths from 0 to 1, for (headline, body) pairs.
+    """
+    counts = np.empty((len(articles), len(FEATURES)))
+    n_words = np.empty(len(articles))
+    n_sentences = np.empty(len(articles))
+    for i, (headline, body) in enumerate(articles):
+        counts[i], n_words[i], n_sentences[i] = article_counts(headline, body)
+
+    per_100_words = 100 / np.maximum(n_words, 1)
+    lexicon_columns = [FEATURE_INDEX[name] for name, _ in LEXICONS] + [FEATURE_INDEX["numbers"]]
+    counts[:, lexicon_columns] *= per_100_words[:, None]
+    counts[:, FEATURE_INDEX["exclamation"]] /= n_sentences
+    counts[:, FEATURE_INDEX["caps"]] /= np.maximum(n_words, 1)
+    strengths = counts / (counts + HALF)
+    strengths[:, FEATURE_INDEX["missing_sources"]] = (counts[:, FEATURE_INDEX["sources"]] +
+                                                      counts[:, FEATURE_INDEX["quotes"]] +
+                                                      counts[:, FEATURE_INDEX["links"]] == 0)
+    return strengths
+
+
+def score_articles(articles):
+    """
+    Scores (headline, body) pairs.  Returns the probability-like fake score of each article, its (n_articles, 6)
+    learning outcome dimensions from 0 to 1, and its feature strengths.
+    """
+    features = article_features(articles)
+    scores = 1 / (1 + np.exp(-(features @ WEIGHT_VECTOR + BIAS)))
+    flags = features * (WEIGHT_VECTOR > 0)
+    outcomes = flags @ OUTCOME_MATRIX / np.maximum(OUTCOME_MATRIX.sum(axis=0), 1)
+    return scores, outcomes, features
+
+
+def article_results(articles):
+    """
+    JSON-ready results for (headline, body) pairs, with the red flags each article shows.
+    """
+    scores, outcomes, features = score_articles(articles)
+    results = []
+    for score, outcome, feature in zip(scores.tolist(), outcomes.round(4).tolist(), features.tolist()):
+        red_flags = [RED_FLAGS[name] for name, strength in zip(FEATURES, feature)
+                     if name in RED_FLAGS and strength >= RED_FLAG_THRESHOLD]
+        results.append({"score": round(score, 4), "outcomes": outcome, "red_flags": red_flags})
+    return results
+
+
+def score_feed(articles, processes=None, chunk_size=CHUNK_SIZE):
+    """
+    Scores any number of (headline, body) pairs in chunks across a process pool, yielding results in order.  Only a
+    couple of chunks per process are in flight at once, so a feed of any size is read as it is scored.
+    """
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(processes) as executor:
+        pending = deque()
+        for chunk in _chunks(articles, chunk_size):
+            pending.append(executor.submit(article_results, chunk))
+            if len(pending) >= 2 * processes:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def read_feed_line(line):
+    """
+    The id, headline and body of one line of a feed.  Raises ValueError for a line that isn't a valid article.
+    """
+    article = json.loads(line)
+    if type(article) is not dict:
+        raise ValueError("The line should be a JSON object.")
+    text = article.get("text")
+    if type(text) is not str:
+        raise ValueError("'text' should be a string.")
+    headline = article.get("headline")
+    if headline is not None and type(headline) is not str:
+        raise ValueError("'headline' should be a string.")
+    return (article.get("id"), *split_article(text, headline))
+
+
+def main(argv):
+    if len(argv) != 2:
+        print(__doc__)
+        return 2
+
+    # One entry per line, filled as the feed is read, which is always ahead of the results: the id of an article
+    # being scored, or the result already worked out for a line that isn't a valid article
+    lines = deque()
+
+    def read_feed(f):
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    article_id, headline, body = read_feed_line(line)
+                except ValueError as e:
+                    lines.append((None, {"line": number, "error": str(e)}))
+                    continue
+                lines.append((article_id, None))
+                yield headline, body
+
+    def write_errors():
+        # Invalid lines are reported in their place, between the results of the articles around them
+        while lines and lines[0][1] is not None:
+            sys.stdout.write(json.dumps(lines.popleft()[1]) + "\n")
+
+    with open(argv[1]) as f:
+        for result in score_feed(read_feed(f)):
+            write_errors()
+            article_id, _ = lines.popleft()
+            if article_id is not None:
+                result = {"id": article_id, **result}
+            sys.stdout.write(json.dumps(result) + "\n")
+        write_errors()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
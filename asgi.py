@@ -0,0 +1,390 @@
+"""
+ASGI entry point for the quiz feedback API.
+
+It serves the same /quiz_feedback, /quiz_feedback/batch, /phrase_table and /ready contract as the Flask app in app.py,
+binary bodies included, and counts requests in the same metrics, but with asyncio handlers: bodies are decoded once
+(with orjson when it is installed), scoring and recording results run in a thread pool so the event loop keeps
+accepting requests, and at most ASGI_MAX_CONCURRENCY requests are worked on at once.  Requests beyond that wait, and
+once ASGI_MAX_PENDING are waiting new requests are turned away with a 503 so clients back off.  Every other path
+(/metrics, /analytics, /keywords, /sessions and so on) is passed to the Flask app itself through a WSGI adapter, in the
+same thread pool and under the same limits, so both entry points serve the whole API.
+
+Run it with several workers through gunicorn.conf.py, which imports the app (and so builds the compiled bank, the
+phrase tables and maps the score table) before forking, so the workers share that memory:
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:application
+
+Or on its own for development:
+    uvicorn asgi:application --port 5000
+"""
+
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from app import (BANK_REGISTRY, BATCH_ERROR_MESSAGE, METRICS, PHRASE_TABLE_MAX_AGE, QUESTION_BANK_RELOAD_INTERVAL,
+                 RESULT_STORE, STREAM_BATCH_SIZE, WARMUP, WIRE_ERROR_MESSAGE, get_batch_quiz_feedback,
+                 get_wire_quiz_feedback, quiz_feedback_result, read_batch_seed, wire_table)
+from app import app as flask_app
+
+MAX_CONCURRENCY = int(os.environ.get("ASGI_MAX_CONCURRENCY", 64))
+MAX_PENDING = int(os.environ.get("ASGI_MAX_PENDING", 1024))
+MAX_BODY_SIZE = int(os.environ.get("ASGI_MAX_BODY_SIZE", 64 * 1024 * 1024))
+SCORING_THREADS = int(os.environ.get("ASGI_SCORING_THREADS", 4))
+
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl")
+
+
+if orjson is not None:
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+else:
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj):
+        return json.dumps(obj).encode()
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class QuizFeedbackASGI():
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, max_pending=MAX_PENDING, scoring_threads=SCORING_THREADS):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.pending = 0
+        # Created on first use, so they belong to the event loop of the worker process
+        self._semaphore = None
+        self._executor = None
+        self._scoring_threads = scoring_threads
+        # Each route with the name of the matching Flask endpoint, so both apps report the same request metrics.  Other
+        # requests go to the Flask app, which counts them itself
+        self.routes = {
+            ("GET", "/ready"): ("readiness", self.readiness),
+            ("POST", "/quiz_feedback"): ("get_quiz_feedback", self.quiz_feedback),
+            ("POST", "/quiz_feedback/batch"): ("get_batch_quiz_feedback", self.batch_quiz_feedback),
+            ("GET", "/phrase_table"): ("get_phrase_table", self.phrase_table),
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        BANK_REGISTRY.ensure_watching(QUESTION_BANK_RELOAD_INTERVAL)
+        # Also started by the lifespan, this covers servers that don't send one
+        WARMUP.ensure_started()
+        start = time.perf_counter()
+        endpoint, route = self.routes.get((scope["method"], scope["path"]), (None, self.wsgi))
+        status = None
+
+        async def send_counted(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        if endpoint is None:
+            await self.serve(route, scope, receive, send)
+            return
+        try:
+            await self.serve(route, scope, receive, send_counted)
+        finally:
+            METRICS.inc("quiz_requests_total", (("endpoint", endpoint), ("status", status or 500)))
+            METRICS.observe("quiz_request_duration_seconds", (("endpoint", endpoint),), time.perf_counter() - start)
+
+    async def serve(self, route, scope, receive, send):
+        if self.pending >= self.max_pending:
+            await self.send_json(send, 503, {"Error": "Service Unavailable",
+                                             "Message": "Too many requests are waiting, please retry later."},
+                                 [(b"retry-after", b"1")])
+            return
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.pending += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.pending -= 1
+        try:
+            await route(scope, receive, send)
+        finally:
+            self._semaphore.release()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._executor = ThreadPoolExecutor(self._scoring_threads, thread_name_prefix="quiz-scoring")
+                WARMUP.ensure_started()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def run_scoring(self, function, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self._scoring_threads, thread_name_prefix="quiz-scoring")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def quiz_feedback(self, scope, receive, send):
+        from wire import SUBMISSION_TYPE
+
+        version = BANK_REGISTRY.current()
+        binary = mimetype(scope) == SUBMISSION_TYPE
+        try:
+            body = await read_body(receive)
+            payload = body if binary else loads(body)
+        except Exception as e:
+            payload = e
+
+        if binary and not isinstance(payload, Exception):
+            await self.wire_feedback(send, version, payload)
+            return
+
+        # Scored in the pool like a batch, as recording the result can write to disk
+        result = await self.run_scoring(quiz_feedback_result, payload, version)
+        await self.send_json(send, 200, result, version_headers(version))
+
+    async def batch_quiz_feedback(self, scope, receive, send):
+        import numpy as np
+        from wire import SUBMISSION_TYPE
+
+        version = BANK_REGISTRY.current()
+        headers = version_headers(version)
+        query = parse_qs(scope.get("query_string", b"").decode())
+        try:
+            seed = read_batch_seed(query.get("seed", [None])[0])
+            body = await read_body(receive)
+            if mimetype(scope) != SUBMISSION_TYPE:
+                payloads = read_batch_body(body, header(scope, b"content-type"))
+        except Exception as e:
+            await self.send_json(send, 200, {"Error": str(e), "Message": BATCH_ERROR_MESSAGE}, headers)
+            return
+
+        stream = query.get("stream", [""])[0].lower() in ("1", "true", "yes") or \
+            "application/x-ndjson" in header(scope, b"accept")
+        if mimetype(scope) == SUBMISSION_TYPE:
+            await self.wire_feedback(send, version, body, seed, stream)
+            return
+        if not stream:
+            results = await self.run_scoring(get_batch_quiz_feedback, payloads, version.compiled, seed,
+                                           RESULT_STORE)
+            await self.send_json(send, 200, results, headers)
+            return
+
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/x-ndjson")] + headers})
+        # Same chunking as the Flask stream: the first quiz on its own, then STREAM_BATCH_SIZE at a time, all drawing
+        # from one generator so chunks don't repeat each other's choices
+        rng = np.random.default_rng(seed)
+        start = 0
+        size = 1
+        while start < len(payloads):
+            chunk = payloads[start:start + size]
+            results = await self.run_scoring(get_batch_quiz_feedback, chunk, version.compiled, rng,
+                                           RESULT_STORE)
+            await send({"type": "http.response.body", "body": b"".join(dumps(result) + b"\n" for result in results),
+                        "more_body": True})
+            start += size
+            size = STREAM_BATCH_SIZE
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def wire_feedback(self, send, version, body, seed=None, stream=False):
+        import numpy as np
+        from wire import FEEDBACK_TYPE, WireFormatError
+
+        headers = version_headers(version)
+        table = wire_table(version.compiled)
+        try:
+            records = list(table.read_submissions((body,)))
+        except WireFormatError as e:
+            await self.send_json(send, 200, {"Error": str(e), "Message": WIRE_ERROR_MESSAGE, "Code": e.code}, headers)
+            return
+
+        if not stream:
+            output = await self.run_scoring(get_wire_quiz_feedback, records, version.compiled, seed, RESULT_STORE)
+            await self.send_body(send, 200, FEEDBACK_TYPE, table.header + output, headers)
+            return
+
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", FEEDBACK_TYPE.encode())] + headers})
+        await send({"type": "http.response.body", "body": table.header, "more_body": True})
+        rng = np.random.default_rng(seed)
+        start = 0
+        size = 1
+        while start < len(records):
+            output = await self.run_scoring(get_wire_quiz_feedback, records[start:start + size], version.compiled,
+                                            rng, RESULT_STORE)
+            await send({"type": "http.response.body", "body": output, "more_body": True})
+            start += size
+            size = STREAM_BATCH_SIZE
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def wsgi(self, scope, receive, send):
+        try:
+            body = await read_body(receive)
+        except BodyTooLarge as e:
+            await self.send_json(send, 413, {"Error": "Payload Too Large", "Message": str(e)})
+            return
+        # Flask reads the buffered body and its response is collected in the pool, so the event loop never blocks
+        status, headers, body = await self.run_scoring(call_wsgi, flask_app, wsgi_environ(scope, body))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def readiness(self, scope, receive, send):
+        if not WARMUP.ready.is_set():
+            await self.send_json(send, 503, {"Ready": False, "Error": WARMUP.error})
+            return
+        await self.send_json(send, 200, {"Ready": True, "Warmup Seconds": WARMUP.seconds})
+
+    async def phrase_table(self, scope, receive, send):
+        version = BANK_REGISTRY.current()
+        table = wire_table(version.compiled)
+        etag = f'"{table.version}"'.encode()
+        headers = version_headers(version) + [(b"etag", etag),
+                                              (b"cache-control", f"public, max-age={PHRASE_TABLE_MAX_AGE}".encode())]
+        if etag in header(scope, b"if-none-match").encode("latin-1"):
+            await self.send_body(send, 304, "application/json", b"", headers)
+            return
+        await self.send_json(send, 200, table.document, headers)
+
+    async def send_json(self, send, status, obj, headers=()):
+        await self.send_body(send, status, "application/json", dumps(obj), headers)
+
+    async def send_body(self, send, status, content_type, body, headers=()):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", content_type.encode()),
+                                (b"content-length", str(len(body)).encode())] + list(headers)})
+        await send({"type": "http.response.body", "body": body})
+
+
+async def read_body(receive):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ConnectionError("The client disconnected")
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_SIZE:
+            raise BodyTooLarge(f"The request body is larger than {MAX_BODY_SIZE} bytes")
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+def read_batch_body(body, content_type):
+    if content_type.split(";")[0].strip() in NDJSON_TYPES:
+        payloads = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                payloads.append(loads(line))
+            except ValueError as e:
+                # Reported in place for that line, rather than failing the batch
+                payloads.append(e)
+        return payloads
+
+    payloads = loads(body)
+    if type(payloads) is dict:
+        payloads = payloads.get("submissions")
+    if type(payloads) is not list:
+        raise ValueError("Expected a list of quiz payloads")
+    return payloads
+
+
+def wsgi_environ(scope, body):
+    """
+    The WSGI environ (PEP 3333) of an ASGI HTTP request whose body has been read.
+    """
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        # WSGI paths are the request's bytes decoded as latin-1
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope.get("headers", ()):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def call_wsgi(application, environ):
+    """
+    Runs a WSGI application to completion.  Returns the status code, the headers as ASGI byte pairs, and the body.
+    """
+    response = []
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        response[:] = [int(status.split(" ", 1)[0]),
+                       [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]]
+        return chunks.append
+
+    iterable = application(environ, start_response)
+    try:
+        chunks.extend(iterable)
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
+    return response[0], response[1], b"".join(chunks)
+
+
+def header(scope, name):
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+
+def mimetype(scope):
+    return header(scope, b"content-type").split(";")[0].strip()
+
+
+def version_headers(version):
+    return [(b"x-question-bank-version", str(version.version).encode())]
+
+
+application = QuizFeedbackASGI()
@@ -0,0 +1,347 @@
+"""
+Benchmarks for the scoring and feedback pipeline.
+
+Measures building the question bank, Quiz.score_quiz, Feedback.construct and whole /quiz_feedback requests through
+Flask's test client, using synthetic submissions drawn from the question bank with a fixed seed, so runs on the same
+machine are comparable.  Reports latency percentiles for single requests, quizzes per second through
+/quiz_feedback/batch at several batch sizes (as JSON and in the binary wire format), the memory allocated per
+request, page recommendations against a pool of a million learners, and the cold start: the time from launching a
+fresh interpreter to its first response, and to the readiness probe passing.
+
+Usage:
+    python benchmark.py [--quick] [--output results.json] [--compare baseline.json] [--threshold 0.25]
+                        [--cold-start-budget 3]
+
+With --compare, exits with status 1 if any benchmark's median latency (or batch throughput) is more than threshold
+worse than in the baseline file.  It also exits with status 1 if the median time to the first response is over the
+cold start budget, in seconds.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+# Benchmark quizzes are not real results, so they are only aggregated in memory
+os.environ.setdefault("QUIZ_RESULTS_DIR", "")
+
+import app  # noqa: E402
+import recommend  # noqa: E402
+import wire  # noqa: E402
+
+BATCH_SIZES = (1, 16, 256, 4096)
+LATENCY_PERCENTILES = (50, 90, 99, 99.9)
+COLD_START_BUDGET = 3.0
+RECOMMEND_POOL_SIZE = 1_000_000
+
+# Run in a fresh interpreter, timed from just before it was launched
+COLD_START_SCRIPT = """
+import json, sys, time
+launched = float(sys.argv[1])
+import app
+imported = time.time()
+response = app.app.test_client().post("/quiz_feedback", json=json.loads(sys.argv[2]))
+assert response.status_code == 200 and "Feedback" in response.json, response.data
+first_response = time.time()
+app.WARMUP.ready.wait(60)
+ready = time.time()
+print(json.dumps({"import": imported - launched, "first_response": first_response - launched,
+                  "ready": ready - launched}))
+"""
+
+
+def synthetic_submissions(compiled_bank, n, n_questions=app.N_QUESTIONS, seed=0):
+    """
+    n quiz payloads of n_questions distinct questions each, with uniformly random answers.
+    """
+    rng = np.random.default_rng(seed)
+    engine = compiled_bank.engine
+    question_ids = engine.question_ids
+    payloads = []
+    for _ in range(n):
+        questions = [question_ids[i] for i in rng.choice(len(question_ids), n_questions, replace=False)]
+        payload = dict()
+        for i, question in enumerate(questions, 1):
+            payload[f"q{i}"] = question
+            payload[f"a{i}"] = int(rng.integers(engine.n_answers[question]))
+        payloads.append(payload)
+    return payloads
+
+
+def time_calls(function, arguments, warmup=20):
+    """
+    Calls function once per argument and returns each call's latency in microseconds.
+    """
+    for argument in arguments[:warmup]:
+        function(argument)
+
+    latencies = np.empty(len(arguments))
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for i, argument in enumerate(arguments):
+            start = time.perf_counter_ns()
+            function(argument)
+            latencies[i] = time.perf_counter_ns() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return latencies / 1000
+
+
+def latency_summary(latencies):
+    summary = {"n": len(latencies), "mean_us": float(latencies.mean()), "min_us": float(latencies.min()),
+               "max_us": float(latencies.max())}
+    for p, value in zip(LATENCY_PERCENTILES, np.percentile(latencies, LATENCY_PERCENTILES)):
+        summary[f"p{p:g}_us"] = float(value)
+    return summary
+
+
+def memory_per_call(function, arguments):
+    """
+    The mean number of bytes allocated, and the largest peak, over calls of function.
+    """
+    allocated = []
+    peaks = []
+    tracemalloc.start()
+    try:
+        for argument in arguments:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            function(argument)
+            after, peak = tracemalloc.get_traced_memory()
+            allocated.append(max(after - before, 0))
+            peaks.append(peak - before)
+    finally:
+        tracemalloc.stop()
+    return {"retained_bytes": float(np.mean(allocated)), "peak_bytes": int(max(peaks))}
+
+
+def bench_create_question_bank(n):
+    return latency_summary(time_calls(lambda _: app.create_question_bank(), [None] * n, warmup=2))
+
+
+def bench_score_quiz(bank, payloads):
+    def make_quiz(payload):
+        quiz = app.Quiz(bank)
+        quiz.add_questions([payload[f"q{i}"] for i in range(1, app.N_QUESTIONS + 1)])
+        for i in range(app.N_QUESTIONS):
+            quiz.add_answer(i, payload[f"a{i + 1}"])
+        return quiz
+
+    quizzes = [make_quiz(payload) for payload in payloads]
+    return latency_summary(time_calls(app.Quiz.score_quiz, quizzes))
+
+
+def bench_feedback_construct(compiled_bank, payloads):
+    engine = compiled_bank.engine
+    feedbacks = [app.Feedback(engine.score(compiled_bank.validator.validate(payload)[2]), seed=i)
+                 for i, payload in enumerate(payloads)]
+    return latency_summary(time_calls(app.Feedback.construct, feedbacks))
+
+
+def bench_request(client, payloads):
+    def post(payload):
+        response = client.post("/quiz_feedback", json=payload)
+        assert response.status_code == 200 and "Feedback" in response.json, response.data
+
+    summary = latency_summary(time_calls(post, payloads))
+    summary.update(memory_per_call(post, payloads[:200]))
+    return summary
+
+
+def bench_batch(client, payloads, batch_sizes, min_quizzes):
+    throughput = dict()
+    for batch_size in batch_sizes:
+        batches = [payloads[i:i + batch_size] for i in range(0, len(payloads) - batch_size + 1, batch_size)]
+        n_batches = max(1, min_quizzes // batch_size)
+        batches = (batches * (n_batches // max(len(batches), 1) + 1))[:n_batches]
+
+        def post(batch):
+            response = client.post("/quiz_feedback/batch", json=batch)
+            assert response.status_code == 200 and len(response.json) == len(batch), response.data
+
+        post(batches[0])
+        start = time.perf_counter()
+        for batch in batches:
+            post(batch)
+        elapsed = time.perf_counter() - start
+        throughput[str(batch_size)] = {"quizzes_per_second": len(batches) * batch_size / elapsed,
+                                       "batches": len(batches)}
+    return throughput
+
+
+def bench_wire_batch(client, payloads, batch_sizes, min_quizzes):
+    """
+    Like bench_batch, but with the binary wire format in both directions.
+    """
+    table = app.wire_table(app.BANK_REGISTRY.current().compiled)
+    indices = {question: i for i, question in enumerate(table.question_ids)}
+    submissions = [([indices[payload[f"q{i}"]] for i in range(1, app.N_QUESTIONS + 1)],
+                    [payload[f"a{i}"] for i in range(1, app.N_QUESTIONS + 1)]) for payload in payloads]
+    throughput = dict()
+    for batch_size in batch_sizes:
+        bodies = [wire.encode_submissions(table.tag, submissions[i:i + batch_size])
+                  for i in range(0, len(submissions) - batch_size + 1, batch_size)]
+        n_batches = max(1, min_quizzes // batch_size)
+        bodies = (bodies * (n_batches // max(len(bodies), 1) + 1))[:n_batches]
+
+        def post(body):
+            response = client.post("/quiz_feedback/batch", data=body, content_type=wire.SUBMISSION_TYPE)
+            assert response.mimetype == wire.FEEDBACK_TYPE, response.data
+            return response.data
+
+        response_bytes = len(post(bodies[0]))
+        start = time.perf_counter()
+        for body in bodies:
+            post(body)
+        elapsed = time.perf_counter() - start
+        throughput[str(batch_size)] = {"quizzes_per_second": len(bodies) * batch_size / elapsed,
+                                       "batches": len(bodies), "request_bytes": len(bodies[0]),
+                                       "response_bytes": response_bytes}
+    return throughput
+
+
+def bench_recommend(compiled_bank, payloads, pool_size, seed=0):
+    """
+    Ranking the pages for one learner, with a pool of pool_size synthetic learners, each sent to a random page.
+    """
+    engine = compiled_bank.engine
+    scores = [engine.score(compiled_bank.validator.validate(payload)[2]) for payload in payloads]
+    rng = np.random.default_rng(seed)
+    pool = np.asarray(scores)[rng.integers(len(scores), size=pool_size)] + rng.integers(-2, 3, (pool_size,
+                                                                                                 len(scores[0])))
+    recommender = recommend.PageRecommender(app.SITE_PAGES, app.RECOMMENDED_READING)
+    thread = recommender.record(pool, [app.SITE_PAGES[i] for i in rng.integers(len(app.SITE_PAGES), size=pool_size)])
+    if thread is not None:
+        thread.join()
+    return latency_summary(time_calls(lambda score: recommender.recommend(score.reshape(1, -1)), scores))
+
+
+def bench_cold_start(payload, n_runs, snapshot=True):
+    """
+    Launches n_runs fresh interpreters and times their import of app, first response and readiness.
+    """
+    env = dict(os.environ)
+    if not snapshot:
+        env["QUIZ_SNAPSHOT"] = ""
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    def launch():
+        launched = time.time()
+        output = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT, repr(launched), json.dumps(payload)],
+                                cwd=directory, env=env, capture_output=True, text=True, check=True).stdout
+        return json.loads(output.splitlines()[-1])
+
+    if snapshot:
+        # Writes the snapshot if it is missing or stale, so the timed runs load it
+        launch()
+    runs = [launch() for _ in range(n_runs)]
+    return {stage: latency_summary(np.asarray([run[stage] for run in runs]) * 1e6)
+            for stage in ("import", "first_response", "ready")}
+
+
+def run_benchmarks(quick=False, seed=0):
+    n = 500 if quick else 5000
+    bank = app.create_question_bank()
+    compiled_bank = bank.compile()
+    payloads = synthetic_submissions(compiled_bank, max(n, max(BATCH_SIZES)), seed=seed)
+    client = app.app.test_client()
+
+    benchmarks = {
+        "create_question_bank": bench_create_question_bank(20 if quick else 200),
+        "score_quiz": bench_score_quiz(bank, payloads[:n]),
+        "feedback_construct": bench_feedback_construct(compiled_bank, payloads[:n]),
+        "quiz_feedback_request": bench_request(client, payloads[:n]),
+    }
+    benchmarks["quiz_feedback_batch"] = bench_batch(client, payloads, BATCH_SIZES, 2000 if quick else 20000)
+    benchmarks["quiz_feedback_wire_batch"] = bench_wire_batch(client, payloads, BATCH_SIZES,
+                                                              2000 if quick else 20000)
+    benchmarks["recommend"] = bench_recommend(compiled_bank, payloads[:n],
+                                              RECOMMEND_POOL_SIZE // 10 if quick else RECOMMEND_POOL_SIZE, seed)
+    n_runs = 3 if quick else 10
+    for snapshot, suffix in ((True, ""), (False, "_no_snapshot")):
+        for stage, summary in bench_cold_start(payloads[0], n_runs, snapshot).items():
+            benchmarks[f"cold_start_{stage}{suffix}"] = summary
+    return {"meta": {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                     "machine": platform.machine(), "time": time.time(), "quick": quick, "seed": seed,
+                     "score_table": app.SCORE_TABLE is not None},
+            "benchmarks": benchmarks}
+
+
+def compare_results(results, baseline, threshold):
+    """
+    Returns a message for every benchmark that got more than threshold worse than in baseline.
+    """
+    regressions = []
+    for name, current in results["benchmarks"].items():
+        previous = baseline.get("benchmarks", dict()).get(name)
+        if previous is None:
+            continue
+        if "p50_us" in current:
+            if current["p50_us"] > previous["p50_us"] * (1 + threshold):
+                regressions.append(f"{name}: median {previous['p50_us']:.1f}us -> {current['p50_us']:.1f}us")
+        else:
+            for batch_size, throughput in current.items():
+                before = previous.get(batch_size)
+                if before is not None and \
+                        throughput["quizzes_per_second"] < before["quizzes_per_second"] / (1 + threshold):
+                    regressions.append(f"{name}[{batch_size}]: {before['quizzes_per_second']:.0f} -> "
+                                       f"{throughput['quizzes_per_second']:.0f} quizzes/s")
+    return regressions
+
+
+def print_results(results):
+    for name, summary in results["benchmarks"].items():
+        if "p50_us" in summary:
+            print(f"{name:24} p50 {summary['p50_us']:10.1f}us  p99 {summary['p99_us']:10.1f}us  "
+                  f"p99.9 {summary['p99.9_us']:10.1f}us")
+            if "peak_bytes" in summary:
+                print(f"{'':24} {summary['retained_bytes']:.0f} bytes retained, {summary['peak_bytes']} bytes peak "
+                      f"per request")
+        else:
+            for batch_size, throughput in summary.items():
+                print(f"{name:24} batch {batch_size:>5}: {throughput['quizzes_per_second']:12.0f} quizzes/s")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="fewer iterations, for CI")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic submissions")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to check for regressions against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="fraction a benchmark may get worse before it counts as a regression")
+    parser.add_argument("--cold-start-budget", type=float, default=COLD_START_BUDGET,
+                        help="seconds the median cold start may take to its first response")
+    args = parser.parse_args(argv[1:])
+
+    results = run_benchmarks(args.quick, args.seed)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failures = []
+    first_response = results["benchmarks"]["cold_start_first_response"]["p50_us"] / 1e6
+    if first_response > args.cold_start_budget:
+        failures.append(f"cold start: first response after {first_response:.2f}s, over the "
+                        f"{args.cold_start_budget:.2f}s budget")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        failures.extend(compare_results(results, baseline, args.threshold))
+    for failure in failures:
+        print(f"Regression: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,33 @@
+"""
+Multi-worker launch configuration, used for both the WSGI and the ASGI app:
+    gunicorn -c gunicorn.conf.py app:app
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:application
+
+On Azure App Service, set one of these as the startup command.
+"""
+
+import gc
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 1))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+WARMUP_TIMEOUT = 60
+
+# The app is imported once in the master before forking, and warmed up there in when_ready, which builds the compiled
+# question bank, the phrase tables and the stores and maps the score table.  The workers share those pages
+# copy-on-write.
+preload_app = True
+
+
+def when_ready(server):
+    # Warm up in the master, so every worker is forked warm and ready
+    import app
+    app.WARMUP.ensure_started()
+    app.WARMUP.ready.wait(WARMUP_TIMEOUT)
+
+    # Objects that exist before forking are never touched by the garbage collector again, which would otherwise
+    # write to their pages and make each worker copy them
+    gc.freeze()
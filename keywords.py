@@ -0,0 +1,258 @@
+"""
+Offline keyword extraction for the news articles learners paste in.
+
+Text is split into phrases at stop words and punctuation, as in RAKE, and every n-gram inside a phrase is a candidate
+keyword.  Words are weighted by TF-IDF, with each sentence of the article counted as a document, and candidates are
+scored from the weights of their words.  All the texts in a batch are scored together with NumPy, so the per-call
+overhead is paid once per batch rather than once per text.
+
+If KEYWORD_MODEL points to a .npz file with "words" and "vectors" arrays (static word embeddings, e.g. GloVe
+exported with numpy), candidates are instead scored like KeyBERT: by the cosine similarity of their embedding to the
+TF-IDF weighted embedding of the whole text.  The model is loaded on first use.
+
+Results have the old KeyBERT shape, a list of [keyword, score] pairs, best first.
+"""
+
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future
+from hashlib import blake2b
+
+import numpy as np
+
+TOP_N = 30
+MAX_NGRAM = 10
+
+STOP_WORDS = frozenset("""
+a about above across after afterwards again against all almost alone along already also although always am among
+amongst an and another any anyhow anyone anything anyway anywhere are around as at back be became because become
+becomes becoming been before beforehand behind being below beside besides between beyond both but by can cannot
+could did do does doing done down due during each eg either else elsewhere enough etc even ever every everyone
+everything everywhere except few for former formerly from further had has have having he hence her here hereafter
+hereby herein hereupon hers herself him himself his how however i ie if in indeed into is it its itself just last
+latter latterly least less many may me meanwhile might mine more moreover most mostly much must my myself namely
+neither never nevertheless next no nobody none noone nor not nothing now nowhere of off often on once one only onto
+or other others otherwise our ours ourselves out over own per perhaps please rather re same says said see seem
+seemed seeming seems several she should since so some somehow someone something sometime sometimes somewhere still
+such than that the their theirs them themselves then thence there thereafter thereby therefore therein thereupon
+these they this those though through throughout thru thus to together too toward towards under until up upon us
+very via was we well were what whatever when whence whenever where whereafter whereas whereby wherein whereupon
+wherever whether which while whither who whoever whole whom whose why will with within without would yet you your
+yours yourself yourselves s t don doesn didn isn wasn aren weren won wouldn shouldn couldn can't won't it's
+""".split())
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+(?:['’][A-Za-z]+|-[A-Za-z0-9]+)*|[.!?]|[,;:()\[\]\"“”]")
+SENTENCE_ENDS = frozenset(".!?")
+
+
+class KeywordExtractor():
+    """
+    Scores candidate keywords for a batch of texts.  Thread-safe, the model is loaded once by whichever call needs
+    it first.
+    """
+    def __init__(self, model_path=None):
+        self.model_path = model_path
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def fingerprint(self):
+        # Keyword results are cached per backend
+        return "tfidf" if self.model_path is None else f"embedding:{self.model_path}"
+
+    def model(self):
+        """
+        The (word -> row, vectors) embedding model, or None when there is no model file.
+        """
+        if self.model_path is None:
+            return None
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    with np.load(self.model_path) as data:
+                        words = data["words"].tolist()
+                        vectors = np.asarray(data["vectors"], dtype=np.float32)
+                    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                    vectors = vectors / np.where(norms > 0, norms, 1)
+                    self._model = ({word: i for i, word in enumerate(words)}, vectors)
+        return self._model
+
+    def extract(self, texts, max_ngrams, top_n=TOP_N):
+        """
+        Returns the top_n [keyword, score] pairs for each text.  max_ngrams has the longest n-gram to consider for
+        each text.
+        """
+        vocabulary = dict()
+        words = []
+        ids = []
+        docs = []
+        sentences = []
+        phrases = []
+        sentence = 0
+        phrase = 0
+        for doc, text in enumerate(texts):
+            for match in TOKEN_PATTERN.finditer(text.lower()):
+                token = match.group()
+                if token in SENTENCE_ENDS:
+                    sentence += 1
+                    phrase += 1
+                elif not token[0].isalnum() or token in STOP_WORDS:
+                    phrase += 1
+                else:
+                    word = vocabulary.get(token)
+                    if word is None:
+                        word = vocabulary[token] = len(words)
+                        words.append(token)
+                    ids.append(word)
+                    docs.append(doc)
+                    sentences.append(sentence)
+                    phrases.append(phrase)
+            sentence += 1
+            phrase += 1
+
+        results = [[] for _ in texts]
+        if not ids:
+            return results
+
+        ids = np.asarray(ids, dtype=np.int64)
+        docs = np.asarray(docs, dtype=np.int64)
+        sentences = np.asarray(sentences, dtype=np.int64)
+        phrases = np.asarray(phrases, dtype=np.int64)
+        n_words = len(words)
+
+        # Term frequency of each word in its text, and the number of the text's sentences it appears in
+        pairs, token_pair, tf = np.unique(docs * n_words + ids, return_inverse=True, return_counts=True)
+        sentence_pairs = np.unique(sentences * n_words + ids)
+        sentence_docs = docs[np.searchsorted(sentences, sentence_pairs // n_words)]
+        sf = np.bincount(np.searchsorted(pairs, sentence_docs * n_words + sentence_pairs % n_words),
+                         minlength=len(pairs))
+        n_sentences = np.bincount(docs[np.unique(sentences, return_index=True)[1]], minlength=len(texts))
+        idf = np.log((1 + n_sentences[pairs // n_words]) / (1 + sf)) + 1
+        token_weights = (tf * idf)[token_pair]
+
+        model = self.model()
+        if model is not None:
+            word_rows, vectors = model
+            rows = np.asarray([word_rows.get(word, -1) for word in words], dtype=np.int64)
+            token_vectors = np.where((rows[ids] >= 0)[:, None], vectors[rows[ids]], 0)
+            # Each text's embedding is the TF-IDF weighted mean of its words', over the distinct words of the text
+            first = np.unique(token_pair, return_index=True)[1]
+            doc_vectors = np.zeros((len(texts), vectors.shape[1]), dtype=np.float32)
+            np.add.at(doc_vectors, docs[first], token_vectors[first] * token_weights[first, None])
+            norms = np.linalg.norm(doc_vectors, axis=1, keepdims=True)
+            doc_vectors /= np.where(norms > 0, norms, 1)
+
+        max_ngrams = np.asarray(max_ngrams, dtype=np.int64)
+        candidate_docs = []
+        candidate_scores = []
+        candidate_starts = []
+        candidate_lengths = []
+        for n in range(1, min(int(max_ngrams.max()), MAX_NGRAM) + 1):
+            if n > len(ids):
+                break
+            starts = np.flatnonzero((phrases[:len(ids) - n + 1] == phrases[n - 1:]) &
+                                    (max_ngrams[docs[:len(ids) - n + 1]] >= n))
+            if not len(starts):
+                break
+            windows = starts[:, None] + np.arange(n)
+            keys = np.column_stack((docs[starts], ids[windows]))
+            _, first, counts = np.unique(keys, axis=0, return_index=True, return_counts=True)
+            starts = starts[first]
+            windows = windows[first]
+
+            if model is None:
+                # Longer phrases score the sum of their words, damped so they don't always win
+                scores = token_weights[windows].sum(axis=1) / np.sqrt(n) * (1 + np.log(counts))
+            else:
+                phrase_vectors = token_vectors[windows].sum(axis=1)
+                norms = np.linalg.norm(phrase_vectors, axis=1)
+                scores = np.einsum("ij,ij->i", phrase_vectors, doc_vectors[docs[starts]]) / np.where(norms > 0, norms, 1)
+
+            candidate_docs.append(docs[starts])
+            candidate_scores.append(scores)
+            candidate_starts.append(starts)
+            candidate_lengths.append(np.full(len(starts), n))
+
+        candidate_docs = np.concatenate(candidate_docs)
+        candidate_scores = np.concatenate(candidate_scores)
+        candidate_starts = np.concatenate(candidate_starts)
+        candidate_lengths = np.concatenate(candidate_lengths)
+
+        # Best first within each text, then the first top_n of each.  Ties go to the shorter candidate, then to the one
+        # that appears first, so a text gets the same keywords whatever it was batched with
+        order = np.lexsort((candidate_starts, candidate_lengths, -candidate_scores, candidate_docs))
+        ordered_docs = candidate_docs[order]
+        group_starts = np.searchsorted(ordered_docs, ordered_docs, side="left")
+        order = order[np.arange(len(order)) - group_starts < top_n]
+
+        if model is None:
+            best = np.zeros(len(texts))
+            np.maximum.at(best, candidate_docs, candidate_scores)
+            candidate_scores = candidate_scores / best[candidate_docs]
+
+        ids = ids.tolist()
+        for doc, score, start, n in zip(candidate_docs[order].tolist(), candidate_scores[order].tolist(),
+                                        candidate_starts[order].tolist(), candidate_lengths[order].tolist()):
+            results[doc].append([" ".join(words[word] for word in ids[start:start + n]), round(score, 4)])
+        return results
+
+
+def text_key(text, max_ngram, top_n):
+    return blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest(), max_ngram, top_n
+
+
+class MicroBatcher():
+    """
+    Collects requests from concurrent callers and hands them to function as one batch.
+
+    A background thread takes whatever has been submitted, optionally waits up to max_wait seconds for more (up to
+    max_batch), then calls function with the list of items.  Requests that arrive while a batch is being worked on
+    make up the next one, so batches form under load without delaying a lone caller.  Each caller waits for its own
+    result.
+    """
+    def __init__(self, function, max_batch=64, max_wait=0):
+        self.function = function
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending = []
+        self._condition = threading.Condition()
+        self._worker_pid = None
+
+    def submit(self, item):
+        future = Future()
+        with self._condition:
+            self._ensure_worker()
+            self._pending.append((item, future))
+            self._condition.notify()
+        return future
+
+    def _ensure_worker(self):
+        # Threads don't survive forking into workers, so each process starts its own
+        if self._worker_pid != os.getpid():
+            self._worker_pid = os.getpid()
+            threading.Thread(target=self._run, name="keyword-batcher", daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                deadline = time.monotonic() + self.max_wait
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+
+            try:
+                results = self.function([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
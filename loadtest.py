@@ -0,0 +1,529 @@
+"""
+Load test for the quiz feedback service, run entirely on this machine.
+
+Starts the app locally (the Flask dev server, the WSGI app under gunicorn, or the ASGI app under gunicorn with uvicorn
+workers), then drives /quiz_feedback with a fleet of concurrent asyncio clients, each on its own keep-alive
+connection, sending a new request as soon as the last one is answered.  Submissions are q1..q8/a1..a8 payloads drawn
+from create_question_bank(), and a share of them are malformed in one of the ways clients get wrong (bad JSON, a
+missing answer, a duplicate or unknown question, an answer out of range or not a number).  A malformed submission
+only counts as an error if it isn't rejected with the error code it should get.
+
+Concurrency doubles step by step.  Each step reports throughput, p50/p99/p99.9 latency, the error rate by kind, the
+peak resident (and proportional) memory of each server worker, and how busy the load generator itself was, since it
+shares the machine with the server.  The run stops once throughput stops growing, or errors pass the limit, and
+reports the saturation point: the fewest clients that reach within --min-gain of the best throughput seen.  Beyond
+it, more clients only wait longer.
+
+Usage:
+    python loadtest.py [--server wsgi|asgi|dev] [--workers N] [--concurrency 1,2,4,...] [--max-concurrency 256]
+                       [--step-seconds 10] [--malformed 0.05] [--quick] [--output loadtest.json]
+
+Exits with status 1 if the server doesn't come up, or if requests fail beyond --max-error-rate even at the lowest
+concurrency.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+# Load test quizzes are not real results, so the servers and this process only aggregate them in memory
+os.environ.setdefault("QUIZ_RESULTS_DIR", "")
+
+import app  # noqa: E402
+from benchmark import synthetic_submissions  # noqa: E402
+
+HOST = "127.0.0.1"
+PATH = "/quiz_feedback"
+LOAD_PERCENTILES = (50, 99, 99.9)
+STEP_SECONDS = 10.0
+WARMUP_SECONDS = 1.0
+MAX_CONCURRENCY = 256
+MALFORMED_SHARE = 0.05
+MAX_ERROR_RATE = 0.01
+# A step has to beat the best throughput so far by this fraction to count as still scaling
+MIN_GAIN = 0.1
+# Steps in a row without scaling before the run stops
+PLATEAU_STEPS = 2
+REQUEST_TIMEOUT = 10.0
+STARTUP_TIMEOUT = 120.0
+MEMORY_SAMPLE_INTERVAL = 0.5
+N_SUBMISSIONS = 4096
+
+
+class LoadTestError(RuntimeError):
+    pass
+
+
+def malformed_submissions(compiled_bank, payloads, n, seed=0):
+    """
+    n (body, expected error code) pairs, each a valid payload broken in one of the ways clients get wrong.
+    """
+    rng = random.Random(seed)
+    engine = compiled_bank.engine
+    unknown = "not a question ID"
+
+    def bad_json(payload):
+        return json.dumps(payload).encode()[:-5], "invalid_json"
+
+    def not_an_object(payload):
+        return json.dumps(list(payload.values())).encode(), "invalid_payload"
+
+    def missing_answer(payload):
+        i = rng.randint(1, app.N_QUESTIONS)
+        return json.dumps({k: v for k, v in payload.items() if k != f"a{i}"}).encode(), "missing_field"
+
+    def duplicate_question(payload):
+        return json.dumps(dict(payload, q2=payload["q1"])).encode(), "duplicate_question"
+
+    def unknown_question(payload):
+        return json.dumps(dict(payload, q1=unknown)).encode(), "unknown_question"
+
+    def answer_out_of_range(payload):
+        return json.dumps(dict(payload, a1=engine.n_answers[payload["q1"]] + 5)).encode(), "answer_out_of_range"
+
+    def answer_not_a_number(payload):
+        return json.dumps(dict(payload, a1="two")).encode(), "invalid_answer"
+
+    kinds = (bad_json, not_an_object, missing_answer, duplicate_question, unknown_question, answer_out_of_range,
+             answer_not_a_number)
+    return [rng.choice(kinds)(rng.choice(payloads)) for _ in range(n)]
+
+
+def request_bytes(body, port):
+    head = (f"POST {PATH} HTTP/1.1\r\nHost: {HOST}:{port}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n")
+    return head.encode() + body
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def server_command(server, port):
+    here = os.path.dirname(os.path.abspath(__file__))
+    if server == "dev":
+        return [sys.executable, "-c", f"import app; app.app.run(host={HOST!r}, port={port}, threaded=True)"]
+    # The command line bind overrides the config file's, so the server is only reachable locally
+    command = [sys.executable, "-m", "gunicorn", "-c", os.path.join(here, "gunicorn.conf.py"), "-b", f"{HOST}:{port}"]
+    if server == "asgi":
+        return command + ["-k", "uvicorn.workers.UvicornWorker", "asgi:application"]
+    return command + ["app:app"]
+
+
+class Server():
+    """
+    A local server process, its log, and the PIDs of the workers that serve requests.
+    """
+    def __init__(self, server, workers=None):
+        self.server = server
+        self.port = free_port()
+        env = dict(os.environ, QUIZ_RESULTS_DIR="")
+        if workers is not None:
+            env["WEB_CONCURRENCY"] = str(workers)
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(server_command(server, self.port), env=env, stdout=self.log,
+                                        stderr=subprocess.STDOUT, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    def worker_pids(self):
+        # gunicorn's workers are the master's children; the dev server serves from its own process
+        if self.server == "dev":
+            return [self.process.pid]
+        children = []
+        for name in os.listdir("/proc"):
+            if not name.isdigit():
+                continue
+            try:
+                with open(f"/proc/{name}/stat") as f:
+                    # The command name is in parentheses and may contain spaces, so fields are counted after it
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if ppid == self.process.pid:
+                children.append(int(name))
+        return sorted(children)
+
+    def log_tail(self, lines=20):
+        self.log.seek(0)
+        return b"\n".join(self.log.read().splitlines()[-lines:]).decode(errors="replace")
+
+    async def wait_ready(self, body, timeout=STARTUP_TIMEOUT):
+        """
+        Waits until a valid submission gets its feedback, which every server supports.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise LoadTestError(f"The {self.server} server exited with status {self.process.returncode}:\n"
+                                    f"{self.log_tail()}")
+            connection = Connection(self.port)
+            try:
+                status, response = await asyncio.wait_for(connection.request(request_bytes(body, self.port)),
+                                                          REQUEST_TIMEOUT)
+                if status == 200 and b'"Feedback"' in response:
+                    return
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+                pass
+            finally:
+                connection.close()
+            await asyncio.sleep(0.25)
+        raise LoadTestError(f"The {self.server} server was not ready after {timeout:.0f}s:\n{self.log_tail()}")
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.log.close()
+
+
+def worker_memory(pid):
+    """
+    The resident and proportional set sizes of a process in MiB.  Workers share the pages the master built before
+    forking, which RSS counts in full in every worker and PSS splits between them.  None if the process has gone.
+    """
+    memory = dict()
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    memory["rss_mib"] = int(line.split()[1]) / 1024
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    memory["pss_mib"] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return memory or None
+
+
+class Connection():
+    """
+    One client's HTTP/1.1 connection, reopened whenever the server closes it.
+    """
+    def __init__(self, port):
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, data):
+        """
+        Sends one request and returns the response's status and body.
+        """
+        reused = self.writer is not None
+        if not reused:
+            self.reader, self.writer = await asyncio.open_connection(HOST, self.port)
+        self.writer.write(data)
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line and reused:
+            # The server closed the idle connection just before this request, so it is sent again on a new one
+            self.close()
+            return await self.request(data)
+        if not status_line:
+            raise asyncio.IncompleteReadError(b"", None)
+        status = int(status_line.split()[1])
+
+        length = None
+        chunked = close = False
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            value = value.strip().lower()
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"transfer-encoding":
+                chunked = value == b"chunked"
+            elif name == b"connection":
+                close = value == b"close"
+
+        if chunked:
+            body = bytearray()
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                body += await self.reader.readexactly(size + 2)
+                del body[len(body) - 2:]
+                if size == 0:
+                    await self.reader.readline()
+                    break
+        elif length is not None:
+            body = await self.reader.readexactly(length)
+        else:
+            body = await self.reader.read()
+            close = True
+        if close:
+            self.close()
+        return status, bytes(body)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def outcome(status, body, expected_code):
+    """
+    How a response counts: "ok", "rejected" (a malformed submission turned away as it should be), or the kind of
+    error it is.
+    """
+    if status != 200:
+        return f"http_{status}"
+    if expected_code is None:
+        return "ok" if b'"Feedback"' in body else "unexpected_error"
+    try:
+        code = json.loads(body).get("Code")
+    except ValueError:
+        return "invalid_response"
+    return "rejected" if code == expected_code else "unexpected_code"
+
+
+async def run_client(port, requests, malformed, malformed_share, seed, measure_from, deadline, latencies, outcomes):
+    rng = random.Random(seed)
+    connection = Connection(port)
+    try:
+        while time.perf_counter() < deadline:
+            if malformed and rng.random() < malformed_share:
+                data, expected_code = rng.choice(malformed)
+            else:
+                data, expected_code = rng.choice(requests), None
+
+            start = time.perf_counter()
+            try:
+                status, body = await asyncio.wait_for(connection.request(data), REQUEST_TIMEOUT)
+                result = outcome(status, body, expected_code)
+            except asyncio.TimeoutError:
+                result = "timeout"
+                connection.close()
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                result = "connection_error"
+                connection.close()
+                # Backs off a little, so a server that refuses connections isn't spun against
+                await asyncio.sleep(0.01)
+            end = time.perf_counter()
+
+            if start >= measure_from:
+                latencies.append(end - start)
+                outcomes[result] += 1
+    finally:
+        connection.close()
+
+
+async def sample_memory(server, stop, peaks):
+    # The peak of each worker over the step
+    while True:
+        for pid in server.worker_pids():
+            memory = worker_memory(pid)
+            if memory is None:
+                continue
+            peak = peaks.setdefault(pid, memory)
+            for key, value in memory.items():
+                peak[key] = max(peak.get(key, 0), value)
+        try:
+            await asyncio.wait_for(stop.wait(), MEMORY_SAMPLE_INTERVAL)
+            return
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_step(server, concurrency, requests, malformed, malformed_share, step_seconds, warmup_seconds, seed):
+    """
+    Drives the server with concurrency clients for warmup_seconds plus step_seconds, and summarises the measured part.
+    """
+    latencies = []
+    outcomes = Counter()
+    peaks = dict()
+    stop = asyncio.Event()
+    memory_task = asyncio.create_task(sample_memory(server, stop, peaks))
+
+    start = time.perf_counter()
+    measure_from = start + warmup_seconds
+    deadline = measure_from + step_seconds
+    clients = [asyncio.create_task(run_client(server.port, requests, malformed, malformed_share,
+                                              f"{seed}-{concurrency}-{i}", measure_from, deadline, latencies,
+                                              outcomes))
+               for i in range(concurrency)]
+    await asyncio.sleep(max(measure_from - time.perf_counter(), 0))
+    cpu_start = time.process_time()
+    await asyncio.gather(*clients)
+    # Requests still in flight at the deadline are counted, so the step can run a little over
+    elapsed = time.perf_counter() - measure_from
+    client_cpu = (time.process_time() - cpu_start) / elapsed
+    stop.set()
+    await memory_task
+
+    return step_summary(concurrency, elapsed, np.asarray(latencies), outcomes, peaks, client_cpu)
+
+
+def step_summary(concurrency, elapsed, latencies, outcomes, peaks, client_cpu):
+    total = sum(outcomes.values())
+    errors = {kind: count for kind, count in sorted(outcomes.items()) if kind not in ("ok", "rejected")}
+    summary = {"concurrency": concurrency, "seconds": elapsed, "requests": total,
+               "throughput_rps": total / elapsed if elapsed > 0 else 0.0, "ok": outcomes["ok"],
+               "rejected": outcomes["rejected"], "errors": errors,
+               "error_rate": sum(errors.values()) / total if total else 1.0, "client_cpu": client_cpu}
+    if len(latencies):
+        summary["mean_ms"] = float(latencies.mean() * 1000)
+        summary["max_ms"] = float(latencies.max() * 1000)
+        for p, value in zip(LOAD_PERCENTILES, np.percentile(latencies, LOAD_PERCENTILES)):
+            summary[f"p{p:g}_ms"] = float(value * 1000)
+    summary["workers"] = [{"pid": pid, **memory} for pid, memory in sorted(peaks.items())]
+    summary["rss_mib"] = sum(memory.get("rss_mib", 0) for memory in peaks.values())
+    summary["pss_mib"] = sum(memory.get("pss_mib", 0) for memory in peaks.values())
+    return summary
+
+
+def concurrency_steps(start, maximum):
+    concurrency = start
+    while concurrency <= maximum:
+        yield concurrency
+        concurrency *= 2
+
+
+def saturation_point(steps, min_gain=MIN_GAIN, max_error_rate=MAX_ERROR_RATE):
+    """
+    The first step that reaches within min_gain of the best throughput of the steps within the error limit.  None if
+    no step is.
+    """
+    healthy = [step for step in steps if step["error_rate"] <= max_error_rate]
+    if not healthy:
+        return None
+    best = max(step["throughput_rps"] for step in healthy)
+    return next(step for step in healthy if step["throughput_rps"] >= (1 - min_gain) * best)
+
+
+def is_saturated(steps, min_gain=MIN_GAIN, max_error_rate=MAX_ERROR_RATE, plateau_steps=PLATEAU_STEPS):
+    """
+    Whether the run can stop: the last step has too many errors, or the last plateau_steps steps all failed to beat
+    the best throughput before them by min_gain.
+    """
+    if steps[-1]["error_rate"] > max_error_rate:
+        return True
+    if len(steps) <= plateau_steps:
+        return False
+    best_before = max(step["throughput_rps"] for step in steps[:-plateau_steps])
+    return all(step["throughput_rps"] < (1 + min_gain) * best_before for step in steps[-plateau_steps:])
+
+
+async def run_load_test(server_kind="wsgi", workers=None, concurrency=None, max_concurrency=MAX_CONCURRENCY,
+                        step_seconds=STEP_SECONDS, warmup_seconds=WARMUP_SECONDS, malformed_share=MALFORMED_SHARE,
+                        max_error_rate=MAX_ERROR_RATE, min_gain=MIN_GAIN, seed=0, progress=sys.stderr):
+    compiled_bank = app.create_question_bank().compile()
+    payloads = synthetic_submissions(compiled_bank, N_SUBMISSIONS, seed=seed)
+    bodies = [json.dumps(payload).encode() for payload in payloads]
+    malformed = malformed_submissions(compiled_bank, payloads, N_SUBMISSIONS // 4, seed=seed)
+
+    server = Server(server_kind, workers)
+    try:
+        started = time.perf_counter()
+        await server.wait_ready(bodies[0])
+        startup = time.perf_counter() - started
+        progress.write(f"{server_kind} server ready in {startup:.1f}s\n")
+
+        requests = [request_bytes(body, server.port) for body in bodies]
+        malformed = [(request_bytes(body, server.port), code) for body, code in malformed]
+        steps = []
+        for clients in concurrency or concurrency_steps(1, max_concurrency):
+            step = await run_step(server, clients, requests, malformed, malformed_share, step_seconds, warmup_seconds,
+                                  seed)
+            steps.append(step)
+            progress.write(format_step(step) + "\n")
+            progress.flush()
+            if concurrency is None and is_saturated(steps, min_gain, max_error_rate):
+                break
+    finally:
+        server.stop()
+
+    saturation = saturation_point(steps, min_gain, max_error_rate)
+    return {"meta": {"server": server_kind, "workers": workers, "cpus": os.cpu_count(), "seed": seed,
+                     "step_seconds": step_seconds, "malformed_share": malformed_share, "time": time.time(),
+                     "startup_seconds": startup},
+            "steps": steps,
+            "saturation": None if saturation is None else {
+                "concurrency": saturation["concurrency"], "throughput_rps": saturation["throughput_rps"],
+                "p99_ms": saturation.get("p99_ms")}}
+
+
+def format_step(step):
+    latency = "  ".join(f"p{p:g} {step[f'p{p:g}_ms']:8.2f}ms" for p in LOAD_PERCENTILES if f"p{p:g}_ms" in step)
+    memory = " ".join(f"{worker.get('rss_mib', 0):.0f}/{worker.get('pss_mib', 0):.0f}" for worker in step["workers"])
+    errors = ", ".join(f"{kind} {count}" for kind, count in step["errors"].items()) or "none"
+    return (f"{step['concurrency']:5d} clients  {step['throughput_rps']:9.1f} req/s  {latency}  "
+            f"errors {step['error_rate']:.2%} ({errors})  client CPU {step['client_cpu']:.0%}  "
+            f"worker RSS/PSS MiB {memory}")
+
+
+def print_results(results):
+    saturation = results["saturation"]
+    if saturation is None:
+        print("No step stayed within the error limit, so there is no saturation point")
+        return
+    last = results["steps"][-1]["concurrency"]
+    where = "" if saturation["concurrency"] < last else f", but throughput was still growing at {last} clients"
+    print(f"Saturation: {saturation['concurrency']} clients, {saturation['throughput_rps']:.1f} req/s, "
+          f"p99 {saturation['p99_ms']:.2f}ms{where}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("wsgi", "asgi", "dev"), default="wsgi",
+                        help="gunicorn with the WSGI app, gunicorn with uvicorn workers and the ASGI app, or the Flask "
+                             "dev server")
+    parser.add_argument("--workers", type=int, help="gunicorn workers, gunicorn.conf.py's default otherwise")
+    parser.add_argument("--concurrency", help="comma separated client counts to run, instead of doubling until "
+                                              "saturation")
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY, help="most clients to double up to")
+    parser.add_argument("--step-seconds", type=float, default=STEP_SECONDS, help="measured seconds per step")
+    parser.add_argument("--warmup-seconds", type=float, default=WARMUP_SECONDS,
+                        help="unmeasured seconds at the start of each step")
+    parser.add_argument("--malformed", type=float, default=MALFORMED_SHARE, help="share of malformed submissions")
+    parser.add_argument("--max-error-rate", type=float, default=MAX_ERROR_RATE,
+                        help="error rate past which the service counts as saturated")
+    parser.add_argument("--min-gain", type=float, default=MIN_GAIN,
+                        help="throughput gain a step needs over the best before it to count as still scaling")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the submissions and the clients' choices")
+    parser.add_argument("--quick", action="store_true", help="short steps, for CI")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv[1:])
+
+    concurrency = [int(clients) for clients in args.concurrency.split(",")] if args.concurrency else None
+    step_seconds = min(args.step_seconds, 3.0) if args.quick else args.step_seconds
+    warmup_seconds = min(args.warmup_seconds, 0.5) if args.quick else args.warmup_seconds
+    try:
+        results = asyncio.run(run_load_test(args.server, args.workers, concurrency, args.max_concurrency, step_seconds,
+                                            warmup_seconds, args.malformed, args.max_error_rate, args.min_gain,
+                                            args.seed))
+    except LoadTestError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    first = results["steps"][0]
+    if first["error_rate"] > args.max_error_rate:
+        print(f"Failed: {first['error_rate']:.2%} of requests failed at {first['concurrency']} client(s)")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
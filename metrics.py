@@ -0,0 +1,232 @@
+"""
+Request metrics in Prometheus text format, and an opt-in sampling profiler.
+
+Every thread counts into its own dictionaries, so recording a measurement takes no lock.  The per-thread values are
+only merged when /metrics is scraped.  Each worker process keeps its own metrics.
+
+The profiler samples the stacks of every thread at a fixed interval and writes them in the collapsed format that
+flamegraph.pl and speedscope read, one "frame;frame;frame count" line per distinct stack.
+"""
+
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class _ThreadMetrics():
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        self.counters = dict()
+        # (name, labels) -> bucket counts, with the +Inf bucket last, then the sum of the observations
+        self.histograms = dict()
+
+
+class _Timer():
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, self.labels, time.perf_counter() - self.start)
+
+
+class Metrics():
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.descriptions = dict()
+        self.collectors = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # The metrics of threads that are still running, and the merged metrics of those that have finished
+        self._threads = []
+        self._retired = _ThreadMetrics()
+
+    def describe(self, name, kind, description):
+        self.descriptions[name] = (kind, description)
+
+    def _state(self):
+        try:
+            return self._local.state
+        except AttributeError:
+            state = self._local.state = _ThreadMetrics()
+            with self._lock:
+                self._threads.append((threading.current_thread(), state))
+            return state
+
+    def inc(self, name, labels=(), amount=1):
+        """
+        Adds to a counter.  labels is a tuple of (label, value) pairs.
+        """
+        counters = self._state().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, labels, seconds):
+        histograms = self._state().histograms
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    def time(self, name, labels=()):
+        """
+        Context manager that observes how long its block took.
+        """
+        return _Timer(self, name, labels)
+
+    def add_collector(self, collector):
+        """
+        collector is called on each scrape and returns (name, labels, value) samples for values kept elsewhere.
+        """
+        self.collectors.append(collector)
+
+    @staticmethod
+    def _merge(into, state):
+        for key, value in list(state.counters.items()):
+            into.counters[key] = into.counters.get(key, 0) + value
+        for key, histogram in list(state.histograms.items()):
+            merged = into.histograms.get(key)
+            if merged is None:
+                into.histograms[key] = list(histogram)
+            else:
+                for i, value in enumerate(histogram):
+                    merged[i] += value
+
+    def snapshot(self):
+        """
+        The counters and histograms of every thread, merged.
+        """
+        with self._lock:
+            running = []
+            for thread, state in self._threads:
+                if thread.is_alive():
+                    running.append((thread, state))
+                else:
+                    # Its values can't change any more, so they are folded in once and the state is dropped
+                    self._merge(self._retired, state)
+            self._threads = running
+
+            total = _ThreadMetrics()
+            self._merge(total, self._retired)
+            for _, state in running:
+                self._merge(total, state)
+        return total
+
+    def render(self):
+        total = self.snapshot()
+        samples = dict()
+        for (name, labels), value in total.counters.items():
+            samples.setdefault(name, []).append((name, labels, value))
+        for (name, labels), histogram in total.histograms.items():
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), histogram):
+                cumulative += count
+                lines.append((name + "_bucket", labels + (("le", str(bound)),), cumulative))
+            lines.append((name + "_sum", labels, histogram[-1]))
+            lines.append((name + "_count", labels, cumulative))
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                samples.setdefault(name, []).append((name, labels, value))
+
+        output = []
+        for name in sorted(samples):
+            kind, description = self.descriptions.get(name, ("untyped", ""))
+            if description:
+                output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples[name]:
+                output.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(output) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    if type(value) is int:
+        return str(value)
+    return repr(float(value))
+
+
+class SamplingProfiler():
+    """
+    Samples every thread's stack each interval seconds for a time window, then writes the collapsed stacks to a file.
+    Only one profile runs at a time.
+    """
+    def __init__(self, directory, interval=0.005):
+        self.directory = directory
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._running = None
+
+    def start(self, seconds):
+        """
+        Starts profiling for seconds in a background thread, and returns the path the profile will be written to, or
+        None if a profile is already running.
+        """
+        with self._lock:
+            if self._running is not None:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"profile-{int(time.time())}-{os.getpid()}.folded")
+            thread = threading.Thread(target=self._run, args=(seconds, path), name="sampling-profiler", daemon=True)
+            self._running = path
+        thread.start()
+        return path
+
+    def running(self):
+        return self._running
+
+    def _run(self, seconds, path):
+        try:
+            stacks = self.sample(seconds)
+            with open(path + ".tmp", "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            os.replace(path + ".tmp", path)
+        finally:
+            with self._lock:
+                self._running = None
+
+    def sample(self, seconds):
+        stacks = Counter()
+        own = threading.get_ident()
+        names = dict()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                frames.append(names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(frames))] += 1
+            time.sleep(self.interval)
+        return stacks
@@ -0,0 +1,358 @@
+"""
+Suggested page recommendations from a learner's whole score vector.
+
+A learner's need vector is how far each learning outcome falls below their own average score, scaled to unit length,
+so it points at the outcomes they are weakest in (Feedback ranks outcomes the same way).  Every site page has a
+profile vector over the same outcomes, and pages are ranked by the cosine similarity of their profile to the need
+vector.
+
+The initial profiles come from the recommended reading table: a page's weight on an outcome is the share of that
+outcome's reading suggestions that point to it.  As learners are recorded, each one's need vector is added to the
+profile of the page they engaged with, so the profiles drift towards the learners each page actually serves.  The
+profile matrix is rebuilt from the running sums only when it is next needed.  The page a feedback response suggests is
+the first one recommended, so only real engagement, posted to /engagement, is recorded: recording the suggestions
+themselves would only feed the profiles back into themselves.
+
+There is also a pool of historical learners, each a need vector and the page they engaged with.  The top k learners
+most similar to the one being recommended for vote for their pages, weighted by similarity, and the votes are added
+to the profile similarities.  The pool is searched exactly, but not by brute force: its vectors are grouped into
+cells around centroids and ordered within a cell by their angle to its centroid.  The nearest cells give a k-th best
+similarity to beat, and the triangle inequality then limits every other cell to the slice of members whose angle could
+beat it, so only a small fraction of the pool is scored.  Newly recorded learners are searched directly until there are
+enough of them to fold into the cell index on a background thread, where they are assigned to the existing cells; the
+pool is only clustered again when it has grown enough to need more cells.
+"""
+
+import threading
+
+import numpy as np
+
+POOL_SIZE = 1_000_000
+POOL_K = 32
+# How many learners' worth of weight the reading table has in a page's profile
+PRIOR_WEIGHT = 100
+# Weight of the pool's votes against the profile similarity
+POOL_WEIGHT = 0.5
+# The cell index is rebuilt once the unindexed learners are this fraction of the indexed ones, within these bounds
+REBUILD_FRACTION = 0.125
+MIN_REBUILD = 4096
+MAX_REBUILD = 32768
+MAX_CELLS_LOG2 = 10
+KMEANS_SAMPLE = 65536
+KMEANS_ITERATIONS = 4
+BLOCK_SIZE = 16384
+# Allows for rounding in the angle bounds, in radians
+ANGLE_TOLERANCE = 1e-3
+
+
+def need_vectors(scores):
+    """
+    Unit need vectors for an (n, n_outcomes) score matrix.  A learner whose outcomes are all equal gets zeros.
+    """
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1, np.shape(scores)[-1])
+    needs = scores.mean(axis=1, keepdims=True) - scores
+    norms = np.linalg.norm(needs, axis=1, keepdims=True)
+    return needs / np.where(norms > 0, norms, 1)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms > 0, norms, 1)).astype(np.float32)
+
+
+def _blocked_argmax(vectors, centroids):
+    # Nearest centroid of each vector and its similarity, a block of vectors at a time to bound the memory used
+    assignment = np.empty(len(vectors), dtype=np.intp)
+    similarity = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), BLOCK_SIZE):
+        sims = vectors[start:start + BLOCK_SIZE] @ centroids.T
+        assignment[start:start + BLOCK_SIZE] = best = sims.argmax(axis=1)
+        similarity[start:start + BLOCK_SIZE] = sims[np.arange(len(best)), best]
+    return assignment, similarity
+
+
+def n_cells_for(n):
+    # A power of two near sqrt(n), so the pool is only re-clustered each time it grows fourfold
+    return 1 << min(MAX_CELLS_LOG2, max(0, int(np.log2(max(n, 1))) // 2))
+
+
+def build_index(vectors, labels, sequence, seed=0):
+    """
+    Clusters unit vectors with spherical k-means, trained on a sample of them, and indexes them by cell.
+    """
+    if not len(vectors):
+        return CellIndex(vectors, labels, sequence, np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.float32),
+                         np.zeros((0, vectors.shape[1]), dtype=np.float32))
+    rng = np.random.default_rng(seed)
+    n_cells = n_cells_for(len(vectors))
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), KMEANS_SAMPLE), replace=False)]
+    centroids = sample[rng.choice(len(sample), n_cells, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        assignment, _ = _blocked_argmax(sample, centroids)
+        sums = np.stack([np.bincount(assignment, sample[:, d], n_cells) for d in range(sample.shape[1])], axis=1)
+        # A cell that lost all its members keeps its old centroid
+        centroids = np.where((np.linalg.norm(sums, axis=1) > 0)[:, None], _normalize(sums), centroids)
+
+    assignment, similarity = _blocked_argmax(vectors, centroids)
+    return CellIndex(vectors, labels, sequence, assignment, similarity, centroids)
+
+
+def _angle(similarity):
+    return np.arccos(np.clip(similarity, -1, 1, dtype=np.float64))
+
+
+class CellIndex():
+    """
+    An immutable index of unit vectors, stored by the cell of their nearest centroid, and within a cell by their
+    angle to its centroid.
+    """
+    def __init__(self, vectors, labels, sequence, assignment, similarity, centroids):
+        """
+        assignment is each vector's cell, and similarity its similarity to that cell's centroid.
+        """
+        # Every angle is under 4, so the keys sort by cell, then by angle
+        keys = assignment * 4.0 + _angle(similarity)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        # Stored one row per dimension, which scores a slice of vectors faster than one row per vector
+        self.vectors_t = np.ascontiguousarray(vectors[order].T, dtype=np.float32)
+        self.labels = labels[order]
+        self.sequence = sequence[order]
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.sizes = np.bincount(assignment, minlength=len(centroids))
+        self.starts = np.concatenate(([0], np.cumsum(self.sizes)))
+        # The largest angle between a cell's centroid and one of its members
+        cells = np.arange(len(centroids))
+        self.radius = np.where(self.sizes > 0, self.keys[np.maximum(self.starts[1:] - 1, 0)] - 4.0 * cells, 0)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def extend(self, vectors, labels, sequence, pool_size):
+        """
+        A new index with these vectors added, and only the newest pool_size kept.  The new vectors are assigned to the
+        existing cells, unless the pool has grown enough to be clustered again.
+        """
+        all_labels = np.concatenate((self.labels, labels))
+        all_sequence = np.concatenate((self.sequence, sequence))
+        newest = slice(None)
+        if len(all_sequence) > pool_size:
+            cut = len(all_sequence) - pool_size
+            newest = all_sequence >= np.partition(all_sequence, cut)[cut]
+        all_vectors = np.concatenate((self.vectors_t.T, vectors))[newest]
+        all_labels, all_sequence = all_labels[newest], all_sequence[newest]
+        if n_cells_for(len(all_sequence)) != len(self.centroids):
+            return build_index(all_vectors, all_labels, all_sequence)
+
+        assignment, similarity = _blocked_argmax(vectors, self.centroids)
+        cells = np.repeat(np.arange(len(self.centroids)), self.sizes)
+        all_assignment = np.concatenate((cells, assignment))[newest]
+        all_similarity = np.concatenate((np.cos(self.keys - 4.0 * cells), similarity))[newest]
+        return CellIndex(all_vectors, all_labels, all_sequence, all_assignment, all_similarity, self.centroids)
+
+    def _scan(self, starts, stops, query):
+        # The similarities of the vectors in these slices, concatenated
+        vectors_t = self.vectors_t
+        return np.concatenate([query @ vectors_t[:, start:stop] for start, stop in zip(starts, stops)])
+
+    def search(self, query, k):
+        """
+        The similarities and labels of the k members most similar to the unit vector query.
+        """
+        if not len(self.labels):
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=self.labels.dtype)
+        query = query.astype(np.float32)
+        angle = _angle(self.centroids @ query)
+        # By the triangle inequality, a member of a cell at angle theta to its centroid is at least
+        # |angle - theta| from the query, so no member of a cell is closer than angle - radius
+        nearest = np.maximum(angle - self.radius, 0)
+        cells = np.argsort(angle)
+
+        # The cells with the closest centroids give a k-th best similarity to beat
+        first = cells[:int(np.searchsorted(np.cumsum(self.sizes[cells]), k)) + 1]
+        starts, stops = self.starts[first], self.starts[first + 1]
+        sims = self._scan(starts.tolist(), stops.tolist(), query)
+        if len(sims) >= k:
+            threshold = np.partition(sims, len(sims) - k)[len(sims) - k]
+            # Only the members of the other cells whose angle to their centroid is within reach of the query's are
+            # scored: a slice of each cell, since its members are ordered by that angle
+            reach = _angle(threshold) + ANGLE_TOLERANCE
+            rest = cells[len(first):]
+            rest = rest[nearest[rest] <= reach]
+            low = np.searchsorted(self.keys, rest * 4.0 + np.maximum(angle[rest] - reach, 0))
+            high = np.searchsorted(self.keys, rest * 4.0 + np.minimum(angle[rest] + reach, np.pi), side="right")
+            nonempty = high > low
+            if nonempty.any():
+                starts = np.concatenate((starts, low[nonempty]))
+                stops = np.concatenate((stops, high[nonempty]))
+                sims = np.concatenate((sims, self._scan(low[nonempty].tolist(), high[nonempty].tolist(), query)))
+            # The final k-th can only be higher, so everything below the threshold is dropped before the top k
+            candidates = np.flatnonzero(sims >= threshold)
+            top = candidates[_top_k_positions(sims[candidates], k)]
+        else:
+            top = _top_k_positions(sims, k)
+
+        # Positions in the concatenated slices back to positions in the index
+        lengths = stops - starts
+        ends = np.cumsum(lengths)
+        slice_of = np.searchsorted(ends, top, side="right")
+        positions = starts[slice_of] + top - (ends[slice_of] - lengths[slice_of])
+        return sims[top], self.labels[positions]
+
+
+def _top_k_positions(sims, k):
+    if len(sims) <= k:
+        return np.arange(len(sims))
+    kth = np.partition(sims, len(sims) - k)[len(sims) - k]
+    above = np.flatnonzero(sims > kth)
+    # Ties with the k-th are cut off in order
+    return np.concatenate((above, np.flatnonzero(sims == kth)[:k - len(above)]))
+
+
+def _top_k(sims, labels, k):
+    top = _top_k_positions(sims, k)
+    return sims[top], labels[top]
+
+
+class PageRecommender():
+    """
+    Ranks site pages for score vectors.  Thread-safe: recording and searching can happen from any thread.
+    """
+    def __init__(self, pages, reading_table, pool_size=POOL_SIZE, k=POOL_K, prior_weight=PRIOR_WEIGHT,
+                 pool_weight=POOL_WEIGHT):
+        """
+        pages are the site's page names, and reading_table has, for each learning outcome, the (page, text) pairs
+        suggested for it.
+        """
+        self.pages = tuple(pages)
+        self.page_ids = {page: i for i, page in enumerate(self.pages)}
+        self.n_outcomes = len(reading_table)
+        self.pool_size = pool_size
+        self.k = k
+        self.pool_weight = pool_weight
+
+        prior = np.zeros((len(self.pages), self.n_outcomes))
+        for outcome, suggestions in enumerate(reading_table):
+            for page, _ in suggestions:
+                prior[self.page_ids[page], outcome] += 1 / len(suggestions)
+        self._prior = _normalize(prior) * prior_weight
+        self._sums = np.zeros_like(self._prior)
+        self._profiles = None
+
+        self._lock = threading.Lock()
+        self._index = build_index(np.zeros((0, self.n_outcomes), dtype=np.float32), np.zeros(0, dtype=np.int16),
+                                  np.zeros(0, dtype=np.int64))
+        # Learners recorded since the index was built, as (vectors, labels, sequence) blocks.  Appended to in place,
+        # and only copied when a rebuild drops the blocks it folded in
+        self._tail = []
+        self._tail_size = 0
+        self._tail_arrays = None
+        self._sequence = 0
+        self._rebuilding = False
+
+    def profiles(self):
+        """
+        The (n_pages, n_outcomes) matrix of unit page profiles.
+        """
+        profiles = self._profiles
+        if profiles is None:
+            with self._lock:
+                profiles = self._profiles = _normalize(self._prior + self._sums)
+        return profiles
+
+    def record(self, scores, pages):
+        """
+        Adds learners to the pool and the page profiles.  scores is an (n, n_outcomes) score matrix, and pages the
+        page each learner engaged with.  Returns the thread rebuilding the index, if this started one.
+        """
+        labels = np.asarray([self.page_ids[page] for page in pages], dtype=np.int16)
+        if not len(labels):
+            return None
+        needs = need_vectors(scores)
+        with self._lock:
+            # Only read under the lock, by profiles(), so it is updated in place
+            np.add.at(self._sums, labels, needs)
+            self._profiles = None
+
+            sequence = np.arange(self._sequence, self._sequence + len(labels))
+            self._sequence += len(labels)
+            self._tail.append((needs, labels, sequence))
+            self._tail_size += len(labels)
+            self._tail_arrays = None
+            threshold = min(max(MIN_REBUILD, REBUILD_FRACTION * len(self._index)), MAX_REBUILD)
+            if self._rebuilding or self._tail_size < threshold:
+                return None
+            self._rebuilding = True
+        thread = threading.Thread(target=self.rebuild, name="recommender-index", daemon=True)
+        thread.start()
+        return thread
+
+    def rebuild(self):
+        """
+        Folds the recorded learners into the cell index, keeping the newest pool_size.
+        """
+        new_index = None
+        try:
+            with self._lock:
+                index, n_blocks = self._index, len(self._tail)
+                tail = self._tail[:n_blocks]
+            new_index = index.extend(*(np.concatenate(column) for column in zip(*tail)), self.pool_size)
+        finally:
+            with self._lock:
+                if new_index is not None:
+                    self._index = new_index
+                    # Anything recorded during the rebuild stays in the tail
+                    self._tail = self._tail[n_blocks:]
+                    self._tail_size = sum(len(block[1]) for block in self._tail)
+                    self._tail_arrays = None
+                self._rebuilding = False
+
+    def neighbours(self, need):
+        """
+        The similarities and page labels of the pool's k learners most similar to one need vector.
+        """
+        with self._lock:
+            index = self._index
+            if self._tail_arrays is None and self._tail:
+                self._tail_arrays = (np.concatenate([block[0] for block in self._tail]),
+                                     np.concatenate([block[1] for block in self._tail]))
+            tail = self._tail_arrays
+        sims, labels = index.search(need, self.k)
+        if tail is None:
+            return sims, labels
+        # Recorded since the index was built, so searched directly
+        return _top_k(np.concatenate((sims, tail[0] @ need)), np.concatenate((labels, tail[1])), self.k)
+
+    def recommend(self, scores):
+        """
+        Ranks the pages for each row of an (n, n_outcomes) score matrix.  Returns the (n, n_pages) page order, best
+        first, and the matching scores.
+        """
+        needs = need_vectors(scores)
+        ranking = needs @ self.profiles().T
+        if self.pool_weight and (len(self._index) or self._tail):
+            for i, need in enumerate(needs):
+                sims, labels = self.neighbours(need)
+                weights = np.clip(sims, 0, None)
+                if weights.sum() > 0:
+                    votes = np.bincount(labels, weights, len(self.pages)) / weights.sum()
+                    ranking[i] += self.pool_weight * votes
+        order = np.argsort(-ranking, axis=1, kind="stable")
+        return order, np.take_along_axis(ranking, order, axis=1)
+
+    def load_pool(self, path):
+        """
+        Records the historical learners in a .npz file with "scores" (n, n_outcomes) and "pages" (n) arrays.
+        """
+        with np.load(path) as data:
+            scores = data["scores"]
+            pages = data["pages"].tolist()
+        # Indexed straight away, rather than searched directly until a rebuild
+        thread = self.record(scores, pages)
+        if thread is not None:
+            thread.join()
+
+    def info(self):
+        with self._lock:
+            return {"pool": len(self._index) + self._tail_size, "indexed": len(self._index),
+                    "cells": len(self._index.centroids)}
@@ -0,0 +1,276 @@
+"""
+Re-scores historical quiz submissions offline, across every core.
+
+Usage:
+    python rescore.py submissions.jsonl feedback.jsonl [--bank bank.json] [--processes N] [--chunk-size 1024]
+                      [--seed 0] [--restart]
+
+Submissions are read one /quiz_feedback payload per line, and one result per submission is written in the same
+order, as /quiz_feedback/batch returns them (with the submission's "id" first when it has one).  Lines that aren't
+valid submissions get an error result in their place.
+
+The compiled question bank is pickled once with its arrays out of band, and those arrays (the stacked outcome matrix
+among them) are put in one shared memory block that every worker process maps, rather than each receiving a copy.
+The phrase tables are constants of app, which each worker already has.  Workers are sent chunks of raw lines and send
+back encoded output, and only a couple of chunks per process are in flight, so an input of any size is streamed.
+
+Progress is reported on stderr and checkpointed next to the output every few seconds.  Running the same command again
+after an interruption carries on from the last checkpoint, and gives the same output as an uninterrupted run, since
+each chunk draws its phrase choices from the seed and its own position.
+"""
+
+import argparse
+import json
+import os
+import pickle
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+# Rescoring replays old submissions, which are not new results
+os.environ.setdefault("QUIZ_RESULTS_DIR", "")
+
+import app  # noqa: E402
+
+CHUNK_SIZE = 1024
+CHECKPOINT_INTERVAL = 5.0
+PROGRESS_INTERVAL = 1.0
+# Arrays are placed at multiples of this in the shared block
+ALIGNMENT = 64
+
+
+class RescoreError(ValueError):
+    pass
+
+
+class SharedBank():
+    """
+    A compiled question bank pickled with its arrays out of band, and the arrays copied into shared memory.
+    """
+    def __init__(self, compiled_bank: app.CompiledQuestionBank):
+        buffers = []
+        self.data = pickle.dumps(compiled_bank, protocol=5, buffer_callback=buffers.append)
+        raw = [buffer.raw() for buffer in buffers]
+
+        self.layout = []
+        size = 0
+        for buffer in raw:
+            self.layout.append((size, buffer.nbytes))
+            size += -(-buffer.nbytes // ALIGNMENT) * ALIGNMENT
+        self.memory = SharedMemory(create=True, size=max(size, 1))
+        for (start, length), buffer in zip(self.layout, raw):
+            self.memory.buf[start:start + length] = buffer
+
+    def spec(self):
+        # All a worker needs to attach: a block name, a small pickle and the offsets of the arrays
+        return self.memory.name, self.data, self.layout
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+def attach_bank(name, data, layout):
+    """
+    Unpickles a SharedBank's compiled bank in another process, its arrays read-only views of the shared block.
+    """
+    memory = SharedMemory(name=name)
+    view = memory.buf.toreadonly()
+    compiled_bank = pickle.loads(data, buffers=[view[start:start + length] for start, length in layout])
+    return memory, compiled_bank
+
+
+# Set in each worker process by _init_worker
+_memory = None
+_compiled_bank = None
+
+
+def _init_worker(spec):
+    global _memory, _compiled_bank
+    _memory, _compiled_bank = attach_bank(*spec)
+
+
+def rescore_chunk(lines, seed):
+    """
+    Scores a chunk of raw submission lines, and returns the encoded result lines.
+    """
+    payloads = []
+    for line in lines:
+        try:
+            payloads.append(json.loads(line))
+        except ValueError as e:
+            payloads.append(e)
+
+    output = []
+    for payload, result in zip(payloads, app.get_batch_quiz_feedback(payloads, _compiled_bank, seed=seed)):
+        if type(payload) is dict and "id" in payload:
+            result = {"id": payload["id"], **result}
+        output.append(json.dumps(result))
+    output.append("")
+    return "\n".join(output).encode()
+
+
+def read_chunks(f, chunk_size):
+    """
+    Yields chunks of up to chunk_size non-blank lines, each with the input offset just after it.
+    """
+    chunk = []
+    offset = f.tell()
+    for line in f:
+        offset += len(line)
+        if line.strip():
+            chunk.append(line)
+            if len(chunk) == chunk_size:
+                yield chunk, offset
+                chunk = []
+    if chunk:
+        yield chunk, offset
+
+
+def checkpoint_path(output_path):
+    return output_path + ".progress"
+
+
+def load_checkpoint(path, expected):
+    """
+    The saved checkpoint, or None to start from the beginning.  Raises RescoreError if it is for a different run.
+    """
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+    for key, value in expected.items():
+        if checkpoint.get(key) != value:
+            raise RescoreError(f"{path} is for a run with a different {key} ({checkpoint.get(key)!r}, not "
+                               f"{value!r}); use --restart to start over")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint, output):
+    # The output is on disk before the checkpoint that points past it
+    output.flush()
+    os.fsync(output.fileno())
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
+
+
+def rescore(input_path, output_path, compiled_bank: app.CompiledQuestionBank, processes=None,
+            chunk_size=CHUNK_SIZE, seed=0, restart=False, progress=sys.stderr):
+    """
+    Rescores every submission in input_path into output_path, resuming from a checkpoint unless restart is set.
+    Returns the number of submissions written.
+    """
+    processes = processes or os.cpu_count() or 1
+    progress_path = checkpoint_path(output_path)
+    run = {"input": os.path.abspath(input_path), "fingerprint": compiled_bank.fingerprint, "seed": seed,
+           "chunk_size": chunk_size}
+    checkpoint = None if restart else load_checkpoint(progress_path, run)
+    if checkpoint is None:
+        checkpoint = dict(run, chunks=0, lines=0, input_offset=0, output_offset=0)
+
+    if checkpoint["output_offset"] and (not os.path.exists(output_path) or
+                                        os.path.getsize(output_path) < checkpoint["output_offset"]):
+        raise RescoreError(f"{output_path} is shorter than {progress_path} says; use --restart to start over")
+
+    input_size = os.path.getsize(input_path)
+    resumed_lines = checkpoint["lines"]
+    if resumed_lines:
+        progress.write(f"Resuming after {resumed_lines} submissions\n")
+
+    shared = SharedBank(compiled_bank)
+    try:
+        with open(input_path, "rb") as source, \
+                open(output_path, "r+b" if checkpoint["output_offset"] else "wb") as output, \
+                ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(shared.spec(),)) as executor:
+            source.seek(checkpoint["input_offset"])
+            output.truncate(checkpoint["output_offset"])
+            output.seek(checkpoint["output_offset"])
+
+            start = time.monotonic()
+            last_checkpoint = last_progress = start
+
+            def write(pending):
+                nonlocal last_checkpoint, last_progress
+                future, n_lines, input_offset = pending
+                output.write(future.result())
+                checkpoint["chunks"] += 1
+                checkpoint["lines"] += n_lines
+                checkpoint["input_offset"] = input_offset
+                checkpoint["output_offset"] = output.tell()
+
+                now = time.monotonic()
+                if now - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    save_checkpoint(progress_path, checkpoint, output)
+                    last_checkpoint = now
+                if now - last_progress >= PROGRESS_INTERVAL:
+                    report_progress(progress, checkpoint, resumed_lines, now - start, input_size)
+                    last_progress = now
+
+            pending = deque()
+            try:
+                chunk_number = checkpoint["chunks"]
+                for lines, input_offset in read_chunks(source, chunk_size):
+                    future = executor.submit(rescore_chunk, lines, [seed, chunk_number])
+                    pending.append((future, len(lines), input_offset))
+                    chunk_number += 1
+                    if len(pending) >= 2 * processes:
+                        write(pending.popleft())
+                while pending:
+                    write(pending.popleft())
+            except BaseException:
+                # Keeps what was written in order, so the next run picks up from there
+                for future, _, _ in pending:
+                    future.cancel()
+                save_checkpoint(progress_path, checkpoint, output)
+                raise
+            output.flush()
+            report_progress(progress, checkpoint, resumed_lines, time.monotonic() - start, input_size)
+    finally:
+        shared.close()
+
+    # Finished, so a later run starts over
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    return checkpoint["lines"]
+
+
+def report_progress(progress, checkpoint, resumed_lines, elapsed, input_size):
+    done = checkpoint["lines"] - resumed_lines
+    rate = done / elapsed if elapsed > 0 else 0
+    fraction = checkpoint["input_offset"] / input_size if input_size else 1
+    progress.write(f"{checkpoint['lines']} submissions, {rate:.0f}/s, {fraction:.1%} of the input\n")
+    progress.flush()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="submissions, one JSON payload per line")
+    parser.add_argument("output", help="where to write the results, one per line")
+    parser.add_argument("--bank", help="question bank to score with (JSON or .npz), instead of the app's")
+    parser.add_argument("--processes", type=int, help="worker processes, the number of CPUs by default")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="submissions sent to a worker at once")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the phrase choices of unseeded submissions")
+    parser.add_argument("--restart", action="store_true", help="ignore any checkpoint and start from the beginning")
+    args = parser.parse_args(argv[1:])
+
+    if args.bank:
+        compiled_bank = app.load_question_bank(args.bank).compile()
+    else:
+        compiled_bank = app.BANK_REGISTRY.current().compiled
+    try:
+        rescore(args.input, args.output, compiled_bank, args.processes, args.chunk_size, args.seed, args.restart)
+    except RescoreError as e:
+        print(e, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print("Interrupted, run the same command again to carry on", file=sys.stderr)
+        return 130
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,285 @@
+"""
+Append-only storage of scored quizzes, and the cohort aggregates built from them.
+
+Each scored quiz is recorded as a row holding its cohort, time and score vector, plus one row per answer.  Rows are
+buffered in memory and written out as NumPy .npy shards, each shard a directory of:
+    results.npy   time, cohort, number of questions and scores of each quiz
+    answers.npy   the quiz (row of results.npy), question and answer of each answer
+    names.json    the cohort names and question IDs that the cohort and question columns index into
+
+Aggregates (counts, sums, score histograms, weakest outcome counts and answer counts) are kept per cohort and for
+every cohort together, and folded forward as rows arrive, so a query reads them directly instead of scanning every
+stored quiz.  Shards are written by a background thread, so neither the request that fills a shard nor the store's
+lock waits on the disk.  Shards written by other workers into the same directory are picked up and folded in on the
+next query.
+"""
+
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import numpy as np
+
+PERCENTILES = (10, 25, 50, 75, 90)
+SHARD_PREFIX = "shard-"
+
+
+def result_dtype(n_outcomes):
+    return np.dtype([("time", "<f8"), ("cohort", "<u4"), ("n_questions", "<u2"), ("scores", "<i4", (n_outcomes,))])
+
+
+ANSWER_DTYPE = np.dtype([("result", "<u4"), ("question", "<u4"), ("answer", "<u2")])
+
+
+class CohortAggregate():
+    """
+    Running totals for one cohort, updated a block of quizzes at a time.
+    """
+    __slots__ = ("count", "score_sum", "score_sqsum", "weakest", "low", "histogram", "answers")
+
+    def __init__(self, n_outcomes):
+        self.count = 0
+        self.score_sum = np.zeros(n_outcomes, dtype=np.float64)
+        self.score_sqsum = np.zeros(n_outcomes, dtype=np.float64)
+        self.weakest = np.zeros(n_outcomes, dtype=np.int64)
+        # histogram[k, s - low] counts the quizzes that scored s on outcome k
+        self.low = 0
+        self.histogram = np.zeros((n_outcomes, 0), dtype=np.int64)
+        # answers[question, answer] counts how often each answer was given
+        self.answers = np.zeros((0, 0), dtype=np.int64)
+
+    def add(self, scores, weakest, questions, answers):
+        n_outcomes = scores.shape[1]
+        self.count += len(scores)
+        self.score_sum += scores.sum(axis=0)
+        self.score_sqsum += np.square(scores, dtype=np.float64).sum(axis=0)
+        self.weakest += np.bincount(weakest, minlength=n_outcomes)
+
+        if len(scores):
+            low = min(self.low, int(scores.min())) if self.histogram.shape[1] else int(scores.min())
+            high = max(self.low + self.histogram.shape[1], int(scores.max()) + 1)
+            if low != self.low or high - low != self.histogram.shape[1]:
+                histogram = np.zeros((n_outcomes, high - low), dtype=np.int64)
+                histogram[:, self.low - low:self.low - low + self.histogram.shape[1]] = self.histogram
+                self.low, self.histogram = low, histogram
+            width = self.histogram.shape[1]
+            index = (np.arange(n_outcomes) * width + (scores - self.low)).ravel()
+            self.histogram += np.bincount(index, minlength=n_outcomes * width).reshape(n_outcomes, width)
+
+        if len(questions):
+            shape = (max(self.answers.shape[0], int(questions.max()) + 1),
+                     max(self.answers.shape[1], int(answers.max()) + 1))
+            if shape != self.answers.shape:
+                counts = np.zeros(shape, dtype=np.int64)
+                counts[:self.answers.shape[0], :self.answers.shape[1]] = self.answers
+                self.answers = counts
+            width = self.answers.shape[1]
+            index = questions.astype(np.int64) * width + answers
+            self.answers += np.bincount(index, minlength=self.answers.size).reshape(self.answers.shape)
+
+    def percentiles(self, percentiles=PERCENTILES):
+        """
+        The nearest-rank percentiles of each outcome's score, as an (n_outcomes, len(percentiles)) array.
+        """
+        if not self.count:
+            return np.zeros((len(self.score_sum), len(percentiles)), dtype=np.int64)
+        cumulative = self.histogram.cumsum(axis=1)
+        ranks = np.ceil(np.asarray(percentiles) / 100 * self.count).clip(1)
+        return np.asarray([np.searchsorted(row, ranks) for row in cumulative]) + self.low
+
+
+class ResultStore():
+    """
+    Records scored quizzes and keeps the per-cohort aggregates up to date.  With directory=None results are only
+    aggregated in memory.  accepts_cohort() stops new cohorts being started once there are max_cohorts.
+    """
+    def __init__(self, directory=None, n_outcomes=6, shard_size=65536, flush_interval=60, max_cohorts=None):
+        self.directory = directory
+        self.n_outcomes = n_outcomes
+        self.max_cohorts = max_cohorts
+        self.dtype = result_dtype(n_outcomes)
+        self.shard_size = shard_size
+        self.flush_interval = flush_interval
+        self._lock = Lock()
+        self._cohorts = []
+        self._cohort_ids = dict()
+        self._questions = []
+        self._question_ids = dict()
+        # Recorded blocks not yet written to a shard, and how many of them are already folded into the aggregates
+        self._pending = []
+        self._pending_rows = 0
+        self._folded = 0
+        self._pending_since = None
+        self._shards = set()
+        self._shard_number = 0
+        # Writes shards in order, one at a time.  Created on first use, so each worker process gets its own thread
+        self._writer = None
+        self._writer_pid = None
+        self._last_write = None
+        self.aggregates = dict()
+        self.total = CohortAggregate(n_outcomes)
+        # Stored shards are folded in by the first query, not at startup
+
+    def _intern(self, ids, names, name):
+        index = ids.get(name)
+        if index is None:
+            index = ids[name] = len(names)
+            names.append(name)
+        return index
+
+    def accepts_cohort(self, cohort):
+        """
+        Whether quizzes can be recorded under cohort: any known cohort, or a new one while there are fewer than
+        max_cohorts.  Checked before scoring, so concurrent requests can each start one more.
+        """
+        if self.max_cohorts is None:
+            return True
+        with self._lock:
+            return cohort in self._cohort_ids or len(self._cohorts) < self.max_cohorts
+
+    def record(self, cohorts, questions, answers, scores):
+        """
+        Records a block of scored quizzes.  cohorts has one name per quiz, questions and answers one list per quiz, and
+        scores is the (n_quizzes, n_outcomes) score matrix.
+        """
+        if not len(cohorts):
+            return
+        scores = np.asarray(scores, dtype=np.int32).reshape(len(cohorts), self.n_outcomes)
+        with self._lock:
+            cohort_ids = np.asarray([self._intern(self._cohort_ids, self._cohorts, cohort) for cohort in cohorts],
+                                    dtype=np.uint32)
+            lengths = np.asarray([len(quiz) for quiz in questions], dtype=np.uint16)
+            question_ids = np.asarray([self._intern(self._question_ids, self._questions, question)
+                                       for quiz in questions for question in quiz], dtype=np.uint32)
+            answer_ids = np.asarray([answer for quiz in answers for answer in quiz], dtype=np.uint16)
+
+            now = time.time()
+            self._pending.append((np.full(len(cohorts), now), cohort_ids, lengths, scores, question_ids, answer_ids))
+            self._pending_rows += len(cohorts)
+            if self._pending_since is None:
+                self._pending_since = now
+            if self._pending_rows >= self.shard_size or now - self._pending_since >= self.flush_interval:
+                self._flush()
+
+    def _fold_pending(self):
+        for block in self._pending[self._folded:]:
+            _, cohort_ids, lengths, scores, question_ids, answer_ids = block
+            self._fold(cohort_ids, scores, np.repeat(cohort_ids, lengths), question_ids, answer_ids)
+        self._folded = len(self._pending)
+
+    def _fold(self, cohort_ids, scores, answer_cohorts, question_ids, answer_ids):
+        # Same ranking as Feedback: the weakest outcome is the first of an ascending argsort
+        weakest = np.argsort(scores, axis=1)[:, 0]
+        scores = scores.astype(np.int64)
+        self.total.add(scores, weakest, question_ids, answer_ids)
+        for cohort in np.unique(cohort_ids).tolist():
+            quizzes = cohort_ids == cohort
+            given = answer_cohorts == cohort
+            aggregate = self.aggregates.get(cohort)
+            if aggregate is None:
+                aggregate = self.aggregates[cohort] = CohortAggregate(self.n_outcomes)
+            aggregate.add(scores[quizzes], weakest[quizzes], question_ids[given], answer_ids[given])
+
+    def _flush(self):
+        self._fold_pending()
+        if self.directory is not None and self._pending:
+            self._shard_number += 1
+            times = self._pending[0][0]
+            name = f"{SHARD_PREFIX}{int(times[0] * 1000):015d}-{os.getpid()}-{self._shard_number:06d}"
+            # Already folded in, so it is marked as seen before it is on disk.  Names are only ever appended, so the
+            # writer can slice them outside the lock
+            self._shards.add(name)
+            if self._writer_pid != os.getpid():
+                self._writer = ThreadPoolExecutor(1, thread_name_prefix="result-shards")
+                self._writer_pid = os.getpid()
+            self._last_write = self._writer.submit(self._write_shard, name, self._pending, len(self._cohorts),
+                                                   len(self._questions))
+        self._pending = []
+        self._pending_rows = 0
+        self._folded = 0
+        self._pending_since = None
+
+    def _write_shard(self, name, pending, n_cohorts, n_questions):
+        try:
+            self._write_shard_files(name, pending, self._cohorts[:n_cohorts], self._questions[:n_questions])
+        except OSError:
+            logging.getLogger(__name__).exception(f"Could not write result shard {name}")
+
+    def _write_shard_files(self, name, pending, cohorts, questions):
+        times, cohort_ids, lengths, scores, question_ids, answer_ids = (np.concatenate(column)
+                                                                        for column in zip(*pending))
+        results = np.empty(len(times), dtype=self.dtype)
+        results["time"] = times
+        results["cohort"] = cohort_ids
+        results["n_questions"] = lengths
+        results["scores"] = scores
+        answers = np.empty(len(question_ids), dtype=ANSWER_DTYPE)
+        answers["result"] = np.repeat(np.arange(len(times)), lengths)
+        answers["question"] = question_ids
+        answers["answer"] = answer_ids
+
+        # Written under a hidden name and renamed, so other workers never see a partial shard
+        staging = os.path.join(self.directory, "." + name)
+        os.makedirs(staging)
+        np.save(os.path.join(staging, "results.npy"), results)
+        np.save(os.path.join(staging, "answers.npy"), answers)
+        with open(os.path.join(staging, "names.json"), "w") as f:
+            json.dump({"cohorts": cohorts, "questions": questions}, f)
+        os.rename(staging, os.path.join(self.directory, name))
+
+    def _fold_new_shards(self):
+        if self.directory is None or not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            if not name.startswith(SHARD_PREFIX) or name in self._shards:
+                continue
+            self._shards.add(name)
+            path = os.path.join(self.directory, name)
+            with open(os.path.join(path, "names.json")) as f:
+                names = json.load(f)
+            results = np.load(os.path.join(path, "results.npy"), mmap_mode="r")
+            answers = np.load(os.path.join(path, "answers.npy"), mmap_mode="r")
+
+            # The shard's IDs are its writer's, so they are mapped onto this store's
+            cohort_map = np.asarray([self._intern(self._cohort_ids, self._cohorts, cohort)
+                                     for cohort in names["cohorts"]], dtype=np.uint32)
+            question_map = np.asarray([self._intern(self._question_ids, self._questions, question)
+                                       for question in names["questions"]], dtype=np.uint32)
+            cohort_ids = cohort_map[results["cohort"]]
+            self._fold(cohort_ids, np.asarray(results["scores"]), cohort_ids[answers["result"]],
+                       question_map[answers["question"]], np.asarray(answers["answer"]))
+
+    def flush(self):
+        """
+        Writes out everything recorded so far, and waits for it to be on disk.
+        """
+        with self._lock:
+            self._flush()
+            last_write = self._last_write if self._writer_pid == os.getpid() else None
+        if last_write is not None:
+            last_write.result()
+
+    def aggregate(self, cohort=None):
+        """
+        The aggregate for one cohort, or for every cohort together when cohort is None.  Returns None for a cohort with
+        no results.
+        """
+        with self._lock:
+            self._fold_pending()
+            self._fold_new_shards()
+            if cohort is not None:
+                index = self._cohort_ids.get(cohort)
+                return None if index is None else self.aggregates.get(index)
+
+            return self.total
+
+    def cohorts(self):
+        with self._lock:
+            self._fold_new_shards()
+            return [self._cohorts[index] for index in sorted(self.aggregates)]
+
+    def question_id(self, index):
+        return self._questions[index]
@@ -0,0 +1,230 @@
+"""
+Offline precomputed scores for every possible quiz.
+
+Only a finite number of quizzes exist: a choice of N_QUESTIONS questions from the bank, and one answer per question.
+`build` enumerates all of them and writes each quiz's score vector and learning outcome ranks to a flat binary file.
+The service memory-maps that file, so scoring a quiz becomes a single lookup and the pages are shared between workers.
+
+A quiz's entry is found with two ranks:
+    - the colex combinatorial rank of its (sorted) question positions picks the block for that question subset
+    - the mixed radix number formed by its answers, in question order, is the entry within that block
+
+Usage:
+    python score_table.py build quiz_scores.bin
+    python score_table.py check quiz_scores.bin
+"""
+
+import os
+import struct
+import sys
+from itertools import combinations
+from math import comb
+
+import numpy as np
+
+
+MAGIC = b"NWSCORE1"
+# magic, bank fingerprint, number of questions in the bank, questions per quiz, number of subsets, number of entries
+HEADER = struct.Struct("<8s16sIIQQ")
+HEADER_SIZE = 64
+MAX_ENTRIES = 50_000_000
+
+
+class ScoreTableError(Exception):
+    pass
+
+
+def _row_layout(engine):
+    # For every row of the scoring matrix, the position of its question in the bank and its answer index
+    row_question = np.repeat(np.arange(len(engine.question_ids)), [engine.n_answers[q] for q in engine.question_ids])
+    row_answer = np.arange(len(row_question)) - np.asarray([engine.offsets[q] for q in engine.question_ids])[row_question]
+    return row_question, row_answer
+
+
+def build_score_table(engine, n_questions):
+    """
+    Returns the subset offsets, the (n_entries, 6) score matrix and the (n_entries, 6) ranks for every quiz of
+    n_questions questions.
+    """
+    question_ids = engine.question_ids
+    starts = np.asarray([engine.offsets[q] for q in question_ids], dtype=np.intp)
+    radices = np.asarray([engine.n_answers[q] for q in question_ids], dtype=np.int64)
+
+    # Checked before anything is enumerated, as a bank that is too big could have more subsets than fit in memory
+    n_entries = count_quizzes(radices.tolist(), n_questions)
+    if n_entries > MAX_ENTRIES:
+        raise ScoreTableError(f"The bank has {n_entries} possible quizzes, which is too many to precompute.")
+
+    subsets = sorted(combinations(range(len(question_ids)), n_questions), key=lambda subset: _subset_rank(subset))
+    sizes = [int(np.prod(radices[list(subset)])) for subset in subsets]
+
+    offsets = np.zeros(len(subsets) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+
+    scores = np.empty((n_entries, engine.matrix.shape[1]), dtype=np.int64)
+    for subset, start, end in zip(subsets, offsets[:-1], offsets[1:]):
+        subset = list(subset)
+        # Every answer combination in C order, so the last question's answer varies fastest
+        answers = np.indices(radices[subset]).reshape(len(subset), -1).T
+        rows = starts[subset] + answers
+        scores[start:end] = engine.matrix[rows].sum(axis=1)
+
+    if np.abs(scores).max(initial=0) > np.iinfo(np.int16).max:
+        raise ScoreTableError("Scores are too large to be stored as int16.")
+
+    # Same ranking as Feedback, worked out on the same int64 scores so ties are broken the same way
+    ranks = np.argsort(scores, axis=1)[:, ::-1].astype(np.uint8)
+    return offsets, scores.astype(np.int16), ranks
+
+
+def count_quizzes(radices, n_questions):
+    """
+    The number of quizzes of n_questions questions, given each question's number of answers: the sum, over every
+    subset of n_questions questions, of the product of their numbers of answers.
+    """
+    # counts[k] is the number of quizzes of k questions among the questions seen so far
+    counts = [1] + [0] * n_questions
+    for radix in radices:
+        for k in range(n_questions, 0, -1):
+            counts[k] += counts[k - 1] * radix
+    return counts[n_questions]
+
+
+def _subset_rank(positions):
+    return sum(comb(p, i + 1) for i, p in enumerate(positions))
+
+
+def write_score_table(path, engine, fingerprint, n_questions):
+    offsets, scores, ranks = build_score_table(engine, n_questions)
+    header = HEADER.pack(MAGIC, bytes.fromhex(fingerprint), len(engine.question_ids), n_questions,
+                         len(offsets) - 1, len(scores))
+
+    # Written under a temporary name in the same directory and renamed, so a running service never maps a partial table
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(header.ljust(HEADER_SIZE, b"\0"))
+            f.write(offsets.tobytes())
+            f.write(scores.tobytes())
+            f.write(ranks.tobytes())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return len(scores)
+
+
+class ScoreTable():
+    """
+    Memory-mapped table written by `write_score_table`, for one compiled question bank.
+    """
+    def __init__(self, path, engine, fingerprint):
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER.size:
+            raise ScoreTableError(f"{path} is not a score table.")
+
+        magic, table_fingerprint, n_bank_questions, n_questions, n_subsets, n_entries = HEADER.unpack_from(header)
+        if magic != MAGIC:
+            raise ScoreTableError(f"{path} is not a score table.")
+        if table_fingerprint.hex() != fingerprint or n_bank_questions != len(engine.question_ids):
+            raise ScoreTableError(f"{path} was built from a different question bank.  Please rebuild it.")
+        width = engine.matrix.shape[1]
+        # The offsets, then the int16 scores and the uint8 ranks of every entry
+        size = HEADER_SIZE + 8 * (n_subsets + 1) + 3 * width * n_entries
+        if os.path.getsize(path) != size:
+            raise ScoreTableError(f"{path} is {os.path.getsize(path)} bytes, but its header describes {size}.  "
+                                  f"Please rebuild it.")
+
+        self.path = path
+        self.n_questions = n_questions
+        self.offsets = np.memmap(path, dtype=np.int64, mode="r", offset=HEADER_SIZE, shape=(n_subsets + 1,))
+        position = HEADER_SIZE + self.offsets.nbytes
+        self.scores = np.memmap(path, dtype=np.int16, mode="r", offset=position, shape=(n_entries, width))
+        position += self.scores.nbytes
+        self.ranks = np.memmap(path, dtype=np.uint8, mode="r", offset=position, shape=(n_entries, width))
+
+        row_question, row_answer = _row_layout(engine)
+        self._row_question = row_question.tolist()
+        self._row_answer = row_answer.tolist()
+        self._radices = [engine.n_answers[q] for q in engine.question_ids]
+        self._comb = [[comb(p, i + 1) for i in range(n_questions)] for p in range(len(engine.question_ids))]
+
+    def index(self, rows):
+        """
+        Returns the entry for a quiz given as scoring matrix rows, or None if the table doesn't hold that quiz.
+        """
+        if len(rows) != self.n_questions:
+            return None
+
+        answered = sorted(zip(map(self._row_question.__getitem__, rows), map(self._row_answer.__getitem__, rows)))
+        subset_rank = 0
+        index = 0
+        previous = -1
+        for i, (position, answer) in enumerate(answered):
+            if position == previous:
+                # The same question twice
+                return None
+            subset_rank += self._comb[position][i]
+            index = index * self._radices[position] + answer
+            previous = position
+        return int(self.offsets[subset_rank]) + index
+
+    def lookup(self, rows):
+        entry = self.index(rows)
+        if entry is None:
+            return None
+        return self.scores[entry], tuple(self.ranks[entry].tolist())
+
+
+def check_score_table(table, engine, n_samples=10000, seed=0):
+    """
+    Recomputes a random sample of quizzes from the question bank and compares them to the table.
+    """
+    from app import Feedback, QUESTION_BANK, learning_outcomes
+
+    rng = np.random.default_rng(seed)
+    question_ids = engine.question_ids
+    mismatches = 0
+    for _ in range(n_samples):
+        questions = [question_ids[i] for i in rng.choice(len(question_ids), table.n_questions, replace=False)]
+        answers = [int(rng.integers(engine.n_answers[q])) for q in questions]
+
+        # Scored straight from the Question objects, independently of the scoring engine
+        scores = np.zeros(len(learning_outcomes), dtype=np.int64)
+        for question, answer in zip(questions, answers):
+            scores += np.asarray(QUESTION_BANK.id_to_question(question).get_learning_outcome_score(answer))
+
+        table_scores, table_ranks = table.lookup(engine.rows(questions, answers))
+        if not np.array_equal(scores, table_scores) or Feedback(scores).learning_outcomes_ranks != table_ranks:
+            mismatches += 1
+    return mismatches
+
+
+def main(argv):
+    if len(argv) != 3 or argv[1] not in ("build", "check"):
+        print(__doc__)
+        return 2
+
+    from app import COMPILED_BANK, N_QUESTIONS
+
+    command, path = argv[1], argv[2]
+    engine = COMPILED_BANK.engine
+    if command == "build":
+        n_entries = write_score_table(path, engine, COMPILED_BANK.fingerprint, N_QUESTIONS)
+        print(f"Wrote {n_entries} quiz scores to {path}")
+        return 0
+
+    try:
+        table = ScoreTable(path, engine, COMPILED_BANK.fingerprint)
+    except ScoreTableError as e:
+        print(e)
+        return 1
+    mismatches = check_score_table(table, engine)
+    print(f"{mismatches} mismatches found in {path}")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
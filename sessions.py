@@ -0,0 +1,262 @@
+"""
+Session state for learners who answer a quiz one question at a time.
+
+A session keeps a running score vector, so each answer is a single vector add, and the matrix rows of the answers
+given so far.  Sessions are stored through a SessionStore, either as objects in process (LocalSessionStore) or as
+compact binary records in a SQLite file that every worker on the machine can share (SQLiteSessionStore).
+"""
+
+import struct
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock, local
+
+import numpy as np
+
+# format version, bank fingerprint, last update time, number of outcomes, number of answers
+SESSION_HEADER = struct.Struct("<B16sdBI")
+SESSION_FORMAT_VERSION = 2
+# Format 1 counted the answers in a u16, and is still read so stored sessions outlive an upgrade
+SESSION_HEADERS = {1: struct.Struct("<B16sdBH"), SESSION_FORMAT_VERSION: SESSION_HEADER}
+SESSION_ROW = struct.Struct("<I")
+
+
+class SessionError(Exception):
+    pass
+
+
+class Session():
+    # The encoded rows and the set of answered rows are kept up to date as answers are added, so an answer costs the
+    # same however many came before it
+    __slots__ = ("fingerprint", "scores", "rows", "updated", "_encoded_rows", "_answered")
+
+    def __init__(self, fingerprint, n_outcomes, scores=None, rows=None, updated=None, encoded_rows=None):
+        self.fingerprint = fingerprint
+        self.scores = np.zeros(n_outcomes, dtype=np.int32) if scores is None else scores
+        self.rows = [] if rows is None else rows
+        self.updated = time.time() if updated is None else updated
+        if encoded_rows is None:
+            encoded_rows = np.asarray(self.rows, dtype="<u4").tobytes()
+        self._encoded_rows = bytearray(encoded_rows)
+        self._answered = None
+
+    @property
+    def answered(self):
+        # Only built when a session is first checked for repeated questions
+        if self._answered is None:
+            self._answered = set(self.rows)
+        return self._answered
+
+    def has_answer(self, start, stop):
+        """
+        Whether any of the rows start..stop-1, which are one question's answers, has been answered.
+        """
+        answered = self.answered
+        return any(row in answered for row in range(start, stop))
+
+    def add_answer(self, row, outcome):
+        self.scores += outcome
+        self.rows.append(row)
+        self._encoded_rows += SESSION_ROW.pack(row)
+        if self._answered is not None:
+            self._answered.add(row)
+        self.updated = time.time()
+
+    def encode(self):
+        header = SESSION_HEADER.pack(SESSION_FORMAT_VERSION, bytes.fromhex(self.fingerprint), self.updated,
+                                     len(self.scores), len(self.rows))
+        return header + self.scores.astype("<i4").tobytes() + self._encoded_rows
+
+    @classmethod
+    def decode(cls, data):
+        header = SESSION_HEADERS.get(data[0]) if data else None
+        if header is None:
+            raise SessionError(f"Unknown session format {data[:1].hex()}")
+        # A truncated or corrupted record is reported like any other unusable session
+        try:
+            format_version, fingerprint, updated, n_outcomes, n_rows = header.unpack_from(data)
+        except struct.error as e:
+            raise SessionError(f"Corrupted session: {e}")
+        position = header.size
+        size = position + 4 * n_outcomes + 4 * n_rows
+        if len(data) != size:
+            raise SessionError(f"Corrupted session: {len(data)} bytes, expected {size}")
+        scores = np.frombuffer(data, dtype="<i4", count=n_outcomes, offset=position).astype(np.int32)
+        position += 4 * n_outcomes
+        encoded_rows = data[position:]
+        rows = np.frombuffer(encoded_rows, dtype="<u4").tolist()
+        return cls(fingerprint.hex(), n_outcomes, scores, rows, updated, encoded_rows)
+
+
+class SessionStore(ABC):
+    """
+    Stores sessions by ID, and forgets them ttl seconds after their last update.  Sessions are stored as whatever
+    encode() returns, and read back with decode().
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def encode(self, session: Session):
+        return session.encode()
+
+    def decode(self, data):
+        return Session.decode(data)
+
+    @abstractmethod
+    def get(self, session_id):
+        pass
+
+    @abstractmethod
+    def put(self, session_id, data):
+        pass
+
+    @abstractmethod
+    def delete(self, session_id):
+        pass
+
+    @abstractmethod
+    def update(self, session_id, function):
+        """
+        Atomically replaces a session's data with function(data).  Returns the new data, or None if there was no
+        session to update.
+        """
+
+    @abstractmethod
+    def evict_expired(self):
+        pass
+
+
+class LocalSessionStore(SessionStore):
+    # Sessions are kept in last-updated order, so expired ones, and the ones dropped when there are more than
+    # max_sessions, are always at the front
+    def __init__(self, ttl, max_sessions=None):
+        super().__init__(ttl)
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = Lock()
+
+    # Sessions are kept as objects, and updated in place
+    def encode(self, session: Session):
+        return session
+
+    def decode(self, data):
+        return data if isinstance(data, Session) else Session.decode(data)
+
+    def _evict_expired(self, now):
+        while self._sessions:
+            session_id, (expires, _) = next(iter(self._sessions.items()))
+            if expires > now:
+                break
+            del self._sessions[session_id]
+
+    def get(self, session_id):
+        with self._lock:
+            self._evict_expired(time.time())
+            entry = self._sessions.get(session_id)
+            return None if entry is None else entry[1]
+
+    def put(self, session_id, data):
+        with self._lock:
+            now = time.time()
+            self._evict_expired(now)
+            self._sessions[session_id] = (now + self.ttl, data)
+            self._sessions.move_to_end(session_id)
+            if self.max_sessions is not None:
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def update(self, session_id, function):
+        with self._lock:
+            now = time.time()
+            self._evict_expired(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            data = function(entry[1])
+            self._sessions[session_id] = (now + self.ttl, data)
+            self._sessions.move_to_end(session_id)
+            return data
+
+    def evict_expired(self):
+        with self._lock:
+            self._evict_expired(time.time())
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions in a local SQLite database, so they are shared by every worker process and survive restarts.
+    """
+    def __init__(self, path, ttl):
+        super().__init__(ttl)
+        self.path = path
+        self._connections = local()
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data BLOB NOT NULL, "
+                               "expires REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+
+    def _connect(self):
+        # One connection per thread, since SQLite connections can't be shared between threads
+        connection = getattr(self._connections, "connection", None)
+        if connection is None:
+            # Only imported when SQLite sessions are used
+            import sqlite3
+
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._connections.connection = connection
+        return connection
+
+    def get(self, session_id):
+        row = self._connect().execute("SELECT data FROM sessions WHERE id = ? AND expires > ?",
+                                      (session_id, time.time())).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, session_id, data):
+        self._connect().execute("INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)",
+                                (session_id, data, time.time() + self.ttl))
+
+    def delete(self, session_id):
+        return self._connect().execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0
+
+    def update(self, session_id, function):
+        connection = self._connect()
+        now = time.time()
+        # Takes the write lock up front, so two workers can't both read the old data
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT data FROM sessions WHERE id = ? AND expires > ?",
+                                     (session_id, now)).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            data = function(row[0])
+            connection.execute("UPDATE sessions SET data = ?, expires = ? WHERE id = ?",
+                               (data, now + self.ttl, session_id))
+            connection.execute("COMMIT")
+            return data
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def evict_expired(self):
+        self._connect().execute("DELETE FROM sessions WHERE expires <= ?", (time.time(),))
+
+
+def create_session_store(url, ttl, max_local_sessions=None):
+    """
+    "local" for an in-process store, or "sqlite:///path/to/sessions.db" for a SQLite store.
+    """
+    if url == "local":
+        return LocalSessionStore(ttl, max_local_sessions)
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):], ttl)
+    raise ValueError(f"Unknown session store: {url}")
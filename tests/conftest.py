@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Tests never write results, snapshots or profiles next to the app
+os.environ.setdefault("QUIZ_RESULTS_DIR", "")
+os.environ.setdefault("QUIZ_SNAPSHOT", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
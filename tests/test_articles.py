@@ -0,0 +1,13 @@
+import json
+
+import articles
+
+
+def test_feed_reports_bad_lines_in_place(tmp_path, capsys):
+    feed = tmp_path / "feed.jsonl"
+    feed.write_text("\n".join(['{"text": "SHOCKING news!!", "id": 1}', '{bad', '{"text": 5}', '',
+                               '{"text": "Officials said", "headline": "Report", "id": "b"}', '[1]']) + "\n")
+    assert articles.main(["articles.py", str(feed)]) == 0
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [line.get("id", line.get("line")) for line in lines] == [1, 2, 3, "b", 6]
+    assert [("error" in line) for line in lines] == [False, True, True, False, True]
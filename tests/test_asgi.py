@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+import app
+import asgi
+
+
+def call(application, method, path, body=b"", query_string=b"", headers=()):
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "query_string": query_string,
+             "headers": list(headers)}
+    asyncio.run(application(scope, receive, send))
+    return sent[0]["status"], b"".join(message.get("body", b"") for message in sent[1:])
+
+
+def requests_counted(endpoint, status):
+    return app.METRICS.snapshot().counters.get(("quiz_requests_total", (("endpoint", endpoint), ("status", status))), 0)
+
+
+def test_ready_once_warmed_up():
+    app.WARMUP.ensure_started()
+    assert app.WARMUP.ready.wait(60)
+    status, body = call(asgi.application, "GET", "/ready")
+    assert status == 200
+    assert json.loads(body)["Ready"] is True
+
+
+def test_requests_are_counted_like_flask():
+    before = requests_counted("get_quiz_feedback", 200), requests_counted("not_found", 404)
+    call(asgi.application, "POST", "/quiz_feedback", b"{}")
+    call(asgi.application, "GET", "/nowhere")
+    assert (requests_counted("get_quiz_feedback", 200), requests_counted("not_found", 404)) == \
+        (before[0] + 1, before[1] + 1)
+
+
+def test_single_quiz_matches_flask():
+    engine = app.BANK_REGISTRY.current().compiled.engine
+    questions = engine.question_ids[:app.N_QUESTIONS]
+    payload = {f"q{i + 1}": question for i, question in enumerate(questions)}
+    payload.update({f"a{i + 1}": 1 for i in range(len(questions))}, seed=3)
+    status, body = call(asgi.application, "POST", "/quiz_feedback", json.dumps(payload).encode())
+    assert status == 200
+    assert json.loads(body) == app.app.test_client().post("/quiz_feedback", json=payload).get_json()
+
+
+def test_other_paths_are_served_by_flask():
+    status, body = call(asgi.application, "GET", "/metrics")
+    assert status == 200
+    assert b"quiz_requests_total" in body
+
+    status, body = call(asgi.application, "GET", "/analytics", query_string=b"cohort=nobody")
+    assert status == 200
+    assert json.loads(body) == app.app.test_client().get("/analytics?cohort=nobody").get_json()
+
+    payload = {"scores": [1, 0, 0, 0, 0, 0], "top_k": 2}
+    status, body = call(asgi.application, "POST", "/recommendations", json.dumps(payload).encode(),
+                        headers=[(b"content-type", b"application/json")])
+    assert status == 200
+    assert json.loads(body) == app.app.test_client().post("/recommendations", json=payload).get_json()
+
+
+def test_flask_requests_are_counted_once():
+    before = requests_counted("get_metrics", 200), requests_counted("not_found", 405)
+    call(asgi.application, "GET", "/metrics")
+    call(asgi.application, "GET", "/quiz_feedback")
+    assert (requests_counted("get_metrics", 200), requests_counted("not_found", 405)) == (before[0] + 1, before[1] + 1)
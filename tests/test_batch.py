@@ -0,0 +1,35 @@
+import app
+
+
+def payloads(n, **kwargs):
+    engine = app.BANK_REGISTRY.current().compiled.engine
+    for i in range(n):
+        questions = engine.question_ids[i:i + app.N_QUESTIONS]
+        payload = {f"q{j + 1}": question for j, question in enumerate(questions)}
+        payload.update({f"a{j + 1}": j % 2 for j in range(len(questions))}, **kwargs)
+        yield payload
+
+
+def test_batch_matches_single_quizzes():
+    client = app.app.test_client()
+    batch = list(payloads(8, seed=11))
+    results = client.post("/quiz_feedback/batch", json=batch).get_json()
+    assert results == [client.post("/quiz_feedback", json=payload).get_json() for payload in batch]
+
+
+def test_invalid_payload_is_reported_in_place():
+    batch = list(payloads(4))
+    batch[1] = dict(batch[1], a1=99)
+    batch[3] = "not a quiz"
+    results = app.app.test_client().post("/quiz_feedback/batch", json={"submissions": batch}).get_json()
+    assert len(results) == 4
+    assert results[1]["Code"] == "answer_out_of_range"
+    assert results[3]["Code"] == "invalid_payload"
+    assert all("Feedback" in results[i] for i in (0, 2))
+
+
+def test_batch_seed_makes_the_whole_batch_repeatable():
+    client = app.app.test_client()
+    batch = list(payloads(6))
+    first = client.post("/quiz_feedback/batch?seed=5", json=batch).get_json()
+    assert client.post("/quiz_feedback/batch?seed=5", json=batch).get_json() == first
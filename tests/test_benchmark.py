@@ -0,0 +1,33 @@
+import app
+import benchmark
+
+
+def test_synthetic_submissions_are_valid_and_repeatable():
+    compiled_bank = app.BANK_REGISTRY.current().compiled
+    payloads = benchmark.synthetic_submissions(compiled_bank, 20, seed=4)
+    assert payloads == benchmark.synthetic_submissions(compiled_bank, 20, seed=4)
+    assert payloads != benchmark.synthetic_submissions(compiled_bank, 20, seed=5)
+    for payload in payloads:
+        questions, _, _ = compiled_bank.validator.validate(payload)
+        assert len(questions) == app.N_QUESTIONS
+
+
+def test_batch_throughput_is_measured_per_batch_size():
+    compiled_bank = app.BANK_REGISTRY.current().compiled
+    payloads = benchmark.synthetic_submissions(compiled_bank, 8)
+    results = benchmark.bench_batch(app.app.test_client(), payloads, (1, 4), 8)
+    assert set(results) == {"1", "4"}
+    assert all(result["quizzes_per_second"] > 0 for result in results.values())
+
+
+def test_only_changes_past_the_threshold_are_regressions():
+    baseline = {"benchmarks": {"request": {"p50_us": 100.0}, "batch": {"16": {"quizzes_per_second": 1000.0}}}}
+    slower = {"benchmarks": {"request": {"p50_us": 120.0}, "batch": {"16": {"quizzes_per_second": 850.0}},
+                             "new": {"p50_us": 1.0}}}
+    assert benchmark.compare_results(slower, baseline, 0.25) == []
+
+    slower["benchmarks"]["request"]["p50_us"] = 130.0
+    slower["benchmarks"]["batch"]["16"]["quizzes_per_second"] = 790.0
+    regressions = benchmark.compare_results(slower, baseline, 0.25)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("request:") and regressions[1].startswith("batch[16]:")
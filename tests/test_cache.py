@@ -0,0 +1,37 @@
+import app
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = app.ResponseCache(2)
+    cache.put("bank", "a", 1)
+    cache.put("bank", "b", 2)
+    assert cache.get("bank", "a") == 1
+    cache.put("bank", "c", 3)
+    assert cache.get("bank", "b") is None
+    assert (cache.get("bank", "a"), cache.get("bank", "c")) == (1, 3)
+    assert cache.info()["evictions"] == 1
+
+
+def test_new_bank_fingerprint_drops_every_entry():
+    cache = app.ResponseCache(4)
+    cache.put("old", "a", 1)
+    assert cache.get("new", "a") is None
+    assert cache.info()["invalidations"] == 1
+    assert cache.get("old", "a") is None
+
+
+def test_question_order_shares_a_cache_entry():
+    engine = app.BANK_REGISTRY.current().compiled.engine
+    questions = list(engine.question_ids[:app.N_QUESTIONS])
+
+    def payload(order):
+        quiz = {f"q{i + 1}": questions[j] for i, j in enumerate(order)}
+        quiz.update({f"a{i + 1}": j % 2 for i, j in enumerate(order)}, seed=21)
+        return quiz
+
+    client = app.app.test_client()
+    app.FEEDBACK_CACHE.clear()
+    first = client.post("/quiz_feedback", json=payload(range(len(questions)))).get_json()
+    hits = app.FEEDBACK_CACHE.info()["hits"]
+    assert client.post("/quiz_feedback", json=payload(range(len(questions))[::-1])).get_json() == first
+    assert app.FEEDBACK_CACHE.info()["hits"] == hits + 1
@@ -0,0 +1,38 @@
+import app
+import keywords
+
+TEXTS = ["Fake news spreads quickly on social media.  Social media companies struggle to stop fake news.",
+         "The council approved the new library budget on Tuesday, after a long public debate about the library."]
+
+
+def test_batch_matches_each_text_alone():
+    extractor = keywords.KeywordExtractor()
+    batch = extractor.extract(TEXTS, [3, 2], 5)
+    assert batch == [extractor.extract([text], [n], 5)[0] for text, n in zip(TEXTS, [3, 2])]
+
+
+def test_keywords_are_ranked_and_limited():
+    result = keywords.KeywordExtractor().extract(TEXTS[:1], [2], 4)[0]
+    assert len(result) == 4
+    assert [score for _, score in result] == sorted((score for _, score in result), reverse=True)
+    assert all(len(keyword.split()) <= 2 for keyword, _ in result)
+    assert not any(word in keywords.STOP_WORDS for keyword, _ in result for word in keyword.split())
+    assert result[0][0] in ("fake news", "social media")
+
+
+def test_batcher_returns_each_callers_result():
+    batcher = keywords.MicroBatcher(lambda items: [item * 2 for item in items], max_batch=4, max_wait=0.01)
+    futures = [batcher.submit(i) for i in range(10)]
+    assert [future.result(5) for future in futures] == list(range(0, 20, 2))
+
+
+def test_endpoint_caches_results_and_reports_errors():
+    client = app.app.test_client()
+    first = client.post("/get_keywords", json={"text": TEXTS[1], "top_n": 3}).get_json()
+    hits = app.KEYWORD_CACHE.info()["hits"]
+    assert client.post("/get_keywords", json={"text": TEXTS[1], "top_n": 3}).get_json() == first
+    assert app.KEYWORD_CACHE.info()["hits"] == hits + 1
+    assert len(first) == 3
+
+    assert client.post("/get_keywords", json={"text": 1}).get_json()["Code"] == "missing_field"
+    assert client.post("/get_keywords", json={"text": "x", "top_n": 0}).get_json()["Code"] == "invalid_top_n"
@@ -0,0 +1,40 @@
+import asyncio
+import io
+
+import app
+import loadtest
+from benchmark import synthetic_submissions
+
+
+def step(concurrency, throughput, error_rate=0.0):
+    return {"concurrency": concurrency, "throughput_rps": throughput, "error_rate": error_rate}
+
+
+def test_malformed_submissions_get_their_error_code():
+    compiled_bank = app.BANK_REGISTRY.current().compiled
+    payloads = synthetic_submissions(compiled_bank, 20)
+    client = app.app.test_client()
+    for body, code in loadtest.malformed_submissions(compiled_bank, payloads, 100):
+        response = client.post("/quiz_feedback", data=body, content_type="application/json")
+        assert loadtest.outcome(response.status_code, response.data, code) == "rejected", (body, response.data)
+
+
+def test_saturation_is_the_fewest_clients_near_the_best_throughput():
+    steps = [step(1, 100), step(2, 190), step(4, 260), step(8, 270), step(16, 300, error_rate=0.5)]
+    assert loadtest.saturation_point(steps)["concurrency"] == 4
+    assert loadtest.saturation_point([step(1, 100, error_rate=0.5)]) is None
+
+
+def test_run_stops_on_a_plateau_or_errors():
+    assert not loadtest.is_saturated([step(1, 100), step(2, 190)])
+    assert not loadtest.is_saturated([step(1, 100), step(2, 190), step(4, 260)])
+    assert loadtest.is_saturated([step(1, 100), step(2, 190), step(4, 200), step(8, 205)])
+    assert loadtest.is_saturated([step(1, 100), step(2, 190, error_rate=0.2)])
+
+
+def test_short_run_against_the_dev_server():
+    results = asyncio.run(loadtest.run_load_test("dev", concurrency=[1, 2], step_seconds=0.5, warmup_seconds=0.1,
+                                                 progress=io.StringIO()))
+    assert [s["concurrency"] for s in results["steps"]] == [1, 2]
+    assert all(s["requests"] > 0 and s["error_rate"] == 0 for s in results["steps"])
+    assert results["saturation"]["concurrency"] in (1, 2)
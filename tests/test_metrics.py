@@ -0,0 +1,48 @@
+import threading
+
+import app
+import metrics
+
+
+def test_counters_from_every_thread_are_merged():
+    registry = metrics.Metrics()
+    threads = [threading.Thread(target=registry.inc, args=("hits", (("path", "/"),), 2)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+        thread.join()
+    registry.inc("hits", (("path", "/"),))
+    assert registry.snapshot().counters == {("hits", (("path", "/"),)): 9}
+
+
+def test_histograms_render_cumulative_buckets():
+    registry = metrics.Metrics(buckets=(0.1, 1.0))
+    registry.describe("latency", "histogram", "Request latency.")
+    for seconds in (0.05, 0.5, 5.0):
+        registry.observe("latency", (), seconds)
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP latency Request latency.", "# TYPE latency histogram"]
+    assert lines[2:] == ['latency_bucket{le="0.1"} 1', 'latency_bucket{le="1.0"} 2', 'latency_bucket{le="+Inf"} 3',
+                         "latency_sum 5.55", "latency_count 3"]
+
+
+def test_requests_record_their_stages():
+    engine = app.BANK_REGISTRY.current().compiled.engine
+    payload = {f"q{i + 1}": question for i, question in enumerate(engine.question_ids[:app.N_QUESTIONS])}
+    payload.update({f"a{i + 1}": 0 for i in range(app.N_QUESTIONS)})
+    app.app.test_client().post("/quiz_feedback", json=payload)
+    body = app.app.test_client().get("/metrics").get_data(as_text=True)
+    for stage in ("validate", "score", "construct"):
+        assert f'{app.STAGE_METRIC}_count{{stage="{stage}"}}' in body
+
+
+def test_ready_only_after_warm_up(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(app, "WARMUP", app.Warmup(lambda: release.wait(10)))
+    client = app.app.test_client()
+    response = client.get("/ready")
+    assert response.status_code == 503 and response.get_json()["Ready"] is False
+
+    release.set()
+    assert app.WARMUP.ready.wait(10)
+    response = client.get("/ready")
+    assert response.status_code == 200 and response.get_json()["Ready"] is True
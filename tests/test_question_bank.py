@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+import app
+
+
+def test_compile_is_reused_until_the_bank_changes():
+    bank = app.create_question_bank()
+    compiled = bank.compile()
+    assert bank.compile() is compiled
+
+    question = app.Question("New question", question_type="MCS", question_id="NEW1")
+    question.add_answer("Yes", True, [1, 1, 1, 1, 1, 1])
+    bank.add_question(question)
+    assert bank.compile() is not compiled
+
+
+def test_compile_sees_answers_added_after_compiling():
+    bank = app.create_question_bank()
+    n_answers = bank.compile().engine.n_answers["MC1"]
+    bank.id_to_question("MC1").add_answer("A new answer", False, [1, 2, 3, 4, 5, 6])
+
+    quiz = app.Quiz(bank)
+    quiz.add_question("MC1")
+    quiz.add_answer("MC1", n_answers)
+    assert quiz.score_quiz().tolist() == [1, 2, 3, 4, 5, 6]
+
+
+def test_unpickled_bank_keeps_its_compiled_form():
+    import pickle
+
+    bank = app.create_question_bank()
+    bank.compile()
+    restored = pickle.loads(pickle.dumps(bank))
+    assert restored.compile() is restored._compiled
+    assert np.array_equal(restored.compile().engine.matrix, bank.compile().engine.matrix)
+
+
+def test_out_of_range_answer_raises_index_error():
+    quiz = app.Quiz(app.create_question_bank())
+    quiz.add_question("MC1")
+    quiz.add_answer("MC1", 10)
+    with pytest.raises(IndexError):
+        quiz.score_quiz()
+
+
+@pytest.mark.parametrize("learning_outcome, message", [
+    ([1, 2, 3, 4, 5, 6.7], "integers"),
+    ([True, 0, 0, 0, 0, 0], "integers"),
+    ({"a": 1, "b": 2, "c": 3, "d": 4, "e": 5, "f": 6}, "lists of 6"),
+    ([1, 2, 3, 4, 5], "lists of 6"),
+    ([2 ** 70, 0, 0, 0, 0, 0], "between"),
+])
+def test_loader_rejects_bad_learning_outcomes(learning_outcome, message):
+    data = [{"question_id": "Q1", "question": "?", "question_type": "MCS",
+             "answers": [{"answer": "a", "correct": True, "learning_outcome": [0] * 6},
+                         {"answer": "b", "correct": False, "learning_outcome": learning_outcome}]}]
+    with pytest.raises(app.QuestionBankError, match=message):
+        app._question_bank_to_arrays(data)
+
+
+def test_question_keeps_its_answers_as_ids_with_the_old_views():
+    question = app.Question("Columnar", question_type="MCS", question_id="COL1")
+    question.add_answer("No", False, [-1, 0, 1, 2, 3, 4])
+    question.add_answer("Yes", True, [4, 3, 2, 1, 0, -1])
+    assert not hasattr(question, "__dict__")
+    assert question.answers == ["No", "Yes"]
+    assert question.learning_outcomes == {"No": [-1, 0, 1, 2, 3, 4], "Yes": [4, 3, 2, 1, 0, -1]}
+    assert question.outcome_array().tolist() == [[-1, 0, 1, 2, 3, 4], [4, 3, 2, 1, 0, -1]]
+    assert question.get_learning_outcome_score("Yes") == question.get_learning_outcome_score(1)
+    with pytest.raises(KeyError):
+        question.get_learning_outcome_score("Maybe")
+
+
+def test_answers_given_as_text_are_stored_as_their_index():
+    quiz = app.Quiz(app.create_question_bank())
+    quiz.add_question("MC1")
+    text = quiz.question_bank.id_to_question("MC1").answers[1]
+    quiz.add_answer("MC1", text)
+    assert quiz.quiz_answers == [1]
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+import app
+import recommend
+
+
+def make_recommender(**kwargs):
+    return recommend.PageRecommender(app.SITE_PAGES, app.RECOMMENDED_READING, **kwargs)
+
+
+def random_learners(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(-20, 20, (n, len(app.learning_outcomes))), \
+        [app.SITE_PAGES[i] for i in rng.integers(len(app.SITE_PAGES), size=n)]
+
+
+def test_search_is_exact_across_index_and_tail():
+    recommender = make_recommender(k=8)
+    scores, pages = random_learners(6000)
+    recommender.record(scores[:5000], pages[:5000]).join()
+    assert recommender.record(scores[5000:], pages[5000:]) is None
+    assert recommender.info() == {"pool": 6000, "indexed": 5000, "cells": recommend.n_cells_for(5000)}
+
+    needs = recommend.need_vectors(scores)
+    for query in recommend.need_vectors(random_learners(20, seed=1)[0]):
+        sims, _ = recommender.neighbours(query)
+        assert np.allclose(np.sort(sims), np.sort(needs @ query)[-8:], atol=1e-5)
+
+
+# The failure is raised in the rebuild thread on purpose
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_failed_rebuild_can_be_retried(monkeypatch):
+    recommender = make_recommender()
+    scores, pages = random_learners(recommend.MIN_REBUILD)
+
+    def fail(*args):
+        raise MemoryError
+
+    monkeypatch.setattr(recommend.CellIndex, "extend", fail)
+    recommender.record(scores, pages).join()
+    assert not recommender._rebuilding
+    assert recommender.info()["indexed"] == 0
+    monkeypatch.undo()
+    recommender.record(scores[:1], pages[:1]).join()
+    assert recommender.info()["indexed"] == recommend.MIN_REBUILD + 1
+
+
+def quiz_payload(**kwargs):
+    payload = {f"q{i + 1}": question for i, question in enumerate(app.BANK_REGISTRY.current().compiled.engine
+                                                                   .question_ids[:app.N_QUESTIONS])}
+    payload.update({f"a{i + 1}": 0 for i in range(app.N_QUESTIONS)}, **kwargs)
+    return payload
+
+
+def test_feedback_suggests_the_first_recommendation_without_recording_it():
+    before = app.RECOMMENDER.info()["pool"]
+    client = app.app.test_client()
+    results = client.post("/quiz_feedback/batch", json=[quiz_payload()] * 3).get_json()
+    assert app.RECOMMENDER.info()["pool"] == before
+    first = client.post("/recommendations", json=quiz_payload()).get_json()["Pages"][0]["Page"]
+    assert {result["Suggested Page"] for result in results} == {first}
+
+
+def test_engagement_changes_the_suggested_page(monkeypatch):
+    monkeypatch.setattr(app, "RECOMMENDER", make_recommender())
+    client = app.app.test_client()
+    # Seeded, so the second response could come from the feedback cache
+    payload = quiz_payload(seed=3)
+    suggested = client.post("/quiz_feedback", json=payload).get_json()["Suggested Page"]
+    engaged = next(page for page in app.SITE_PAGES if page != suggested)
+
+    response = client.post("/engagement", json={**payload, "page": "Not a page"}).get_json()
+    assert response["Code"] == "invalid_payload"
+    for _ in range(200):
+        assert client.post("/engagement", json={**payload, "page": engaged}).get_json() == \
+            {"Recorded": True, "Page": engaged}
+
+    result = client.post("/quiz_feedback", json=payload).get_json()
+    assert result["Suggested Page"] == engaged
+    assert result["Feedback"].endswith(tuple(text for page, text in app.READINGS if page == engaged))
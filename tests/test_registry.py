@@ -0,0 +1,52 @@
+import os
+
+import app
+
+
+def make_registry(path, cache):
+    bank = app.create_question_bank()
+    app.dump_question_bank(bank, path)
+    return app.BankRegistry(app.BankVersion(1, bank, bank.compile(), None), source=str(path), caches=(cache,))
+
+
+def rewrite(path, bank):
+    stat = os.stat(path)
+    app.dump_question_bank(bank, path)
+    # Some filesystems only keep whole seconds
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2_000_000_000))
+
+
+def test_changed_source_is_swapped_in(tmp_path):
+    path = tmp_path / "bank.json"
+    cache = app.ResponseCache(4)
+    registry = make_registry(path, cache)
+    old = registry.current()
+    cache.put(old.compiled.fingerprint, "key", "value")
+    assert registry.reload_if_changed() is old
+
+    bank = app.create_question_bank()
+    question = app.Question("New question", question_type="MCS", question_id="NEW1")
+    question.add_answer("Yes", True, [1, 1, 1, 1, 1, 1])
+    bank.add_question(question)
+    rewrite(path, bank)
+
+    new = registry.reload_if_changed()
+    assert new.version == 2 and registry.current() is new
+    assert "NEW1" in new.compiled.engine.question_ids
+    assert "NEW1" not in old.compiled.engine.question_ids
+    assert cache.info()["size"] == 0
+
+
+def test_invalid_source_keeps_the_current_version(tmp_path):
+    path = tmp_path / "bank.json"
+    registry = make_registry(path, app.ResponseCache(4))
+    old = registry.current()
+    path.write_text("{not json")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 2_000_000_000))
+    assert registry.reload_if_changed() is old
+
+
+def test_unchanged_bank_is_not_republished(tmp_path):
+    registry = make_registry(tmp_path / "bank.json", app.ResponseCache(4))
+    old = registry.current()
+    assert registry.publish(app.create_question_bank()) is old
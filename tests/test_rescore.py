@@ -0,0 +1,59 @@
+import io
+import json
+
+import pytest
+
+import app
+import rescore
+
+
+def write_submissions(path, n):
+    engine = app.BANK_REGISTRY.current().compiled.engine
+    lines = []
+    for i in range(n):
+        questions = engine.question_ids[i % 3:i % 3 + app.N_QUESTIONS]
+        payload = {f"q{j + 1}": question for j, question in enumerate(questions)}
+        payload.update({f"a{j + 1}": (i + j) % 2 for j in range(len(questions))}, id=i)
+        lines.append(json.dumps(payload))
+    lines[4] = "{not json"
+    path.write_text("\n".join(lines) + "\n")
+
+
+def run(tmp_path, processes, **kwargs):
+    output = tmp_path / f"feedback{processes}.jsonl"
+    n = rescore.rescore(str(tmp_path / "submissions.jsonl"), str(output), app.BANK_REGISTRY.current().compiled,
+                        processes=processes, chunk_size=3, progress=io.StringIO(), **kwargs)
+    return n, [json.loads(line) for line in output.read_text().splitlines()]
+
+
+def test_output_does_not_depend_on_the_number_of_processes(tmp_path):
+    write_submissions(tmp_path / "submissions.jsonl", 10)
+    n, results = run(tmp_path, 1)
+    assert n == 10 and run(tmp_path, 2) == (n, results)
+    assert results[4]["Code"] == "invalid_json"
+    assert [result.get("id") for result in results] == [0, 1, 2, 3, None, 5, 6, 7, 8, 9]
+    assert all("Feedback" in result for i, result in enumerate(results) if i != 4)
+    assert not (tmp_path / "feedback1.jsonl.progress").exists()
+
+
+def test_checkpoint_from_another_run_is_refused(tmp_path):
+    write_submissions(tmp_path / "submissions.jsonl", 5)
+    (tmp_path / "feedback1.jsonl.progress").write_text(json.dumps({"seed": 1}))
+    with pytest.raises(rescore.RescoreError):
+        run(tmp_path, 1)
+
+
+def test_resumed_run_matches_an_uninterrupted_one(tmp_path):
+    input_path = tmp_path / "submissions.jsonl"
+    write_submissions(input_path, 10)
+    _, expected = run(tmp_path, 1)
+
+    # As if the run had stopped after its first chunk.  Its lines are replaced, to show they aren't written again
+    first_chunk = b"".join(json.dumps({"kept": i}).encode() + b"\n" for i in range(3))
+    (tmp_path / "feedback1.jsonl").write_bytes(first_chunk)
+    input_offset = len(b"".join(input_path.read_bytes().splitlines(keepends=True)[:3]))
+    checkpoint = {"input": str(input_path), "fingerprint": app.BANK_REGISTRY.current().compiled.fingerprint,
+                  "seed": 0, "chunk_size": 3, "chunks": 1, "lines": 3, "input_offset": input_offset,
+                  "output_offset": len(first_chunk)}
+    (tmp_path / "feedback1.jsonl.progress").write_text(json.dumps(checkpoint))
+    assert run(tmp_path, 1) == (10, [{"kept": i} for i in range(3)] + expected[3:])
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+
+import app
+from results import SHARD_PREFIX, ResultStore
+
+
+def record(store, n, cohort="A"):
+    scores = np.arange(n * 6).reshape(n, 6) % 7 - 3
+    store.record([cohort] * n, [["Q1", "Q2"]] * n, [[0, 1]] * n, scores)
+    return scores
+
+
+def test_no_directory_unless_asked(tmp_path):
+    directory = tmp_path / "results"
+    store = ResultStore(str(directory), shard_size=4)
+    assert not directory.exists()
+    record(store, 2)
+    store.flush()
+    assert len(os.listdir(directory)) == 1
+
+
+def test_shards_are_folded_in_by_other_stores(tmp_path):
+    writer = ResultStore(str(tmp_path), shard_size=4)
+    scores = np.concatenate([record(writer, 3), record(writer, 3, "B")])
+    writer.flush()
+    assert all(name.startswith(SHARD_PREFIX) for name in os.listdir(tmp_path))
+
+    reader = ResultStore(str(tmp_path))
+    total = reader.aggregate()
+    assert total.count == 6
+    assert np.array_equal(total.score_sum, scores.sum(axis=0))
+    assert reader.aggregate("B").count == 3
+    # The writer doesn't count its own shards twice
+    assert writer.aggregate().count == 6
+
+
+def test_analytics_answers_cover_every_answer_of_a_question():
+    engine = app.BANK_REGISTRY.current().compiled.engine
+    question = engine.question_ids[0]
+    store = ResultStore()
+    store.record(["A"], [[question]], [[0]], np.zeros((1, 6)))
+    assert app.analytics_result(None, store)["Answers"] == {str(question): [1] + [0] * (engine.n_answers[question] - 1)}
+
+
+def test_total_is_kept_up_to_date_across_cohorts():
+    store = ResultStore()
+    scores = np.concatenate([record(store, 3), record(store, 2, "B")])
+    total = store.aggregate()
+    assert total.count == 5
+    assert np.array_equal(total.score_sum, scores.sum(axis=0))
+    assert total.count == store.aggregate("A").count + store.aggregate("B").count
+
+
+def test_new_cohorts_are_refused_past_the_limit():
+    store = ResultStore(max_cohorts=2)
+    record(store, 1, "A")
+    record(store, 1, "B")
+    assert store.accepts_cohort("A")
+    assert not store.accepts_cohort("C")
+    with pytest.raises(app.SubmissionError, match="No more than 2"):
+        app.read_cohort({"cohort": "C"}, store)
+    with pytest.raises(app.SubmissionError):
+        app.read_cohort({"cohort": "bad\ncohort"})
+    assert app.read_cohort({"cohort": "Year 9/B-2"}) == "Year 9/B-2"
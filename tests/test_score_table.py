@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+
+import pytest
+
+import app
+import score_table
+
+
+def test_count_matches_the_built_table():
+    engine = app.BANK_REGISTRY.current().compiled.engine
+    offsets, scores, ranks = score_table.build_score_table(engine, app.N_QUESTIONS)
+    radices = [engine.n_answers[q] for q in engine.question_ids]
+    assert score_table.count_quizzes(radices, app.N_QUESTIONS) == len(scores) == offsets[-1]
+
+
+def test_too_many_quizzes_is_refused_before_enumerating():
+    # Enumerating the C(200, 8) subsets of this bank would never finish
+    question_ids = list(range(200))
+    engine = SimpleNamespace(question_ids=question_ids, offsets={q: 4 * q for q in question_ids},
+                             n_answers={q: 4 for q in question_ids})
+    with pytest.raises(score_table.ScoreTableError, match="too many"):
+        score_table.build_score_table(engine, 8)
+
+
+def test_truncated_table_falls_back_to_live_scoring(tmp_path):
+    compiled = app.BANK_REGISTRY.current().compiled
+    path = str(tmp_path / "quiz_scores.bin")
+    score_table.write_score_table(path, compiled.engine, compiled.fingerprint, app.N_QUESTIONS)
+    assert app.load_score_table(path, compiled) is not None
+    assert list(tmp_path.iterdir()) == [tmp_path / "quiz_scores.bin"]
+    with open(path, "r+b") as f:
+        f.truncate(score_table.HEADER_SIZE + 100)
+    with pytest.raises(score_table.ScoreTableError, match="Please rebuild"):
+        score_table.ScoreTable(path, compiled.engine, compiled.fingerprint)
+    assert app.load_score_table(path, compiled) is None
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+import app
+
+
+def baseline_score(bank, questions, answers):
+    # Quiz.score_quiz as it was before the engine: each answer's learning outcomes, summed
+    score = np.zeros(len(app.learning_outcomes), dtype=np.int64)
+    for question_id, answer in zip(questions, answers):
+        question = bank.id_to_question(question_id)
+        score += question.learning_outcomes[question.answers[answer]]
+    return score
+
+
+def random_quizzes(compiled_bank, n, seed=0):
+    rng = np.random.default_rng(seed)
+    engine = compiled_bank.engine
+    for _ in range(n):
+        picked = rng.choice(len(engine.question_ids), app.N_QUESTIONS, replace=False)
+        questions = [engine.question_ids[i] for i in picked]
+        yield questions, [int(rng.integers(engine.n_answers[q])) for q in questions]
+
+
+def test_engine_matches_baseline_scoring():
+    bank = app.create_question_bank()
+    compiled_bank = bank.compile()
+    engine = compiled_bank.engine
+    quizzes = list(random_quizzes(compiled_bank, 200))
+
+    expected = np.asarray([baseline_score(bank, q, a) for q, a in quizzes])
+    single = np.asarray([engine.score(engine.rows(q, a)) for q, a in quizzes])
+    rows = np.asarray([engine.rows(q, a) for q, a in quizzes])
+    assert np.array_equal(single, expected)
+    assert np.array_equal(engine.score_batch(rows), expected)
+    assert np.array_equal(engine.score_batch(rows.ravel(), [app.N_QUESTIONS] * len(quizzes)), expected)
+
+
+def test_score_quiz_matches_baseline_scoring():
+    bank = app.create_question_bank()
+    for questions, answers in random_quizzes(bank.compile(), 50, seed=1):
+        quiz = app.Quiz(bank)
+        quiz.add_questions(questions)
+        for question, answer in zip(questions, answers):
+            quiz.add_answer(question, answer)
+        assert quiz.score_quiz().tolist() == baseline_score(bank, questions, answers).tolist()
+
+
+def test_score_quiz_accepts_questions_outside_the_bank():
+    bank = app.create_question_bank()
+    outside = app.Question("Not in the bank", question_type="MCS", question_id="OUT1")
+    outside.add_answer("No", False, [-1, -1, -1, -1, -1, -1])
+    outside.add_answer("Yes", True, [2, 2, 2, 2, 2, 2])
+
+    quiz = app.Quiz(bank)
+    quiz.add_question("MC1")
+    quiz.add_question(outside)
+    quiz.add_answer("MC1", 1)
+    quiz.add_answer(outside, 1)
+    expected = np.asarray(bank.id_to_question("MC1").get_learning_outcome_score(1)) + 2
+    assert quiz.score_quiz().tolist() == expected.tolist()
+
+    quiz.add_answer(outside, 5)
+    with pytest.raises(IndexError):
+        quiz.score_quiz()
+
+
+def test_score_quiz_requires_every_answer():
+    quiz = app.Quiz(app.create_question_bank())
+    quiz.add_questions(["MC1", "MC2"])
+    quiz.add_answer("MC1", 0)
+    with pytest.raises(AssertionError):
+        quiz.score_quiz()
+
+
+def test_feedback_is_only_repeatable_with_a_seed():
+    score = np.arange(len(app.learning_outcomes))
+    assert app.Feedback(score, seed=7).draws == app.Feedback(score, seed=7).draws
+    assert len({tuple(app.Feedback(score).draws) for _ in range(5)}) == 5
+
+
+def test_seeded_feedback_is_repeatable():
+    score = np.asarray([3, -1, 4, 1, -5, 9])
+    feedback = app.Feedback(score, seed=7).construct()
+    assert app.Feedback(score, seed=7).construct() == feedback
+    assert len({app.Feedback(score, seed=seed).construct() for seed in range(20)}) > 1
+
+
+def test_submission_seed_ignores_question_order():
+    engine = app.BANK_REGISTRY.current().compiled.engine
+    questions = list(engine.question_ids[:app.N_QUESTIONS])
+    answers = [i % 2 for i in range(len(questions))]
+    payload = {f"q{i + 1}": q for i, q in enumerate(questions)}
+    payload.update({f"a{i + 1}": a for i, a in enumerate(answers)}, seed="submission")
+    reordered = {f"q{i + 1}": q for i, q in enumerate(questions[::-1])}
+    reordered.update({f"a{i + 1}": a for i, a in enumerate(answers[::-1])}, seed="submission")
+
+    client = app.app.test_client()
+    assert client.post("/quiz_feedback", json=payload).get_json() == \
+        client.post("/quiz_feedback", json=reordered).get_json()
+    assert client.post("/quiz_feedback", json=dict(payload, seed="x")).get_json()["Code"] == "invalid_seed"
@@ -0,0 +1,41 @@
+import pytest
+
+import app
+
+
+def quiz(questions, **kwargs):
+    payload = {f"q{i + 1}": question for i, question in enumerate(questions)}
+    payload.update({f"a{i + 1}": 0 for i in range(len(questions))}, **kwargs)
+    return payload
+
+
+@pytest.mark.parametrize("n_questions", [1, 3, app.N_QUESTIONS + 2])
+def test_quizzes_of_any_length_are_scored(n_questions):
+    engine = app.BANK_REGISTRY.current().compiled.engine
+    questions = list(engine.question_ids[:n_questions])
+    result = app.app.test_client().post("/quiz_feedback", json=quiz(questions)).get_json()
+    assert "Feedback" in result
+
+
+def test_next_questions_target_the_weakest_outcome():
+    compiled_bank = app.BANK_REGISTRY.current().compiled
+    answered = list(compiled_bank.engine.question_ids[:3])
+    result = app.app.test_client().post("/quiz_questions", json=quiz(answered, n_questions=4)).get_json()
+
+    scores = compiled_bank.engine.score(compiled_bank.engine.rows(answered, [0] * len(answered)))
+    outcome = app.weakest_outcome(scores)
+    assert result["Learning Outcome"] == app.LEARNING_OUTCOMES[outcome]
+    assert len(result["Questions"]) == 4
+    assert not set(result["Questions"]) & set(answered)
+
+    # The most discriminative questions for that outcome that weren't answered, in order
+    selector = compiled_bank.selector
+    power = {question: selector.power[i, outcome] for i, question in enumerate(selector.question_ids)}
+    chosen = [power[question] for question in result["Questions"]]
+    assert chosen == sorted(chosen, reverse=True)
+    assert min(chosen) >= max(power[q] for q in power if q not in answered and q not in result["Questions"])
+
+
+def test_invalid_question_count_is_refused():
+    result = app.app.test_client().post("/quiz_questions", json={"n_questions": 0}).get_json()
+    assert result["Code"] == "invalid_n_questions"
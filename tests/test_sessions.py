@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+import app
+from sessions import (SESSION_HEADERS, LocalSessionStore, Session, SessionError, SessionStore, SQLiteSessionStore,
+                      create_session_store)
+
+FINGERPRINT = "00112233445566778899aabbccddeeff"
+
+
+def test_session_round_trip_past_a_u16_of_answers():
+    session = Session(FINGERPRINT, 6, np.arange(6, dtype=np.int32), list(range(70_000)), 123.5)
+    decoded = Session.decode(session.encode())
+    assert decoded.fingerprint == FINGERPRINT
+    assert decoded.scores.tolist() == list(range(6))
+    assert decoded.rows == session.rows
+    assert decoded.updated == 123.5
+
+
+def test_format_1_sessions_still_decode():
+    data = SESSION_HEADERS[1].pack(1, bytes.fromhex(FINGERPRINT), 1.0, 6, 2) + \
+        np.arange(6, dtype="<i4").tobytes() + np.asarray([3, 9], dtype="<u4").tobytes()
+    assert Session.decode(data).rows == [3, 9]
+    with pytest.raises(SessionError):
+        Session.decode(b"\x09" + data[1:])
+
+
+def test_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore(60)
+
+
+@pytest.mark.parametrize("make_store", [lambda path: LocalSessionStore(60),
+                                        lambda path: SQLiteSessionStore(str(path / "sessions.db"), 60)])
+def test_store_operations(tmp_path, make_store):
+    store = make_store(tmp_path)
+    store.put("s", b"one")
+    assert store.get("s") == b"one"
+    assert store.update("s", lambda data: data + b"!") == b"one!"
+    assert store.update("missing", lambda data: data) is None
+    assert store.delete("s")
+    assert store.get("s") is None
+    assert not store.delete("s")
+
+
+def test_sqlite_sessions_are_shared_and_persisted(tmp_path):
+    url = f"sqlite:///{tmp_path / 'sessions.db'}"
+    create_session_store(url, 60).put("s", Session(FINGERPRINT, 6).encode())
+    assert Session.decode(create_session_store(url, 60).get("s")).fingerprint == FINGERPRINT
+
+
+def test_expired_sessions_are_forgotten(tmp_path):
+    for store in (LocalSessionStore(-1), SQLiteSessionStore(str(tmp_path / "sessions.db"), -1)):
+        store.put("s", b"data")
+        assert store.get("s") is None
+
+
+def test_session_from_another_bank_is_stale():
+    client = app.app.test_client()
+    app.SESSION_STORE.put("stale", Session(FINGERPRINT, len(app.learning_outcomes)).encode())
+    assert client.get("/sessions/stale").get_json()["Code"] == "stale_session"
+    assert client.post("/sessions/stale/answers", json={"q1": "MC1", "a1": 0}).get_json()["Code"] == "stale_session"
+
+    session_id = client.post("/sessions").get_json()["Session"]
+    assert client.post(f"/sessions/{session_id}/answers", json={"q1": "MC1", "a1": 0}).get_json()["Answered"] == 1
+    assert client.get(f"/sessions/{session_id}").get_json()["Answered"] == 1
+
+
+@pytest.mark.parametrize("data", [b"\x02", b"\x02" + bytes(40), b"\x01" + bytes(30)])
+def test_corrupted_sessions_are_session_errors(data):
+    with pytest.raises(SessionError):
+        Session.decode(data)
+    encoded = Session(FINGERPRINT, 6, rows=[1, 2]).encode()
+    with pytest.raises(SessionError):
+        Session.decode(encoded[:-1])
+
+
+def test_corrupted_stored_session_is_stale():
+    client = app.app.test_client()
+    app.SESSION_STORE.put("corrupted", Session(FINGERPRINT, len(app.learning_outcomes)).encode()[:-3])
+    assert client.get("/sessions/corrupted").get_json()["Code"] == "stale_session"
+
+
+def test_added_answers_are_encoded_incrementally():
+    session = Session(FINGERPRINT, 6)
+    for row in (4, 9, 2):
+        assert not session.has_answer(row, row + 1)
+        session.add_answer(row, np.ones(6, dtype=np.int32))
+    assert session.has_answer(8, 10)
+    decoded = Session.decode(session.encode())
+    assert decoded.rows == [4, 9, 2]
+    assert decoded.scores.tolist() == [3] * 6
+
+
+def test_local_store_drops_the_least_recently_used_sessions():
+    store = LocalSessionStore(60, max_sessions=2)
+    for session_id in ("a", "b", "c"):
+        store.put(session_id, b"data")
+    assert len(store) == 2
+    assert store.get("a") is None and store.get("c") == b"data"
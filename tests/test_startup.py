@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+
+import app
+
+APP_DIRECTORY = os.path.dirname(os.path.abspath(app.__file__))
+
+
+def run(script, **env):
+    environ = dict(os.environ, **env)
+    environ.pop("QUIZ_SNAPSHOT", None)
+    output = subprocess.run([sys.executable, "-c", script], cwd=APP_DIRECTORY, env=environ, capture_output=True,
+                            text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def test_import_defers_numpy_and_the_service_modules(tmp_path):
+    loaded = run("import json, sys, app; print(json.dumps(sorted(set(sys.modules) & {'numpy', 'keywords', 'metrics', "
+                 "'recommend', 'results', 'score_table', 'sessions', 'wire'})))", XDG_CACHE_HOME=str(tmp_path))
+    assert loaded == []
+    assert not os.listdir(tmp_path)
+
+
+def test_snapshot_is_written_to_the_cache_directory(tmp_path):
+    version = run("import json, app; print(json.dumps(app.BANK_REGISTRY.current().version))",
+                  XDG_CACHE_HOME=str(tmp_path))
+    assert version == 1
+    assert os.listdir(tmp_path / "quiz-feedback") == ["quiz_snapshot.pickle"]
@@ -0,0 +1,62 @@
+import io
+import json
+
+import pytest
+
+import app
+
+
+def payloads(n):
+    compiled_bank = app.BANK_REGISTRY.current().compiled
+    engine = compiled_bank.engine
+    for i in range(n):
+        questions = engine.question_ids[i:i + app.N_QUESTIONS]
+        payload = {f"q{j + 1}": question for j, question in enumerate(questions)}
+        payload.update({f"a{j + 1}": 0 for j in range(len(questions))})
+        payload["seed"] = i
+        yield payload
+
+
+def stream(body, content_type="application/json"):
+    client = app.app.test_client()
+    response = client.post("/quiz_feedback/batch?stream=1", data=body, content_type=content_type)
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_stream_matches_batch():
+    body = json.dumps(list(payloads(20)))
+    batch = app.app.test_client().post("/quiz_feedback/batch", data=body, content_type="application/json").get_json()
+    assert stream(body) == batch
+
+
+def test_truncated_body_scores_every_whole_item():
+    body = json.dumps(list(payloads(10)))
+    lines = stream(body[:-1])
+    assert len(lines) == 11
+    assert all("Feedback" in line for line in lines[:10])
+    assert lines[-1]["Code"] == "invalid_batch"
+
+
+def test_malformed_item_is_reported_in_place():
+    items = [json.dumps(payload) for payload in payloads(5)]
+    items[2] = "{bad}"
+    lines = stream("[" + ",".join(items) + "]")
+    assert len(lines) == 5
+    assert lines[2]["Code"] == "invalid_json"
+    assert all("Feedback" in line for i, line in enumerate(lines) if i != 2)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64])
+def test_json_array_reader_across_chunks(chunk_size):
+    body = b'[{"a": "x]},{"}, 12, [1, [2]], {bad}, "s,\\"]", -3.5e2]'
+    items = list(app.iter_json_array(io.BytesIO(body), chunk_size))
+    assert isinstance(items[3], ValueError)
+    assert items[:3] + items[4:] == [{"a": "x]},{"}, 12, [1, [2]], 's,"]', -350.0]
+
+
+def test_json_array_reader_rejects_an_incomplete_array():
+    items = app.iter_json_array(io.BytesIO(b'[{"a": 1}, {"b": 2}, {"c"'), 4)
+    assert next(items) == {"a": 1}
+    assert next(items) == {"b": 2}
+    with pytest.raises(ValueError, match="incomplete"):
+        next(items)
@@ -0,0 +1,57 @@
+import pytest
+
+import app
+
+
+@pytest.fixture(scope="module")
+def quiz():
+    engine = app.BANK_REGISTRY.current().compiled.engine
+    questions = engine.question_ids[:app.N_QUESTIONS]
+    payload = {f"q{i + 1}": question for i, question in enumerate(questions)}
+    payload.update({f"a{i + 1}": 0 for i in range(len(questions))})
+    return payload
+
+
+def validate(payload):
+    return app.BANK_REGISTRY.current().compiled.validator.validate(payload)
+
+
+def test_valid_payload(quiz):
+    questions, answers, rows = validate(quiz)
+    assert questions == [quiz[f"q{i + 1}"] for i in range(len(questions))]
+    assert answers == [0] * len(questions)
+
+
+@pytest.mark.parametrize("change, code, field", [
+    ({"q01": "MC1"}, "invalid_payload", "q01"),
+    ({"a0": 1}, "invalid_payload", "a0"),
+    ({"q1": "NOPE"}, "unknown_question", "q1"),
+    ({"q2": "q1"}, "unknown_question", "q2"),
+    ({"a1": 99}, "answer_out_of_range", "a1"),
+    ({"a1": -1}, "answer_out_of_range", "a1"),
+    ({"a1": 1.0}, "invalid_answer", "a1"),
+    ({"a1": True}, "invalid_answer", "a1"),
+    ({"a1": None}, "missing_field", "a1"),
+    ({"q99": "MC1", "a99": 0}, "missing_field", None),
+])
+def test_error_codes(quiz, change, code, field):
+    payload = {key: value for key, value in {**quiz, **change}.items() if value is not None}
+    with pytest.raises(app.SubmissionError) as error:
+        validate(payload)
+    assert error.value.code == code
+    if field is not None:
+        assert error.value.field == field
+
+
+def test_duplicate_question(quiz):
+    with pytest.raises(app.SubmissionError) as error:
+        validate({**quiz, "q2": quiz["q1"]})
+    assert (error.value.code, error.value.field) == ("duplicate_question", "q2")
+
+
+@pytest.mark.parametrize("payload, code", [(ValueError("bad"), "invalid_json"), ([], "invalid_payload"),
+                                           ({}, "missing_field")])
+def test_payload_errors(payload, code):
+    with pytest.raises(app.SubmissionError) as error:
+        validate(payload)
+    assert error.value.code == code
@@ -0,0 +1,101 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import app
+import wire
+
+
+@pytest.fixture(scope="module")
+def table():
+    client = app.app.test_client()
+    document = client.get("/phrase_table").get_json()
+    return document, bytes.fromhex(document["Version"])
+
+
+def submissions(document, n):
+    questions = list(range(app.N_QUESTIONS))
+    return [(questions, [i % 2] * len(questions), i) for i in range(n)]
+
+
+def json_payload(document, submission):
+    questions, answers, seed = submission
+    payload = {f"q{i + 1}": document["Questions"][q] for i, q in enumerate(questions)}
+    payload.update({f"a{i + 1}": answer for i, answer in enumerate(answers)}, seed=seed)
+    return payload
+
+
+@pytest.mark.parametrize("stream", ["0", "1"])
+def test_round_trip_matches_json(table, stream):
+    document, tag = table
+    quizzes = submissions(document, 20)
+    client = app.app.test_client()
+    response = client.post(f"/quiz_feedback/batch?stream={stream}", data=wire.encode_submissions(tag, quizzes),
+                           content_type=wire.SUBMISSION_TYPE)
+    assert response.mimetype == wire.FEEDBACK_TYPE
+    records = wire.decode_feedback(response.get_data(), len(app.learning_outcomes), tag)
+
+    expected = client.post("/quiz_feedback/batch", json=[json_payload(document, quiz) for quiz in quizzes]).get_json()
+    assert len(records) == len(expected)
+    for record, result in zip(records, expected):
+        assert record["code"] == 0
+        assert wire.expand(document, record) == (result["Feedback"], result["Suggested Page"])
+
+
+def test_truncated_body_reports_the_last_record(table):
+    document, tag = table
+    body = wire.encode_submissions(tag, submissions(document, 3))
+    response = app.app.test_client().post("/quiz_feedback/batch?stream=1", data=body[:-1],
+                                          content_type=wire.SUBMISSION_TYPE)
+    records = wire.decode_feedback(response.get_data(), len(app.learning_outcomes), tag)
+    assert [wire.ERROR_CODES[code] for code in records["code"]] == ["", "", "invalid_payload"]
+
+
+def test_stale_table_is_a_known_code(table):
+    document, tag = table
+    body = wire.encode_submissions(bytes(wire.TAG_SIZE), submissions(document, 1))
+    result = app.app.test_client().post("/quiz_feedback/batch", data=body, content_type=wire.SUBMISSION_TYPE)
+    assert result.get_json()["Code"] == "stale_table"
+    assert "stale_table" in wire.ERROR_CODES
+
+
+def test_stream_keeps_records_read_before_a_failure(table):
+    document, tag = table
+    compiled_bank = app.BANK_REGISTRY.current().compiled
+    body = wire.encode_submissions(tag, submissions(document, 5))
+    records = list(app.wire_table(compiled_bank).read_submissions((body,)))
+
+    def failing():
+        yield from records[:3]
+        raise ConnectionError("The client went away")
+
+    output = b"".join(app.stream_wire_quiz_feedback(failing(), compiled_bank, batch_size=4))
+    decoded = wire.decode_feedback(output, len(app.learning_outcomes), tag)
+    assert [wire.ERROR_CODES[code] for code in decoded["code"]] == ["", "", "", "internal_error"]
+    assert np.array_equal(decoded["scores"][:3], wire.decode_feedback(
+        b"".join(app.stream_wire_quiz_feedback(iter(records[:3]), compiled_bank)),
+        len(app.learning_outcomes), tag)["scores"])
+
+
+def large_engine(n_questions):
+    question_ids = [f"Q{i}" for i in range(n_questions)]
+    return SimpleNamespace(question_ids=question_ids, offsets={q: 3 * i for i, q in enumerate(question_ids)},
+                           n_answers={q: 3 for q in question_ids}, matrix=np.zeros((3 * n_questions, 6)))
+
+
+def test_question_indices_past_a_byte():
+    table = wire.WireTable(large_engine(300), app.PHRASE_TABLES, app.N_QUESTIONS)
+    body = wire.encode_submissions(table.tag, [([299, 0, 256], [2, 1, 0])])
+    record, = table.read_submissions((body,))
+    assert record.questions == ["Q299", "Q0", "Q256"]
+    assert record.rows == [3 * 299 + 2, 1, 3 * 256]
+
+    body = wire.encode_submissions(table.tag, [([299], [3])])
+    error, = table.read_submissions((body,))
+    assert error.code == "answer_out_of_range"
+
+
+def test_too_many_questions_for_the_format():
+    with pytest.raises(ValueError, match="at most 65536 questions"):
+        wire.WireTable(large_engine(wire.MAX_QUESTIONS + 1), app.PHRASE_TABLES, app.N_QUESTIONS)
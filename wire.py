@@ -0,0 +1,289 @@
+"""
+Compact binary wire format for quiz submissions and feedback.
+
+A binary request has the content type application/x-quiz-submission, and its body is a header followed by any number
+of submission records:
+    header      magic b"NW", format version (u8), table tag (4 bytes)
+    record      number of questions (u8), flags (u8), then
+                    seed (u64)                      if flags & HAS_SEED
+                    cohort length (u8), UTF-8 text  if flags & HAS_COHORT
+                question index (u16), answer index (u8)  for each question
+A SUBMISSION_SEED flag seeds the phrase choices from the answers, like {"seed": "submission"} in JSON.
+
+The response, application/x-quiz-feedback, is the same header followed by one fixed size record per submission, in
+order: an error code (0 for success), the learning outcome ranks from best to worst, one phrase ID per part of the
+feedback, and the score vector.  Records read straight into a NumPy array with feedback_dtype.  The reading's phrase ID
+is its index in the table's Readings, which also names the suggested page.
+
+Question indices, phrase IDs and error codes all refer to the phrase table served at /phrase_table, which is
+identified by its tag.  The tag changes whenever the question bank or any phrase does, and a request with another
+tag is refused, so a client never reads one table's IDs with another.  `expand` turns a record back into the text
+/quiz_feedback returns.  Question indices are u16, so a bank served in this format has at most 65536 questions.
+
+A streamed response whose request body can't be read to the end finishes with one extra record, holding only the
+error code that stopped it, after the records of every submission read before then.
+"""
+
+import json
+import struct
+from collections import namedtuple
+from hashlib import blake2b
+
+import numpy as np
+
+SUBMISSION_TYPE = "application/x-quiz-submission"
+FEEDBACK_TYPE = "application/x-quiz-feedback"
+
+MAGIC = b"NW"
+# Format 1 had u8 question indices, and format 2 indexed readings per learning outcome
+FORMAT_VERSION = 3
+TAG_SIZE = 4
+# magic, format version, table tag
+HEADER = struct.Struct(f"<2sB{TAG_SIZE}s")
+# number of questions, flags
+RECORD = struct.Struct("<BB")
+SEED = struct.Struct("<Q")
+# question index, answer index
+QUESTION = struct.Struct("<HB")
+MAX_QUESTIONS = 1 << 16
+
+HAS_SEED = 1
+SUBMISSION_SEED = 2
+HAS_COHORT = 4
+KNOWN_FLAGS = HAS_SEED | SUBMISSION_SEED | HAS_COHORT
+
+# Index 0 is success.  New codes are only ever appended, so a code's ID never changes
+ERROR_CODES = ("", "invalid_payload", "invalid_seed", "invalid_cohort", "missing_field", "too_many_questions",
+               "unknown_question", "duplicate_question", "answer_out_of_range", "internal_error", "stale_table")
+ERROR_CODE_IDS = {code: i for i, code in enumerate(ERROR_CODES)}
+
+# The parts of the feedback a phrase is chosen for, in the order of the phrase IDs in a record
+PHRASES = ("intro", "first_positive", "second_positive", "improvement_intro", "weakness", "advice", "reading")
+
+SubmissionRecord = namedtuple("SubmissionRecord", ["questions", "answers", "rows", "seed", "cohort"])
+
+
+class WireFormatError(ValueError):
+    """
+    A body or record that can't be decoded.  code is one of ERROR_CODES.
+    """
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def feedback_dtype(n_outcomes):
+    return np.dtype([("code", "u1"), ("ranks", "u1", (n_outcomes,)), ("phrases", "u1", (len(PHRASES),)),
+                     ("scores", "<i4", (n_outcomes,))])
+
+
+class WireTable():
+    """
+    The question indices and phrase tables binary clients use for one compiled bank, and the tag identifying them.
+    """
+    def __init__(self, engine, phrase_tables: dict, max_questions):
+        self.question_ids = engine.question_ids
+        if len(self.question_ids) > MAX_QUESTIONS:
+            raise ValueError(f"The binary format can index at most {MAX_QUESTIONS} questions, the bank has "
+                             f"{len(self.question_ids)}.")
+        self.n_answers = [engine.n_answers[q] for q in self.question_ids]
+        self.max_questions = max_questions
+        # The scoring matrix row of answer a to question index i is row_start[i] + a, for a < n_answers[i].  Records are
+        # a few questions each, which are looked up faster in a list than by NumPy indexing
+        self.row_start = np.asarray([engine.offsets[q] for q in self.question_ids], dtype=np.int64)
+        self._row_start = self.row_start.tolist()
+        self.dtype = feedback_dtype(engine.matrix.shape[1])
+
+        # Phrase IDs are draws scaled by the number of options, which for most parts depends on an outcome
+        self.n_intros = len(phrase_tables["Intros"])
+        self.n_improvement_intros = len(phrase_tables["Improvement Intros"])
+        self.n_titles = np.asarray([len(titles) for titles in phrase_tables["Titles"]])
+        self.n_advice = np.asarray([len(advice) for advice in phrase_tables["Advice"]])
+        # Readings are chosen from the ones for the weakest outcome and the suggested page, padded to the most
+        # choices any pair has
+        reading_choices = phrase_tables["Reading Choices"]
+        self.n_reading = np.asarray([[len(choices) for choices in by_page] for by_page in reading_choices])
+        self.reading_choices = np.zeros(self.n_reading.shape + (int(self.n_reading.max()),), dtype=np.uint8)
+        for outcome, by_page in enumerate(reading_choices):
+            for page, choices in enumerate(by_page):
+                self.reading_choices[outcome, page, :len(choices)] = choices
+
+        document = {"Format": FORMAT_VERSION, "Questions": list(self.question_ids), "Answer Counts": self.n_answers,
+                    "Phrases": list(PHRASES), "Error Codes": list(ERROR_CODES), **phrase_tables}
+        content = json.dumps(document, sort_keys=True).encode()
+        self.tag = blake2b(content, digest_size=TAG_SIZE).digest()
+        self.version = self.tag.hex()
+        self.document = {"Version": self.version, **document}
+        self.header = HEADER.pack(MAGIC, FORMAT_VERSION, self.tag)
+
+    def read_submissions(self, chunks):
+        """
+        Checks the header at the start of chunks, an iterable of bytes, and returns a generator of the records after
+        it, decoded as they arrive.  Each is a SubmissionRecord, or the WireFormatError it failed with.
+        """
+        chunks = iter(chunks)
+        buffer = bytearray()
+        while len(buffer) < HEADER.size:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise WireFormatError("invalid_payload", "The body is shorter than the header.")
+            buffer += chunk
+        magic, version, tag = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise WireFormatError("invalid_payload", f"Expected a format {FORMAT_VERSION} {SUBMISSION_TYPE} body.")
+        if tag != self.tag:
+            raise WireFormatError("stale_table", f"The body is for phrase table {tag.hex()}, the current one is "
+                                                 f"{self.version}.  Fetch /phrase_table again.")
+        del buffer[:HEADER.size]
+        return self._records(buffer, chunks)
+
+    def _records(self, buffer, chunks):
+        position = 0
+        while True:
+            end = self._record_end(buffer, position)
+            if end is None:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    if position < len(buffer):
+                        yield WireFormatError("invalid_payload", "The last record is incomplete.")
+                    return
+                del buffer[:position]
+                position = 0
+                buffer += chunk
+                continue
+            try:
+                yield self._decode(buffer, position, end)
+            except WireFormatError as e:
+                yield e
+            position = end
+
+    @staticmethod
+    def _record_end(buffer, position):
+        # Where the record starting at position ends, or None if it isn't all in buffer yet
+        if len(buffer) < position + RECORD.size:
+            return None
+        n_questions, flags = RECORD.unpack_from(buffer, position)
+        end = position + RECORD.size
+        if flags & HAS_SEED:
+            end += SEED.size
+        if flags & HAS_COHORT:
+            if len(buffer) <= end:
+                return None
+            end += 1 + buffer[end]
+        end += QUESTION.size * n_questions
+        return end if end <= len(buffer) else None
+
+    def _decode(self, buffer, position, end):
+        n_questions, flags = RECORD.unpack_from(buffer, position)
+        position += RECORD.size
+        if flags & ~KNOWN_FLAGS:
+            raise WireFormatError("invalid_payload", f"Unknown record flags: {flags}.")
+
+        seed = None
+        if flags & HAS_SEED:
+            if flags & SUBMISSION_SEED:
+                raise WireFormatError("invalid_seed", "A record can't have both a seed and the submission seed flag.")
+            seed, = SEED.unpack_from(buffer, position)
+            position += SEED.size
+        elif flags & SUBMISSION_SEED:
+            seed = "submission"
+
+        cohort = ""
+        if flags & HAS_COHORT:
+            length = buffer[position]
+            try:
+                cohort = bytes(buffer[position + 1:position + 1 + length]).decode()
+            except UnicodeDecodeError:
+                raise WireFormatError("invalid_cohort", "The cohort should be UTF-8 text.")
+            position += 1 + length
+
+        if n_questions == 0:
+            raise WireFormatError("missing_field", "A record should have at least one question.")
+        if n_questions > self.max_questions:
+            raise WireFormatError("too_many_questions", f"A quiz can have at most {self.max_questions} questions, "
+                                                        f"this one has {n_questions}.")
+        indices, answers = zip(*QUESTION.iter_unpack(buffer[position:end]))
+        if max(indices) >= len(self.question_ids):
+            raise WireFormatError("unknown_question", f"Question index {max(indices)} is not in the phrase table.")
+        if len(set(indices)) != n_questions:
+            raise WireFormatError("duplicate_question", "The quiz asks the same question twice.")
+        n_answers = self.n_answers
+        for index, answer in zip(indices, answers):
+            if answer >= n_answers[index]:
+                raise WireFormatError("answer_out_of_range", f"For question {self.question_ids[index]}, the answer "
+                                                             f"{answer} is not valid.")
+        row_start = self._row_start
+        rows = [row_start[index] + answer for index, answer in zip(indices, answers)]
+        return SubmissionRecord([self.question_ids[index] for index in indices], list(answers), rows, seed, cohort)
+
+    def error_record(self, code):
+        """
+        A feedback record holding only an error code.
+        """
+        record = np.zeros(1, dtype=self.dtype)
+        record["code"] = ERROR_CODE_IDS[code]
+        return record.tobytes()
+
+    def phrase_ids(self, ranks, draws, pages):
+        """
+        The phrase IDs for quizzes with these (n, n_outcomes) ranks, (n, len(PHRASES)) draws and suggested pages,
+        chosen as Feedback chooses them.
+        """
+        best, second, worst = ranks[:, 0], ranks[:, 1], ranks[:, -1]
+        pages = np.asarray(pages, dtype=np.intp)
+        counts = np.column_stack((np.full(len(ranks), self.n_intros), self.n_titles[best], self.n_titles[second],
+                                  np.full(len(ranks), self.n_improvement_intros), self.n_titles[worst],
+                                  self.n_advice[worst], self.n_reading[worst, pages]))
+        ids = (np.asarray(draws) * counts).astype(np.uint8)
+        # The reading is sent as its index in Readings
+        ids[:, -1] = self.reading_choices[worst, pages, ids[:, -1]]
+        return ids
+
+
+def encode_submissions(tag, submissions):
+    """
+    Encodes a request body.  submissions are (question indices, answer indices) pairs, optionally followed by a seed
+    (an integer, or "submission") and a cohort.
+    """
+    parts = [HEADER.pack(MAGIC, FORMAT_VERSION, tag)]
+    for questions, answers, *options in submissions:
+        seed = options[0] if options else None
+        cohort = options[1].encode() if len(options) > 1 and options[1] else b""
+        flags = (HAS_SEED if type(seed) is int else 0) | (SUBMISSION_SEED if seed == "submission" else 0) | \
+            (HAS_COHORT if cohort else 0)
+        parts.append(RECORD.pack(len(questions), flags))
+        if flags & HAS_SEED:
+            parts.append(SEED.pack(seed))
+        if cohort:
+            parts.append(bytes((len(cohort),)) + cohort)
+        parts.extend(QUESTION.pack(question, answer) for question, answer in zip(questions, answers))
+    return b"".join(parts)
+
+
+def decode_feedback(data, n_outcomes, tag=None):
+    """
+    The records of a response body as a structured array.  Raises WireFormatError if the header doesn't match tag.
+    """
+    magic, version, body_tag = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION or (tag is not None and body_tag != tag):
+        raise WireFormatError("invalid_payload", f"Expected a format {FORMAT_VERSION} {FEEDBACK_TYPE} body.")
+    return np.frombuffer(data, dtype=feedback_dtype(n_outcomes), offset=HEADER.size)
+
+
+def expand(document, record):
+    """
+    The (feedback, suggested page) text of one feedback record, from a /phrase_table document.
+    """
+    ranks = record["ranks"].tolist()
+    intro, first, second, improvement_intro, weakness, advice, reading = record["phrases"].tolist()
+    improvement_intro = document["Improvement Intros"][improvement_intro]
+    weakness = document["Titles"][ranks[-1]][weakness]
+    if type(improvement_intro) is not str:
+        improvement = (improvement_intro[0], " ", weakness, " ", improvement_intro[1])
+    else:
+        improvement = (improvement_intro, " ", weakness)
+    page, text = document["Readings"][reading]
+    output = "".join((document["Intros"][intro], " ", document["Titles"][ranks[0]][first], " and ",
+                      document["Titles"][ranks[1]][second], ".  ", *improvement, ". ",
+                      document["Advice"][ranks[-1]][advice], "\n", text))
+    return output, page